@@ -1,93 +1,127 @@
 from __future__ import absolute_import
 from __future__ import unicode_literals
 # Import flask and template operators
-from flask import Flask, render_template, request
+from flask import Flask, render_template
 
 # Import SQLAlchemy
-from flask.ext.sqlalchemy import SQLAlchemy
+from .database import SQLAlchemy
 
-# Define the WSGI application object
-app = Flask(__name__)
+# Extensions, bound to the application by create_app(). They are imported
+# by the views to register their handlers. The extensions instrumenting the
+# application (metrics, tracing, profiling, compression...) are imported from
+# their modules only by create_app(), to keep importing the package fast
 
-# Configurations
-app.config.from_object('config.default')
-
-# Define the database object which is imported
-# by modules and controllers
-db = SQLAlchemy(app)
+# Define the database object
+db = SQLAlchemy()
 
 # Authentication
-# from .auth import AuthProvider
-# auth = AuthProvider(app)
-
 from flask_oauthlib.provider import OAuth2Provider
-oauth = OAuth2Provider(app)
+oauth = OAuth2Provider()
 
 # CSRF protection for forms
 from flask.ext.wtf.csrf import CsrfProtect
-
 csrf = CsrfProtect()
-csrf.init_app(app)
 
 # Login Manager
 from flask.ext.login import LoginManager
-from .auth.models import User
-
 login_manager = LoginManager()
-login_manager.init_app(app)
-login_manager.login_view = "login"
-
-
-# Tell the login manager how to find the user
-@login_manager.user_loader
-def load_user(userid):
-    return User.query.filter_by(username=userid).first()
-
+login_manager.login_view = "auth.login"
 
 # Rest API
 from .restful import Api
-api = Api(app, oauth)
-
-# Configure logging
-import logging
-from logging.handlers import TimedRotatingFileHandler
-from logging import Formatter
-
-# Configure the application log
-if app.config.get('APPLICATION_LOG', None):
-    application_log_handler = TimedRotatingFileHandler(app.config.get('APPLICATION_LOG'), 'd', 7)
-    application_log_handler.setLevel(logging.INFO)
-    application_log_handler.setFormatter(Formatter(
-        '%(asctime)s %(levelname)s: %(message)s '
-        '[in %(pathname)s:%(lineno)d]'
-    ))
-    app.logger.addHandler(application_log_handler)
-
-
-# Configure the access log if defined in the configuration
-if app.config.get('ACCESS_LOG', None):
-    access_log = logging.getLogger('access_log')
-    access_log_handler = TimedRotatingFileHandler(app.config.get('ACCESS_LOG'), 'd', 7)
-    access_log_handler.setLevel(logging.INFO)
-    access_log_handler.setFormatter(Formatter('%(asctime)s   %(message)s'))
-    access_log.addHandler(access_log_handler)
-
-    @app.before_request
-    def pre_request_logging():
-        # Log except when testing
-        if not app.config.get('TESTING'):
-            access_log.info('\t'.join([
-                request.remote_addr,
-                request.method,
-                request.url,
-                str(request.data)])
-            )
+api = Api()
+
+
+def configure_logging(app):
+    """Configure the application and access logs, if defined in the configuration"""
+    import logging
+    from logging.handlers import TimedRotatingFileHandler
+    from logging import Formatter
+    from .logs import queue_logging
+
+    # Log files are written by a background thread
+    queue_logging.init_app(app)
+
+    # Configure the application log
+    if app.config.get('APPLICATION_LOG', None):
+        application_log_handler = TimedRotatingFileHandler(app.config.get('APPLICATION_LOG'), 'd', 7)
+        application_log_handler.setLevel(logging.INFO)
+        application_log_handler.setFormatter(Formatter(
+            '%(asctime)s %(levelname)s: %(message)s '
+            '[in %(pathname)s:%(lineno)d]'
+        ))
+        queue_logging.add_handler(app.logger, application_log_handler)
+
+    # Configure the access log
+    if app.config.get('ACCESS_LOG', None):
+        access_log = logging.getLogger('access_log')
+        access_log.setLevel(logging.INFO)
+        access_log_handler = TimedRotatingFileHandler(app.config.get('ACCESS_LOG'), 'd', 7)
+        access_log_handler.setLevel(logging.INFO)
+        access_log_handler.setFormatter(Formatter('%(message)s'))
+        queue_logging.add_handler(access_log, access_log_handler)
+
+        from .access_log import AccessLog
+        AccessLog(app, access_log)
 
 
 # Sample HTTP error handling
-@app.errorhandler(404)
 def not_found(error):
     return render_template('404.html'), 404
 
-# Import modules
-from app.auth import views as auth_views
+
+def create_app(config='config.default'):
+    """Create the WSGI application object with the given configuration
+    (an object or its import path)"""
+    app = Flask(__name__)
+
+    # Configurations
+    app.config.from_object(config)
+
+    # Tracing of the phases of requests
+    from .tracing import tracer
+    # Request metrics, exposed in the /internal/metrics endpoint
+    from .metrics import metrics
+    # Connection pool instrumentation
+    from .pool import pool_monitor
+    # SQL statements per request
+    from .query_stats import query_stats
+    # Admission control for API and OAuth endpoints
+    from .admission import admission
+    # Profiling of requests on demand
+    from .profiling import profiler
+    # Memory allocation profiling (see the /internal/memory endpoints)
+    from .memory import memory
+    # Response compression
+    from .cache.compress import compress
+    # Warmup before accepting requests (see the /internal/ready endpoint)
+    from .warmup import warmup
+
+    db.init_app(app)
+    tracer.init_app(app)
+    metrics.init_app(app)
+    pool_monitor.init_app(app, db)
+    query_stats.init_app(app, db)
+    oauth.init_app(app)
+    csrf.init_app(app)
+    login_manager.init_app(app)
+    admission.init_app(app)
+    api.init_app(app, oauth)
+    api.batch('/v1/batch')
+    profiler.init_app(app, oauth)
+    memory.init_app(app)
+    compress.init_app(app)
+    warmup.init_app(app, db)
+    configure_logging(app)
+
+    # Import the views only when creating the application
+    from .auth.views import auth
+    app.register_blueprint(auth)
+
+    # Internal endpoints
+    from .internal import internal
+    app.register_blueprint(internal)
+
+    app.register_error_handler(404, not_found)
+
+    return app
@@ -0,0 +1,172 @@
+from __future__ import absolute_import
+from __future__ import unicode_literals
+import json
+import random
+import time
+from datetime import datetime
+
+from flask import request
+
+
+class BodyRecorder(object):
+    """Input stream keeping the first limit bytes read from it"""
+
+    def __init__(self, stream, limit):
+        self.stream = stream
+        self.limit = limit
+        self.data = b''
+
+    def record(self, chunk):
+        if len(self.data) < self.limit:
+            self.data += chunk[:self.limit - len(self.data)]
+        return chunk
+
+    def read(self, *args):
+        return self.record(self.stream.read(*args))
+
+    def readline(self, *args):
+        return self.record(self.stream.readline(*args))
+
+    def readlines(self, *args):
+        return [self.record(line) for line in self.stream.readlines(*args)]
+
+    def __iter__(self):
+        for line in self.stream:
+            yield self.record(line)
+
+
+class AccessLog(object):
+    """Structured access log, one JSON object per response, written after the
+    request with its endpoint, status, latency (in milliseconds), response
+    size, the OAuth client, and the SQL statements count and time.
+
+    Successful (2xx) and not modified (304) responses are sampled with the
+    ACCESS_LOG_SAMPLE_RATE probability, unless slower than ACCESS_LOG_SLOW
+    seconds. Other responses are always logged. Each entry includes the sample
+    rate it was logged with, to weight the entries when aggregating. Requests
+    failing with an uncaught exception are logged when torn down, as 500
+    responses with the name of the exception.
+
+    With ACCESS_LOG_BODY, the first ACCESS_LOG_BODY bytes of the request body
+    are recorded as the application reads it, and read from the input stream
+    after the request when the application did not, so the body is never
+    read in memory for the log.
+    """
+
+    def __init__(self, app=None, logger=None):
+        self.logger = logger
+
+        if app and logger:
+            self.init_app(app, logger)
+
+    def init_app(self, app, logger):
+        self.app = app
+        self.logger = logger
+        app.config.setdefault('ACCESS_LOG_SAMPLE_RATE', 1.0)
+        app.config.setdefault('ACCESS_LOG_SLOW', 1.0)
+        app.config.setdefault('ACCESS_LOG_BODY', 0)
+
+        app.extensions['access_log'] = self
+
+        # Run before the other functions, which may read the body
+        app.before_request_funcs.setdefault(None, []).insert(0, self.before_request)
+        app.teardown_request(self.teardown_request)
+
+        # After request functions run in reverse order, run the last one to
+        # log the final response (e.g. compressed)
+        app.after_request_funcs.setdefault(None, []).insert(0, self.after_request)
+
+    def before_request(self):
+        request.start_time = time.time()
+
+        # Record the body as it is read, unless the input stream was already used
+        limit = self.app.config.get('ACCESS_LOG_BODY')
+        if limit and 'stream' not in request.__dict__:
+            request.body_recorder = BodyRecorder(request.environ['wsgi.input'], limit)
+            request.environ['wsgi.input'] = request.body_recorder
+
+    def sample_rate(self, status, latency):
+        """Probability of logging a response"""
+        if (200 <= status < 300 or status == 304) and latency < self.app.config.get('ACCESS_LOG_SLOW'):
+            return self.app.config.get('ACCESS_LOG_SAMPLE_RATE')
+
+        return 1.0
+
+    def client_id(self):
+        oauth = getattr(request, 'oauth', None)
+        client = getattr(oauth, 'client', None)
+        if client is not None:
+            return client.client_id
+
+        # Token requests
+        return request.values.get('client_id', None)
+
+    def body(self, limit):
+        """The first limit bytes of the request body"""
+        recorder = getattr(request, 'body_recorder', None)
+        if recorder is None:
+            return request.stream.read(limit)
+
+        # The part the application did not read
+        if len(recorder.data) < limit:
+            request.stream.read(limit - len(recorder.data))
+
+        return recorder.data[:limit]
+
+    def entry(self, response, latency, sample_rate, error=None):
+        """Log entry of the response, or of an uncaught exception (error)
+        when response is None"""
+        entry = dict(
+            time=datetime.utcnow().isoformat() + 'Z',
+            remote_addr=request.remote_addr,
+            method=request.method,
+            path=request.path,
+            endpoint=request.endpoint,
+            status=response.status_code if response is not None else 500,
+            not_modified=response is not None and response.status_code == 304,
+            latency=round(latency * 1000, 3),
+            bytes=response.calculate_content_length() if response is not None else None,
+            client_id=self.client_id(),
+            sample_rate=sample_rate
+        )
+
+        if error is not None:
+            entry['error'] = type(error).__name__
+
+        queries = getattr(request, 'queries', None)
+        if queries is not None:
+            entry['sql_count'] = queries.count
+            entry['sql_time'] = round(queries.time * 1000, 3)
+
+        # Only the first ACCESS_LOG_BODY bytes of the body, if enabled
+        limit = self.app.config.get('ACCESS_LOG_BODY')
+        if limit:
+            entry['body'] = self.body(limit).decode('utf-8', 'replace')
+
+        return entry
+
+    def after_request(self, response):
+        start = getattr(request, 'start_time', None)
+
+        # Log except when testing
+        if start is None or self.app.config.get('TESTING'):
+            return response
+
+        request.access_logged = True
+        latency = time.time() - start
+        sample_rate = self.sample_rate(response.status_code, latency)
+        if sample_rate >= 1.0 or random.random() < sample_rate:
+            self.logger.info(json.dumps(self.entry(response, latency, sample_rate), sort_keys=True))
+
+        return response
+
+    def teardown_request(self, exc=None):
+        start = getattr(request, 'start_time', None)
+
+        # Uncaught exceptions skip the after request functions
+        if exc is None or start is None or getattr(request, 'access_logged', False) or \
+                self.app.config.get('TESTING'):
+            return
+
+        latency = time.time() - start
+        self.logger.info(json.dumps(self.entry(None, latency, 1.0, exc), sort_keys=True))
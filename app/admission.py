@@ -0,0 +1,226 @@
+from __future__ import absolute_import
+from __future__ import unicode_literals
+import functools
+import heapq
+import itertools
+import threading
+import weakref
+from contextlib import contextmanager
+
+from flask import current_app, request, json, make_response
+
+from .http_errors import ServiceUnavailable, TooManyRequests
+
+# Request priorities, lower values are admitted first. Priorities only order
+# the requests waiting for the same endpoint class (see AdmissionControl)
+PRIORITY_CONDITIONAL = 0
+PRIORITY_READ = 1
+PRIORITY_WRITE = 2
+PRIORITY_EXPENSIVE = 3
+
+
+class Limiter(object):
+    """Limits the number of requests of an endpoint class in execution.
+
+    Requests over max_in_flight wait in a queue of at most max_queue requests,
+    ordered by priority, for at most timeout seconds. When the queue is full,
+    a new request displaces the waiting request with the lowest priority if
+    it has a higher priority, otherwise it is rejected.
+    """
+
+    class Waiter(object):
+        def __init__(self):
+            self.event = threading.Event()
+            self.admitted = False
+
+    def __init__(self, max_in_flight, max_queue=0, timeout=None):
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.timeout = timeout
+
+        self.in_flight = 0
+        self.admitted = 0
+        self.rejected = 0
+
+        self._waiting = []
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+
+    @property
+    def queued(self):
+        return len(self._waiting)
+
+    def acquire(self, priority=PRIORITY_READ):
+        """Wait for the request to be admitted. Returns False if the
+        request was rejected"""
+        with self._lock:
+            if self.in_flight < self.max_in_flight and not self._waiting:
+                self.in_flight += 1
+                self.admitted += 1
+                return True
+
+            if len(self._waiting) >= self.max_queue:
+                worst = max(self._waiting) if self._waiting else None
+                if worst is None or worst[0] <= priority:
+                    self.rejected += 1
+                    return False
+
+                # Shed the least important waiting request
+                self._remove(worst)
+                worst[2].event.set()
+                self.rejected += 1
+
+            entry = [priority, next(self._counter), Limiter.Waiter()]
+            heapq.heappush(self._waiting, entry)
+
+        waiter = entry[2]
+        waiter.event.wait(self.timeout)
+
+        with self._lock:
+            if not waiter.event.is_set():
+                # Timed out
+                self._remove(entry)
+                self.rejected += 1
+
+            return waiter.admitted
+
+    def release(self):
+        with self._lock:
+            if self._waiting:
+                # Hand the slot over to the next waiting request
+                waiter = heapq.heappop(self._waiting)[2]
+                waiter.admitted = True
+                waiter.event.set()
+                self.admitted += 1
+            else:
+                self.in_flight -= 1
+
+    def _remove(self, entry):
+        self._waiting.remove(entry)
+        heapq.heapify(self._waiting)
+
+    def stats(self):
+        return dict(in_flight=self.in_flight, queued=self.queued,
+                    admitted=self.admitted, rejected=self.rejected)
+
+
+def resource_class(request):
+    """Endpoint class and priority of a request to an API resource.
+    Conditional GET requests are the cheapest to serve, since they
+    usually end with a 304 response, and are admitted before the other
+    reads. Writes have a class of their own, with a single priority"""
+    if request.method in ('GET', 'HEAD'):
+        if request.if_none_match:
+            return 'read', PRIORITY_CONDITIONAL
+        return 'read', PRIORITY_READ
+
+    return 'write', PRIORITY_WRITE
+
+
+def oauth_class(request):
+    """Endpoint class and priority of a request to the OAuth endpoints.
+    Password grants are the most expensive since they verify the password hash,
+    the other grants (e.g. refresh tokens) are admitted first"""
+    if request.values.get('grant_type', None) == 'password':
+        return 'oauth', PRIORITY_EXPENSIVE
+
+    return 'oauth', PRIORITY_WRITE
+
+
+class AdmissionControl(object):
+    """Limits the requests in execution per endpoint class, rejecting requests
+    with a 503 (or 429) response and a Retry-After header when saturated.
+
+    Limits for every endpoint class are given in the ADMISSION_LIMITS
+    configuration. Classes without limits are not controlled. Every class has
+    a limiter of its own, so the classes do not compete with each other: a
+    saturated class does not delay the requests of the others, and the
+    priorities only order the requests waiting in the queue of one class.
+    """
+
+    def __init__(self, app=None):
+        self._limiters = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+        if app:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('ADMISSION_CONTROL', True)
+        app.config.setdefault('ADMISSION_LIMITS', {})
+        app.config.setdefault('ADMISSION_QUEUE_TIMEOUT', 1.0)
+        app.config.setdefault('ADMISSION_RETRY_AFTER', 1)
+        app.config.setdefault('ADMISSION_REJECT_STATUS', ServiceUnavailable.status)
+
+        app.extensions['admission'] = self
+        app.errorhandler(ServiceUnavailable)(self.handle_rejection)
+        app.errorhandler(TooManyRequests)(self.handle_rejection)
+
+    @property
+    def limiters(self):
+        """The limiters of the current application, by endpoint class"""
+        with self._lock:
+            return self._limiters.setdefault(current_app._get_current_object(), dict())
+
+    def limiter(self, name):
+        """Get the limiter for the endpoint class, created from the configuration"""
+        limiters = self.limiters
+        limiter = limiters.get(name, None)
+        if limiter is None:
+            limits = current_app.config.get('ADMISSION_LIMITS').get(name, None)
+            if limits is None:
+                return None
+
+            with self._lock:
+                limiter = limiters.setdefault(name, Limiter(
+                    limits.get('max_in_flight'),
+                    limits.get('max_queue', 0),
+                    limits.get('timeout', current_app.config.get('ADMISSION_QUEUE_TIMEOUT'))))
+
+        return limiter
+
+    @contextmanager
+    def limit(self, name, priority=PRIORITY_READ):
+        """Run the block only if the request is admitted for the endpoint class,
+        otherwise raise ServiceUnavailable or TooManyRequests"""
+        limiter = self.limiter(name) if current_app.config.get('ADMISSION_CONTROL') else None
+        if limiter is None:
+            yield
+            return
+
+        if not limiter.acquire(priority):
+            if current_app.config.get('ADMISSION_REJECT_STATUS') == TooManyRequests.status:
+                raise TooManyRequests
+            raise ServiceUnavailable
+
+        try:
+            yield
+        finally:
+            limiter.release()
+
+    def limited(self, classify):
+        """Decorator to apply admission control to a view. The classify function
+        receives the request and returns the endpoint class and priority"""
+        def decorator(view):
+            @functools.wraps(view)
+            def wrapper(*args, **kwargs):
+                with self.limit(*classify(request)):
+                    return view(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def handle_rejection(self, err):
+        response = make_response(json.dumps({'error': err.args[0]}), err.status, {
+            'Content-Type': 'application/json'
+        })
+        response.headers['Retry-After'] = str(current_app.config.get('ADMISSION_RETRY_AFTER'))
+
+        return response
+
+    def stats(self):
+        return dict((name, limiter.stats()) for name, limiter in self.limiters.items())
+
+
+admission = AdmissionControl()
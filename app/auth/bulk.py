@@ -0,0 +1,134 @@
+from __future__ import absolute_import
+from __future__ import unicode_literals
+import atexit
+import multiprocessing
+import os
+import time
+
+from app import db
+from app.util import now, uuid, chunks
+from .models import User, UserDetails, compute_password_hash, hash_password, password_hashing
+
+# The processes of the pool are started from a new interpreter where possible
+# (Python 3): forking a process running threads (i.e. a server) could copy
+# locks held by the other threads into the children, which would deadlock
+_context = multiprocessing.get_context('spawn') if hasattr(multiprocessing, 'get_context') else multiprocessing
+
+# Process pool for password hashing, created on first use, by its size and
+# the process that created it
+_pool = None
+_pool_key = None
+
+
+def _get_pool(processes):
+    """Get the pool of the given size (by default the number of CPUs).
+
+    The pool is recreated when the size changes, and in forked processes (i.e.
+    server workers), which cannot use the processes of the parent's pool"""
+    global _pool, _pool_key
+    key = (processes or multiprocessing.cpu_count(), os.getpid())
+    if _pool is not None and _pool_key == key:
+        return _pool
+
+    if _pool is not None and _pool_key[1] == key[1]:
+        _pool.terminate()
+
+    _pool = _context.Pool(key[0])
+    _pool_key = key
+    return _pool
+
+
+def _terminate_pool():
+    # Only the pool created by this process
+    if _pool is not None and _pool_key[1] == os.getpid():
+        _pool.terminate()
+
+
+atexit.register(_terminate_pool)
+
+
+def _timed_hash(password):
+    # Run by the processes of the pool, which return the time to the parent,
+    # as their metrics are not exposed
+    start = time.time()
+    value = compute_password_hash(password)
+    return value, time.time() - start
+
+
+def hash_passwords(passwords, processes=None):
+    """Hash a list of passwords, keeping the order of the list.
+
+    Hashing is CPU bound, so when processes is None or greater than one
+    the passwords are hashed in parallel using a process pool of the given
+    size (by default the number of CPUs)."""
+    if (processes is not None and processes <= 1) or len(passwords) <= 1:
+        return [hash_password(p) for p in passwords]
+
+    results = _get_pool(processes).map(_timed_hash, passwords)
+    for value, elapsed in results:
+        password_hashing.observe(elapsed, operation='hash')
+
+    return [value for value, elapsed in results]
+
+
+def insert_users(rows):
+    """Insert users with their details using bulk operations.
+
+    Each row is a dict with the user fields (email, username, password) and
+    the details fields (name, url, bio, born, gender). Passwords must already
+    be hashed. The session is not committed, and the list of usernames of the
+    new users is returned, in the same order as the rows"""
+    timestamp = now()
+
+    users = []
+    for row in rows:
+        users.append(dict(
+            username=row.get('username', None) or uuid(),
+            email=row.get('email', None),
+            _password=row.get('password', None),
+            is_admin=row.get('is_admin', False),
+            created=timestamp,
+            modified=timestamp
+        ))
+    db.session.bulk_insert_mappings(User, users)
+
+    # Users are identified by username to recover the generated ids
+    usernames = [u['username'] for u in users]
+    ids = dict()
+    for chunk in chunks(usernames, 500):
+        ids.update(db.session.query(User.username, User.id).filter(User.username.in_(chunk)))
+
+    details = []
+    for user, row in zip(users, rows):
+        details.append(dict(
+            user_id=ids[user['username']],
+            name=row.get('name', None),
+            url=row.get('url', None),
+            bio=row.get('bio', None),
+            born=row.get('born', None),
+            gender=row.get('gender', None),
+            created=timestamp,
+            modified=timestamp
+        ))
+    db.session.bulk_insert_mappings(UserDetails, details)
+
+    return usernames
+
+
+def load_users(usernames):
+    """Get a dict of the users with the given usernames"""
+    users = dict()
+    for chunk in chunks(usernames, 500):
+        for user in User.query.filter(User.username.in_(chunk)):
+            users[user.username] = user
+
+    return users
+
+
+def existing_emails(emails):
+    """Get the set of emails already registered"""
+    existing = set()
+    for chunk in chunks(emails, 500):
+        existing.update(email for email, in db.session.query(User.email).filter(User.email.in_(chunk)))
+
+    return existing
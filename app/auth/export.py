@@ -0,0 +1,84 @@
+from __future__ import absolute_import
+from __future__ import unicode_literals
+import csv
+import io
+import json
+from datetime import date
+
+import six
+from restless.preparers import FieldsPreparer
+from restless.utils import MoreTypesJSONEncoder
+
+from app import db
+from .models import User
+
+FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+
+def _csv_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, date):
+        return value.isoformat()
+    return six.text_type(value)
+
+
+def export_users(aliases, format='ndjson', batch_size=1000):
+    """Iterate over the lines of an export of all the users (with details),
+    with the fields given by the aliases of the user resource.
+
+    Users are loaded batch_size at a time, by id (keyset pagination), so the
+    memory used does not depend on the number of users. Each batch is read
+    from a replica, and the routing does not apply to the queries run while
+    the lines are consumed. NDJSON lines have the same fields as the user
+    resource representation, CSV has a header line and a column per field."""
+    if format not in FORMATS:
+        raise ValueError("Unknown format '%s', expected one of %s" % (format, ', '.join(sorted(FORMATS))))
+
+    preparer = FieldsPreparer(fields=aliases)
+    fields = sorted(aliases.keys())
+
+    if format == 'csv':
+        # The csv module of Python 2 writes encoded strings
+        buf = io.BytesIO() if six.PY2 else io.StringIO()
+        writer = csv.writer(buf, lineterminator=str('\n'))
+
+        def line(values):
+            if six.PY2:
+                values = [value.encode('utf-8') for value in values]
+            writer.writerow(values)
+            value = buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+            return value.decode('utf-8') if six.PY2 else value
+
+        yield line(fields)
+
+    last = None
+    while True:
+        with db.read_only():
+            query = User.query.order_by(User.id)
+            if last is not None:
+                query = query.filter(User.id > last)
+
+            users = query.limit(batch_size).all()
+            if not users:
+                return
+
+            lines = []
+            for user in users:
+                prepped = preparer.prepare(user)
+                if format == 'csv':
+                    lines.append(line([_csv_value(prepped.get(field)) for field in fields]))
+                else:
+                    # Without empty values, as the user resource
+                    prepped = dict((k, v) for k, v in six.iteritems(prepped) if v)
+                    lines.append(json.dumps(prepped, cls=MoreTypesJSONEncoder, sort_keys=True) + '\n')
+
+            last = users[-1].id
+
+        for value in lines:
+            yield value
@@ -0,0 +1,178 @@
+from __future__ import absolute_import
+from __future__ import unicode_literals
+import csv
+import io
+import itertools
+import json
+import os
+from datetime import datetime
+
+from flask import current_app
+
+from app import db
+from app.constants import Genders
+from app.util import chunks
+from passlib.hash import sha256_crypt
+from .bulk import hash_passwords, insert_users, existing_emails
+
+
+def read_rows(stream, format):
+    """Iterate over the rows of a CSV (with a header line) or NDJSON (one JSON
+    object per line) text stream as dicts, without reading the whole stream"""
+    if format == 'csv':
+        for row in csv.DictReader(stream):
+            # Empty CSV fields are missing values
+            yield dict((k, v) for k, v in row.items() if v != '')
+    elif format == 'ndjson':
+        for line in stream:
+            line = line.strip()
+            if line:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    # Reported by validate_row
+                    yield line
+    else:
+        raise ValueError("Unknown format '%s', expected csv or ndjson" % format)
+
+
+def validate_row(row):
+    """Check a row of the import and return it as expected by insert_users,
+    with the password still in plain text unless password_hash is given.
+    Raise ValueError for invalid rows"""
+    if not isinstance(row, dict):
+        raise ValueError("Expected an object")
+
+    if not row.get('email', None):
+        raise ValueError("Missing required field email")
+
+    password_hash = row.get('password_hash', None)
+    if password_hash:
+        if not sha256_crypt.identify(password_hash):
+            raise ValueError("password_hash is not a sha256_crypt hash")
+    elif not row.get('password', None):
+        raise ValueError("Missing required field password or password_hash")
+
+    gender = row.get('gender', None)
+    if gender and gender not in Genders:
+        raise ValueError(("Gender must be one of (" + ','.join(["'%s'"] * len(Genders)) + ")") % tuple(Genders))
+
+    born = row.get('born', None)
+    if born:
+        try:
+            born = datetime.strptime(born[:10], '%Y-%m-%d')
+        except (TypeError, ValueError):
+            raise ValueError("born must be a date in the format YYYY-MM-DD")
+
+    return dict(
+        email=row.get('email'),
+        password=password_hash or row.get('password'),
+        hashed=bool(password_hash),
+        name=row.get('name', None),
+        url=row.get('url', None),
+        bio=row.get('bio', None),
+        born=born or None,
+        gender=gender or None
+    )
+
+
+class Checkpoint(object):
+    """Progress of an import stored in a JSON file, written after every
+    committed batch so an interrupted import can be resumed"""
+
+    def __init__(self, path=None):
+        self.path = path
+        self.rows = 0
+        self.imported = 0
+        self.failed = 0
+
+        if path and os.path.exists(path):
+            with io.open(path, encoding='utf-8') as f:
+                self.__dict__.update(json.load(f))
+
+    def save(self):
+        if not self.path:
+            return
+
+        # Replace the file atomically, a checkpoint is never half written
+        tmp = self.path + '.tmp'
+        with io.open(tmp, 'w', encoding='utf-8') as f:
+            f.write(json.dumps(dict(rows=self.rows, imported=self.imported, failed=self.failed)))
+        os.rename(tmp, self.path)
+
+
+class Importer(object):
+    """Imports users from a stream of rows in batches.
+
+    Rows are validated, the passwords of each batch are hashed in parallel
+    (rows can instead give an existing sha256_crypt hash as password_hash) and
+    the users are inserted with bulk operations, committing every batch_size
+    rows. Invalid rows and rows with an email already registered are reported
+    to the errors callback with their row number and skipped.
+    """
+
+    def __init__(self, batch_size=1000, processes=None, checkpoint=None, progress=None, errors=None):
+        self.batch_size = batch_size
+        self.processes = processes if processes is not None else current_app.config.get('PASSWORD_HASH_PROCESSES')
+        self.checkpoint = Checkpoint(checkpoint)
+        self.progress = progress
+        self.errors = errors
+
+    def error(self, number, message):
+        self.checkpoint.failed += 1
+        if self.errors is not None:
+            self.errors(number, message)
+
+    def run(self, rows):
+        """Import the rows, skipping the ones imported before the checkpoint.
+        Return the checkpoint"""
+        checkpoint = self.checkpoint
+        rows = itertools.islice(rows, checkpoint.rows, None)
+
+        for batch in chunks(rows, self.batch_size):
+            self.import_batch(batch, checkpoint.rows + 1)
+
+            checkpoint.rows += len(batch)
+            checkpoint.save()
+            if self.progress is not None:
+                self.progress(checkpoint)
+
+        return checkpoint
+
+    def import_batch(self, batch, first):
+        valid = []
+        for number, row in enumerate(batch, first):
+            try:
+                valid.append((number, validate_row(row)))
+            except ValueError as err:
+                self.error(number, err.args[0])
+
+        # Emails must be unique, in the database and in the input
+        emails = existing_emails([row['email'] for number, row in valid])
+        rows = []
+        for number, row in valid:
+            if row['email'] in emails:
+                self.error(number, "A user with email %s already exists" % row['email'])
+                continue
+
+            emails.add(row['email'])
+            rows.append(row)
+
+        plain = [row for row in rows if not row.pop('hashed')]
+        for row, hashed in zip(plain, hash_passwords([row['password'] for row in plain], self.processes)):
+            row['password'] = hashed
+
+        if rows:
+            insert_users(rows)
+            db.session.commit()
+        self.checkpoint.imported += len(rows)
+
+
+def import_users(path, format=None, **kwargs):
+    """Import the users in a CSV or NDJSON file (by default the format is
+    given by the extension of the file), see Importer"""
+    if format is None:
+        format = 'csv' if path.lower().endswith('.csv') else 'ndjson'
+
+    with io.open(path, encoding='utf-8', newline='') as stream:
+        return Importer(**kwargs).run(read_rows(stream, format))
@@ -1,12 +1,28 @@
 from __future__ import absolute_import
 from __future__ import unicode_literals
 from app import db
+from app.baked import queries
 from app.util import now, enum, uuid, secret
-from app.sql import ChoiceType, StringListType, UUID
+from app.sql import ChoiceType, StringListType, UUID, gin_index
 from app.constants import Genders, GrantTypes, ResponseTypes
 
 from flask.ext.login import UserMixin
 from passlib.hash import sha256_crypt
+from app.metrics import registry
+
+password_hashing = registry.histogram('password_hash_seconds', 'Time hashing (hash) and verifying (verify) passwords',
+                                      ['operation'], buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0))
+
+
+def hash_password(password):
+    """Return the hash of the password as stored in the database"""
+    with password_hashing.time(operation='hash'):
+        return compute_password_hash(password)
+
+
+def compute_password_hash(password):
+    """Hash the password, without recording the time"""
+    return sha256_crypt.encrypt(password, rounds=12345)
 
 
 class User(db.Model, UserMixin):
@@ -37,7 +53,7 @@ class User(db.Model, UserMixin):
 
     def _set_password(self, password):
         if password:
-            self._password = sha256_crypt.encrypt(password, rounds=12345)
+            self._password = hash_password(password)
 
     # Hide password encryption by exposing password field only.
     password = db.synonym('_password',
@@ -47,11 +63,12 @@ class User(db.Model, UserMixin):
     def check_password(self, password):
         if self._password is None:
             return False
-        return sha256_crypt.verify(password, self._password)
+        with password_hashing.time(operation='verify'):
+            return sha256_crypt.verify(password, self._password)
 
     @classmethod
     def authenticate(cls, login, password):
-        user = cls.query.filter(db.or_(User.email == login, User.username == login)).first()
+        user = queries.run('user_by_login', login=login).first()
         authenticated = user.check_password(password) if user else False
 
         return user, authenticated
@@ -67,6 +84,15 @@ class User(db.Model, UserMixin):
         return self.is_admin
 
 
+queries.register('user_by_login',
+                 lambda session: session.query(User),
+                 lambda query: query.filter(db.or_(User.email == db.bindparam('login'),
+                                                   User.username == db.bindparam('login'))))
+queries.register('user_by_username',
+                 lambda session: session.query(User),
+                 lambda query: query.filter(User.username == db.bindparam('username')))
+
+
 class UserDetails(db.Model):
     __tablename__ = 'user_details'
 
@@ -102,7 +128,7 @@ class Application(db.Model):
 class Client(db.Model):
     __tablename__ = 'clients'
 
-    client_id = db.Column('id', UUID, primary_key=True, default=uuid)
+    client_id = db.Column('id', UUID(binary=True), primary_key=True, default=uuid)
     client_secret = db.Column('secret', db.String(16), unique=True, index=True,
                               nullable=False, default=secret)
 
@@ -123,8 +149,8 @@ class Client(db.Model):
     _default_scopes = db.Column('default_scopes', db.Text)
 
     # The list of allowed grant types for this client
-    allowed_grant_types = db.Column(StringListType(GrantTypes), default=[GrantTypes.REFRESH_TOKEN])
-    allowed_response_types = db.Column(StringListType(ResponseTypes), default=[ResponseTypes.TOKEN])
+    allowed_grant_types = db.Column(StringListType(GrantTypes, native=True), default=[GrantTypes.REFRESH_TOKEN])
+    allowed_response_types = db.Column(StringListType(ResponseTypes, native=True), default=[ResponseTypes.TOKEN])
 
     # OAuthLib also supports
     # validate_scopes: A function to validate scopes
@@ -165,6 +191,10 @@ class Client(db.Model):
         return []
 
 
+gin_index(Client.__table__, 'allowed_grant_types')
+gin_index(Client.__table__, 'allowed_response_types')
+
+
 class Grant(db.Model):
     __tablename__ = 'grants'
 
@@ -175,7 +205,7 @@ class Grant(db.Model):
     )
     user = db.relationship('User')
 
-    client_id = db.Column(UUID, db.ForeignKey('clients.id'), nullable=False)
+    client_id = db.Column(UUID(binary=True), db.ForeignKey('clients.id'), nullable=False)
     client = db.relationship('Client')
 
     code = db.Column(db.String(255), index=True, nullable=False)
@@ -201,7 +231,7 @@ class Token(db.Model):
     __tablename__ = 'tokens'
 
     id = db.Column(db.Integer, primary_key=True)
-    client_id = db.Column(UUID, db.ForeignKey('clients.id'), nullable=False)
+    client_id = db.Column(UUID(binary=True), db.ForeignKey('clients.id'), nullable=False)
     client = db.relationship('Client')
 
     user_id = db.Column(
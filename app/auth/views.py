@@ -1,23 +1,76 @@
 from __future__ import absolute_import
 from __future__ import unicode_literals
-from app import app, db, oauth, csrf, api
-from flask import request
+from app import db, oauth, csrf, api, login_manager
+from app.admission import admission, oauth_class
+import flask
+from flask import Blueprint, current_app, request, json, make_response, render_template, Response, \
+    stream_with_context
+from werkzeug.http import unquote_etag
 from flask.ext.login import current_user, login_user, login_required, logout_user
+from restless.data import Data
+from app.baked import queries
+from app.metrics import registry
+from app.tracing import traced
 from app.util import is_safe_url
-from app.constants import Genders
+from app.constants import Genders, CREATED, ACCEPTED
+from app.restful import HttpError, BadRequest, Conflict, NotFound, Unauthorized, \
+    PreconditionFailed, PreconditionRequired
+from app.cache import etag
+from app.cache.compress import etag_matches
 from .forms import LoginForm
+from . import export
 from .models import Client, Grant, User, Token, UserDetails
+from .bulk import hash_passwords, insert_users, load_users, existing_emails
 from datetime import datetime, timedelta
+import six
+
+# Login, OAuth and export endpoints. The API resources are registered by the api
+auth = Blueprint('auth', __name__)
+
+
+queries.register('client_by_id',
+                 lambda session: session.query(Client),
+                 lambda query: query.filter(Client.client_id == db.bindparam('client_id')))
+queries.register('grant_by_code',
+                 lambda session: session.query(Grant),
+                 lambda query: query.filter(Grant.client_id == db.bindparam('client_id'),
+                                            Grant.code == db.bindparam('code')))
+queries.register('token_by_access_token',
+                 lambda session: session.query(Token),
+                 lambda query: query.filter(Token.access_token == db.bindparam('access_token')))
+queries.register('token_by_refresh_token',
+                 lambda session: session.query(Token),
+                 lambda query: query.filter(Token.refresh_token == db.bindparam('refresh_token')))
+
+token_lookups = registry.counter('oauth_token_lookups', 'Bearer and refresh token lookups by result '
+                                 '(valid, expired or missing)', ['token', 'result'])
+
+
+def count_token(kind, tok):
+    if tok is None:
+        token_lookups.inc(token=kind, result='missing')
+    elif tok.expires and tok.expires < datetime.utcnow():
+        token_lookups.inc(token=kind, result='expired')
+    else:
+        token_lookups.inc(token=kind, result='valid')
+    return tok
+
+
+# Tell the login manager how to find the user
+@login_manager.user_loader
+def load_user(userid):
+    return queries.run('user_by_username', username=userid).first()
 
 
 @oauth.clientgetter
 def load_client(client_id):
-    return Client.query.filter_by(client_id=client_id).first()
+    with db.read_only():
+        return queries.run('client_by_id', client_id=client_id).first()
 
 
 @oauth.grantgetter
 def load_grant(client_id, code):
-    return Grant.query.filter_by(client_id=client_id, code=code).first()
+    return queries.run('grant_by_code', client_id=client_id, code=code).first()
 
 
 @oauth.grantsetter
@@ -38,12 +91,19 @@ def save_grant(client_id, code, request, *args, **kwargs):
 
 
 @oauth.tokengetter
+@traced('token.lookup')
 def load_token(access_token=None, refresh_token=None):
     if access_token:
-        tok = Token.query.filter_by(access_token=access_token).first()
-        return tok
+        # Look for the token in a replica first. A new token might
+        # not be replicated yet, so fallback to the primary database
+        with db.read_only():
+            tok = queries.run('token_by_access_token', access_token=access_token).first()
+        if tok is None:
+            with db.primary():
+                tok = queries.run('token_by_access_token', access_token=access_token).first()
+        return count_token('access', tok)
     elif refresh_token:
-        return Token.query.filter_by(refresh_token=refresh_token).first()
+        return count_token('refresh', queries.run('token_by_refresh_token', refresh_token=refresh_token).first())
 
 
 @oauth.tokensetter
@@ -79,12 +139,12 @@ def get_user(username, password, *args, **kwargs):
     return None
 
 
-@app.route('/', endpoint='index')
+@auth.route('/', endpoint='index')
 def index():
     return "IT WORKS!!"
 
 
-@app.route('/login', methods=['GET', 'POST'])
+@auth.route('/login', methods=['GET', 'POST'])
 def login():
     # Protect with csrf
     csrf.protect()
@@ -103,12 +163,12 @@ def login():
         if not is_safe_url(next):
             return flask.abort(400)
 
-        return flask.redirect(next or flask.url_for('index'))
+        return flask.redirect(next or flask.url_for('.index'))
 
     return flask.render_template('login.html', form=form)
 
 
-@app.route("/logout")
+@auth.route("/logout")
 @login_required
 def logout():
     logout_user()
@@ -116,11 +176,12 @@ def logout():
     if not is_safe_url(next):
         return flask.abort(400)
 
-    return flask.redirect(next or flask.url_for('index'))
+    return flask.redirect(next or flask.url_for('.index'))
 
 
-@app.route('/v1/oauth2/auth', methods=['GET', 'POST'])
+@auth.route('/v1/oauth2/auth', methods=['GET', 'POST'])
 @login_required
+@admission.limited(oauth_class)
 @oauth.authorize_handler
 def authorize(*args, **kwargs):
     if request.method == 'GET':
@@ -134,18 +195,41 @@ def authorize(*args, **kwargs):
     return confirm == 'yes'
 
 
-@app.route('/v1/oauth2/token', methods=['POST'])
+@auth.route('/v1/oauth2/token', methods=['POST'])
+@admission.limited(oauth_class)
 @oauth.token_handler
 def access_token():
     return None
 
 
-@app.route('/v1/oauth2/revoke', methods=['POST'])
+@auth.route('/v1/oauth2/revoke', methods=['POST'])
+@admission.limited(oauth_class)
 @oauth.revoke_handler
 def revoke_token():
     pass
 
 
+def validate_gender(gender):
+    if gender and gender not in Genders:
+        raise BadRequest(("Gender must be one of (" + ','.join(["'%s'"] * len(Genders)) + ")") % tuple(Genders))
+
+    return gender
+
+
+def validate_bulk(data):
+    """Check that the request body is a list of objects of the allowed size"""
+    if not isinstance(data, list):
+        raise BadRequest("Expected a list of objects")
+
+    if len(data) > current_app.config.get('BULK_MAX_ITEMS'):
+        raise BadRequest("At most %d objects are allowed per request" % current_app.config.get('BULK_MAX_ITEMS'))
+
+
+def error_result(err):
+    """Per item result for the given HttpError in a bulk request"""
+    return dict(status=err.status, error=err.args[0])
+
+
 @api.resource('/v1/user/')
 class UserResource:
     aliases = {
@@ -178,6 +262,9 @@ class UserResource:
 
     @api.admin
     def create(self):
+        if isinstance(self.data, list):
+            return self.create_bulk()
+
         # Check
         for s in ['email', 'password']:
             if not self.data.get(s, None):
@@ -189,9 +276,7 @@ class UserResource:
         )
 
         # Always create details
-        gender = self.data.get('gender', None)
-        if gender and gender not in Genders:
-            raise BadRequest(("Gender must be one of (" + ','.join(["'%s'"] * len(Genders)) + ")") % tuple(Genders))
+        gender = validate_gender(self.data.get('gender', None))
 
         user.details = UserDetails(
             name=self.data.get('name', None),
@@ -218,19 +303,168 @@ class UserResource:
         # Can only update password
         user.password = self.data.get('password', user.password)
 
-        gender = self.data.get('gender', user.details.gender)
-        if gender and gender not in Genders:
-            raise BadRequest(("Gender must be one of (" + ','.join(["'%s'"] * len(Genders)) + ")") % tuple(Genders))
-
-        # Update user details
-        user.details.name = self.data.get('name', user.details.name)
-        user.details.url = self.data.get('url', user.details.url)
-        user.details.bio = self.data.get('bio', user.details.url)
-        user.details.born = self.data.get('born', user.details.born)
-        user.details.gender = gender
+        gender = validate_gender(self.data.get('gender', user.details.gender))
+        self.update_details(user, self.data, gender)
         db.session.add(user.details)
 
         db.session.add(user)
         db.session.commit()
 
         return user
+
+    def update_details(self, user, data, gender):
+        user.details.name = data.get('name', user.details.name)
+        user.details.url = data.get('url', user.details.url)
+        user.details.bio = data.get('bio', user.details.bio)
+        user.details.born = data.get('born', user.details.born)
+        user.details.gender = gender
+
+    def prepare_result(self, user, status):
+        """Prepare the per item result of a bulk request for the user,
+        returning the result and the etag of the user resource"""
+        prepped = self.prepare(user)
+        value = etag.calculate_etag_from_data(self.serializer.serialize(prepped))
+
+        return dict(status=status, etag=value, object=prepped), value
+
+    def create_bulk(self):
+        """Create the list of users in the request body.
+
+        Every item is validated before inserting, and only the valid
+        items are created. The response has a result for each item
+        in the same order as the request."""
+        validate_bulk(self.data)
+
+        results = [None] * len(self.data)
+        valid = []
+        for i, item in enumerate(self.data):
+            try:
+                if not isinstance(item, dict):
+                    raise BadRequest("Expected an object")
+
+                for s in ['email', 'password']:
+                    if not item.get(s, None):
+                        raise BadRequest("Missing required parameter %s" % s)
+
+                validate_gender(item.get('gender', None))
+                valid.append(i)
+            except HttpError as err:
+                results[i] = error_result(err)
+
+        # Emails must be unique, in the database and in the request
+        emails = existing_emails([self.data[i].get('email') for i in valid])
+        rows = []
+        for i in valid:
+            item = self.data[i]
+            if item.get('email') in emails:
+                results[i] = error_result(Conflict("A user with email %s already exists" % item.get('email')))
+                continue
+
+            emails.add(item.get('email'))
+            rows.append((i, dict(
+                email=item.get('email'),
+                password=item.get('password'),
+                name=item.get('name', None),
+                url=item.get('url', None),
+                bio=item.get('bio', None),
+                born=item.get('born', None),
+                gender=item.get('gender', None)
+            )))
+
+        passwords = hash_passwords([row.get('password') for i, row in rows],
+                                   current_app.config.get('PASSWORD_HASH_PROCESSES'))
+        for (i, row), password in zip(rows, passwords):
+            row['password'] = password
+
+        etags = dict()
+        if len(rows) > 0:
+            usernames = insert_users([row for i, row in rows])
+            users = load_users(usernames)
+            for (i, row), username in zip(rows, usernames):
+                results[i], etags[self.request.path + username + '/'] = self.prepare_result(users[username], CREATED)
+
+        # Store the etags in the same transaction
+        etag.set_etags(etags, commit=False)
+        db.session.commit()
+
+        return Data(dict(objects=results), should_prepare=False)
+
+    @api.admin
+    def update_list(self):
+        """Update the list of users in the request body.
+
+        Each item must include the user id and the etag of the user resource
+        (the equivalent of the If-Match header for a single update)"""
+        validate_bulk(self.data)
+
+        results = [None] * len(self.data)
+        ids = [item.get('id') for item in self.data
+               if isinstance(item, dict) and isinstance(item.get('id', None), six.string_types) and item.get('id')]
+        users = load_users(ids)
+        stored = etag.get_etags([self.request.path + pk + '/' for pk in ids])
+
+        valid = []
+        for i, item in enumerate(self.data):
+            try:
+                if not isinstance(item, dict) or not item.get('id', None):
+                    raise BadRequest("Missing required parameter id")
+
+                if not isinstance(item.get('id'), six.string_types):
+                    raise BadRequest("Invalid parameter id")
+
+                user = users.get(item.get('id'), None)
+                if user is None:
+                    raise NotFound("Cannot update non existing object")
+
+                if not item.get('etag', None):
+                    raise PreconditionRequired
+
+                # The etag can be given quoted, as in the ETag header, and of a compressed representation
+                if not etag_matches(stored.get(self.request.path + user.username + '/', None),
+                                    [unquote_etag(item.get('etag'))[0]]):
+                    raise PreconditionFailed
+
+                valid.append((i, user, validate_gender(item.get('gender', user.details.gender))))
+            except HttpError as err:
+                results[i] = error_result(err)
+
+        updated = [(i, user) for i, user, gender in valid if self.data[i].get('password', None)]
+        passwords = hash_passwords([self.data[i].get('password') for i, user in updated],
+                                   current_app.config.get('PASSWORD_HASH_PROCESSES'))
+        for (i, user), password in zip(updated, passwords):
+            user._password = password
+
+        for i, user, gender in valid:
+            self.update_details(user, self.data[i], gender)
+
+        # Flush to get the modification dates
+        db.session.flush()
+
+        etags = dict()
+        for i, user, gender in valid:
+            results[i], etags[self.request.path + user.username + '/'] = self.prepare_result(user, ACCEPTED)
+
+        etag.set_etags(etags, commit=False)
+        db.session.commit()
+
+        return Data(results, should_prepare=False)
+
+
+@auth.route('/v1/export/user', endpoint='export_users')
+def export_user_list():
+    """Stream all the users with their details, as NDJSON (by default) or
+    CSV (with ?format=csv). Only for administrators"""
+    valid, req = oauth.verify_request([])
+    if not valid or not req.user.is_admin:
+        return make_response(json.dumps({'error': Unauthorized.msg}), Unauthorized.status,
+                             {'Content-Type': 'application/json'})
+
+    format = request.args.get('format', 'ndjson')
+    if format not in export.FORMATS:
+        return make_response(json.dumps({'error': 'Format must be one of (%s)' % ', '.join(sorted(export.FORMATS))}),
+                             BadRequest.status, {'Content-Type': 'application/json'})
+
+    lines = export.export_users(UserResource.aliases, format, current_app.config.get('EXPORT_BATCH_SIZE'))
+    return Response(stream_with_context(lines), mimetype=export.FORMATS[format], headers={
+        'Content-Disposition': 'attachment; filename=users.%s' % format
+    })
@@ -0,0 +1,58 @@
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+from sqlalchemy.ext import baked
+
+
+class QueryRegistry(object):
+    """Registry of the queries run on (nearly) every request.
+
+    The queries are built with the baked query extension, so the Query object
+    and its compiled SQL are cached after the first call and every following
+    call only binds the parameters. Values changing between calls must be
+    given as bindparam() in the query and passed as keyword arguments to run()
+
+    ```
+    queries.register('user_by_username',
+                     lambda session: session.query(User),
+                     lambda query: query.filter(User.username == bindparam('username')))
+
+    user = queries.run('user_by_username', username=username).first()
+    ```
+    """
+
+    def __init__(self, size=200):
+        self.bakery = baked.bakery(size=size)
+        self.queries = dict()
+
+    def register(self, name, *steps):
+        """Register a query built by steps. The first step receives the
+        session and returns a query, the following steps receive the query
+        and return it modified"""
+        query = self.bakery(steps[0])
+        for step in steps[1:]:
+            query += step
+
+        self.queries[name] = query
+        return query
+
+    def run(self, name, session=None, **params):
+        """Return the result of the query with the given parameters, in the
+        given session (by default the session of the application), which can
+        be iterated or used with first(), one(), all() or get()"""
+        if session is None:
+            from app import db
+            session = db.session()
+
+        result = self.queries[name](session)
+        return result.params(**params) if params else result
+
+    def warm(self, session):
+        """Build every query and compile its SQL in advance, by running it
+        once with all its parameters set to None (matching no rows)"""
+        for name, query in self.queries.items():
+            params = query.to_query(session).statement.compile().params
+            self.run(name, session, **dict.fromkeys(params)).first()
+
+
+queries = QueryRegistry()
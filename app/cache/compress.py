@@ -0,0 +1,200 @@
+from __future__ import absolute_import
+from __future__ import unicode_literals
+import gzip
+import io
+import threading
+import zlib
+from collections import OrderedDict
+
+from flask import current_app, request
+
+try:
+    # Brotli is optional, gzip is used when it is not installed
+    import brotli
+except ImportError:
+    brotli = None
+
+# Content encodings, in order of preference
+ENCODINGS = ('br', 'gzip')
+
+
+def encoded_etag(etag, encoding):
+    """ETag of the representation of the resource with the given encoding,
+    the representations are byte-different so they need different strong
+    validators"""
+    return '%s-%s' % (etag, encoding)
+
+
+def etag_matches(etag, etags):
+    """Whether the ETags (e.g. request.if_none_match) contain the etag of the
+    resource, of any of its encoded representations"""
+    if etag is None:
+        return False
+
+    return etag in etags or any(encoded_etag(etag, encoding) in etags for encoding in ENCODINGS)
+
+
+def gzip_compress(data, level):
+    """Compress data in gzip format.
+
+    The modification time is fixed so the same body always produces
+    the same compressed bytes"""
+    buf = io.BytesIO()
+    with gzip.GzipFile(fileobj=buf, mode='wb', compresslevel=level, mtime=0) as f:
+        f.write(data)
+    return buf.getvalue()
+
+
+def brotli_compress(data, level):
+    """Compress data in brotli format. Brotli quality goes from 0 to 11,
+    the level is used as is"""
+    return brotli.compress(data, quality=level)
+
+
+class VariantCache(object):
+    """Bounded LRU cache of compressed response bodies.
+
+    Variants are stored by (etag, encoding). Since the stored etag for a
+    detail resource is not recalculated on every request, the length and
+    crc32 of the uncompressed body are kept with the variant and must match
+    for the variant to be reused.
+    """
+
+    def __init__(self, size=256):
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._variants = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, etag, encoding, data):
+        key = (etag, encoding)
+        with self._lock:
+            variant = self._variants.get(key, None)
+            if variant is not None and variant[0] == len(data) and variant[1] == zlib.crc32(data):
+                # Mark as recently used
+                del self._variants[key]
+                self._variants[key] = variant
+                self.hits += 1
+                return variant[2]
+
+            self.misses += 1
+            return None
+
+    def set(self, etag, encoding, data, compressed):
+        key = (etag, encoding)
+        with self._lock:
+            self._variants.pop(key, None)
+            self._variants[key] = (len(data), zlib.crc32(data), compressed)
+            while len(self._variants) > self.size:
+                self._variants.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._variants.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+class Compress(object):
+    """Negotiates response compression through the Accept-Encoding header.
+
+    Only responses with one of the COMPRESS_MIMETYPES and a body of at least
+    COMPRESS_MIN_SIZE bytes are compressed. If the response carries an ETag,
+    the compressed body is kept in a variant cache so identical bodies are
+    not compressed again on every request, and the ETag of the compressed
+    response gets the encoding as suffix ("<etag>-gzip"). Not modified
+    responses to requests with the ETag of an encoded representation return
+    that ETag.
+    """
+
+    def __init__(self, app=None):
+        self.cache = VariantCache()
+        self.compressors = OrderedDict()
+        if brotli is not None:
+            self.compressors['br'] = brotli_compress
+        self.compressors['gzip'] = gzip_compress
+
+        if app:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('COMPRESS_ENABLED', True)
+        app.config.setdefault('COMPRESS_MIMETYPES', ['application/json'])
+        app.config.setdefault('COMPRESS_MIN_SIZE', 500)
+        app.config.setdefault('COMPRESS_LEVEL', 6)
+        app.config.setdefault('COMPRESS_BROTLI_LEVEL', 4)
+        app.config.setdefault('COMPRESS_CACHE_SIZE', 256)
+
+        self.cache.size = app.config.get('COMPRESS_CACHE_SIZE')
+        app.after_request(self.after_request)
+
+    def is_compressible(self, response):
+        if response.status_code < 200 or response.status_code >= 300 or response.status_code == 204:
+            return False
+
+        if response.direct_passthrough or response.is_streamed:
+            return False
+
+        if 'Content-Encoding' in response.headers:
+            return False
+
+        if response.mimetype not in current_app.config.get('COMPRESS_MIMETYPES'):
+            return False
+
+        return len(response.get_data()) >= current_app.config.get('COMPRESS_MIN_SIZE')
+
+    def negotiate(self):
+        """Return the preferred encoding accepted by the client or None"""
+        return request.accept_encodings.best_match(list(self.compressors.keys()))
+
+    def compress(self, encoding, data):
+        if encoding == 'br':
+            return self.compressors[encoding](data, current_app.config.get('COMPRESS_BROTLI_LEVEL'))
+        return self.compressors[encoding](data, current_app.config.get('COMPRESS_LEVEL'))
+
+    def not_modified(self, response):
+        response.vary.add('Accept-Encoding')
+
+        etag, weak = response.get_etag()
+        encoding = self.negotiate()
+        if etag and encoding and encoded_etag(etag, encoding) in request.if_none_match:
+            response.set_etag(encoded_etag(etag, encoding), weak)
+
+        return response
+
+    def after_request(self, response):
+        if not current_app.config.get('COMPRESS_ENABLED'):
+            return response
+
+        if response.status_code == 304:
+            return self.not_modified(response)
+
+        if not self.is_compressible(response):
+            return response
+
+        # The representation depends on the request headers from now on
+        response.vary.add('Accept-Encoding')
+
+        encoding = self.negotiate()
+        if encoding is None:
+            return response
+
+        data = response.get_data()
+        etag, weak = response.get_etag()
+
+        compressed = self.cache.get(etag, encoding, data) if etag else None
+        if compressed is None:
+            compressed = self.compress(encoding, data)
+            if etag:
+                self.cache.set(etag, encoding, data, compressed)
+
+        response.set_data(compressed)
+        response.headers['Content-Encoding'] = encoding
+        if etag:
+            response.set_etag(encoded_etag(etag, encoding), weak)
+
+        return response
+
+
+compress = Compress()
@@ -3,39 +3,87 @@ from __future__ import unicode_literals
 
 from .models import Etag
 from app import db
+from app.baked import queries
+from app.util import chunks
+from app.metrics import registry
+from app.tracing import traced
 
+lookups = registry.counter('etag_lookups', 'ETag store lookups by result (hit or miss)', ['result'])
 
+queries.register('etag', lambda session: session.query(Etag))
+
+
+@traced('etag.get')
 def get_etag(uri):
     """Get the current etag for the specified uri"""
-    etag = Etag.query.get(uri)
+    etag = queries.run('etag').get(uri)
     if not etag:
+        lookups.inc(result='miss')
         return None
 
+    lookups.inc(result='hit')
+
     return etag.value
 
 
+def get_etags(uris):
+    """Get the current etags for the specified uris as a dict. URIs
+    without a stored etag are not included in the result"""
+    etags = dict()
+    for chunk in chunks(uris, 500):
+        for etag in Etag.query.filter(Etag.uri.in_(chunk)):
+            etags[etag.uri] = etag.value
+
+    lookups.inc(len(etags), result='hit')
+    lookups.inc(len(uris) - len(etags), result='miss')
+    return etags
+
+
+@traced('etag.calculate')
 def calculate_etag_from_data(data):
     """Calculate the etag value from the data"""
     return Etag.calculate(data)
 
 
+@traced('etag.set')
 def set_etag(uri, etag):
     """Store the Etag for the specified URI and given hash value"""
-    etag_obj = Etag.query.get(uri)
-    if etag_obj is None:
-        etag_obj = Etag(uri=uri, value=etag)
+    with db.primary():
+        etag_obj = queries.run('etag').get(uri)
+        if etag_obj is None:
+            etag_obj = Etag(uri=uri, value=etag)
+        else:
+            etag_obj.value = etag
 
-    # Store in db
-    db.session.add(etag_obj)
-    db.session.commit()
+        # Store in db
+        db.session.add(etag_obj)
+        db.session.commit()
 
 
 def set_etag_from_data(uri, data):
     """Store the Etag for the specified URI and given data value"""
-    etag_obj = Etag.query.get(uri)
-    if etag_obj is None:
-        etag_obj = Etag(uri=uri, value=calculate_etag_from_data(data))
+    set_etag(uri, calculate_etag_from_data(data))
+
+
+@traced('etag.set')
+def set_etags(etags, commit=True):
+    """Store the Etags for multiple URIs at once. The etags parameter
+    is a dict mapping each URI to its hash value.
+
+    If commit is False, the etags are only added to the session so they can be
+    stored in the same transaction as the changed resources"""
+    stored = dict()
+    with db.primary():
+        for chunk in chunks(list(etags.keys()), 500):
+            for etag_obj in Etag.query.filter(Etag.uri.in_(chunk)):
+                stored[etag_obj.uri] = etag_obj
+
+    for uri, value in etags.items():
+        etag_obj = stored.get(uri, None)
+        if etag_obj is None:
+            db.session.add(Etag(uri=uri, value=value))
+        else:
+            etag_obj.value = value
 
-    # Store in db
-    db.session.add(etag_obj)
-    db.session.commit()
+    if commit:
+        db.session.commit()
@@ -6,6 +6,10 @@ Genders = enum(M='Male', F='Female')
 GrantTypes = enum(PASSWORD='password', REFRESH_TOKEN='refresh_token')
 ResponseTypes = enum(CODE='code', TOKEN='token')
 
+CREATED = 201
+ACCEPTED = 202
 NOT_MODIFIED = 304
 PRECONDITION_REQUIRED = 428
 PRECONDITION_FAILED = 412
+TOO_MANY_REQUESTS = 429
+SERVICE_UNAVAILABLE = 503
@@ -0,0 +1,216 @@
+from __future__ import absolute_import
+from __future__ import unicode_literals
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import request, has_request_context
+from flask.ext.sqlalchemy import SQLAlchemy as _SQLAlchemy, SignallingSession, _EngineConnector
+from sqlalchemy import event, inspect
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.sql.dml import UpdateBase
+
+
+class EngineConnector(_EngineConnector):
+    """Engine connector notifying the creation of new engines.
+
+    Replica engines use a bind in the form ('replica', index), where the index
+    refers to the position of the replica in SQLALCHEMY_REPLICA_URIS"""
+
+    def get_uri(self):
+        if isinstance(self._bind, tuple) and self._bind[0] == 'replica':
+            return self._app.config['SQLALCHEMY_REPLICA_URIS'][self._bind[1]]
+
+        return super(EngineConnector, self).get_uri()
+
+    def get_engine(self):
+        engine = self._engine
+        rv = super(EngineConnector, self).get_engine()
+        if rv is not engine:
+            for callback in self._sa.engine_callbacks:
+                callback(rv, self._app)
+
+        return rv
+
+
+class RoutingSession(SignallingSession):
+    """Session routing read-only work to a replica database.
+
+    Queries go to a replica (chosen once per session) only if the database
+    allows it at the moment (see SQLAlchemy.use_replica) and the session has
+    not written anything in the current transaction. Flushes and DML
+    statements always go to the primary database."""
+
+    def __init__(self, db, **options):
+        self.db = db
+        self.wrote = False
+        self.replica = None
+        super(RoutingSession, self).__init__(db, **options)
+
+        event.listen(self, 'after_flush', RoutingSession.after_flush)
+        event.listen(self, 'after_commit', RoutingSession.after_commit)
+        event.listen(self, 'after_rollback', RoutingSession.after_rollback)
+
+    def get_bind(self, mapper=None, clause=None):
+        if not self._flushing and not self.wrote and not isinstance(clause, UpdateBase) and \
+                self.db.use_replica():
+            if self.replica is None:
+                self.replica = self.db.get_replica_engine(self.app)
+            return self.replica
+
+        return super(RoutingSession, self).get_bind(mapper, clause)
+
+    @staticmethod
+    def after_flush(session, flush_context):
+        session.wrote = True
+
+    @staticmethod
+    def after_commit(session):
+        if session.wrote:
+            session.db.record_write()
+        session.wrote = False
+
+    @staticmethod
+    def after_rollback(session):
+        session.wrote = False
+
+
+class SQLAlchemy(_SQLAlchemy):
+    """Extends Flask-SQLAlchemy with the pool pre-ping option
+    (SQLALCHEMY_POOL_PRE_PING), callbacks run for every engine created,
+    used to install instrumentation, and routing of read-only work to
+    the replicas in SQLALCHEMY_REPLICA_URIS.
+
+    Work is read-only during GET and HEAD requests, and inside
+    ``with db.read_only()`` blocks. After a write by a request with a
+    non-safe method (e.g. POST or PUT), reads by the same
+    client (identified by the Authorization header or the user of the
+    request) go to the primary database for SQLALCHEMY_READ_YOUR_WRITES
+    seconds, so clients see their own changes regardless of replication
+    lag. Inside ``with db.primary()`` blocks the primary is always used.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.engine_callbacks = []
+
+        # Class of the pools of the engines which would use a QueuePool
+        self.pool_class = None
+        self._local = threading.local()
+        self._writes = dict()
+        self._writes_lock = threading.Lock()
+        super(SQLAlchemy, self).__init__(*args, **kwargs)
+
+    def init_app(self, app):
+        app.config.setdefault('SQLALCHEMY_REPLICA_URIS', [])
+        app.config.setdefault('SQLALCHEMY_READ_YOUR_WRITES', 5.0)
+        super(SQLAlchemy, self).init_app(app)
+
+        @app.before_request
+        def mark_read_only():
+            request.db_read_only = request.method in ('GET', 'HEAD')
+
+    def on_engine_created(self, callback):
+        """Register a callback to be called with every new engine and its
+        application. Callbacks are registered once, for all the applications"""
+        if callback not in self.engine_callbacks:
+            self.engine_callbacks.append(callback)
+        return callback
+
+    def make_connector(self, app, bind=None):
+        return EngineConnector(self, app, bind)
+
+    def apply_pool_defaults(self, app, options):
+        super(SQLAlchemy, self).apply_pool_defaults(app, options)
+        if app.config.get('SQLALCHEMY_POOL_PRE_PING', False):
+            # Test connections on checkout, discarding the ones closed by the server
+            options['pool_pre_ping'] = True
+
+    def apply_driver_hacks(self, app, info, options):
+        super(SQLAlchemy, self).apply_driver_hacks(app, info, options)
+        if self.pool_class is not None and 'poolclass' not in options and \
+                info.get_dialect().get_pool_class(info) is QueuePool:
+            options['poolclass'] = self.pool_class
+
+    def create_session(self, options):
+        return RoutingSession(self, **options)
+
+    def get_replica_engine(self, app):
+        """Get the engine for a random replica"""
+        replicas = app.config.get('SQLALCHEMY_REPLICA_URIS')
+        return self.get_engine(app, bind=('replica', random.randrange(len(replicas))))
+
+    @contextmanager
+    def read_only(self):
+        """Route the queries in the block to a replica"""
+        self._local.read_only = getattr(self._local, 'read_only', 0) + 1
+        try:
+            yield
+        finally:
+            self._local.read_only -= 1
+
+    @contextmanager
+    def primary(self):
+        """Route the queries in the block to the primary database"""
+        self._local.primary = getattr(self._local, 'primary', 0) + 1
+        try:
+            yield
+        finally:
+            self._local.primary -= 1
+
+    def use_replica(self):
+        if not self.get_app().config.get('SQLALCHEMY_REPLICA_URIS'):
+            return False
+
+        if getattr(self._local, 'primary', 0) > 0:
+            return False
+
+        read_only = getattr(self._local, 'read_only', 0) > 0 or \
+            (has_request_context() and getattr(request, 'db_read_only', False))
+
+        return read_only and not self.recently_written()
+
+    def identities(self):
+        """Identities of the client of the current request"""
+        if not has_request_context():
+            return []
+
+        identities = []
+        if 'Authorization' in request.headers:
+            identities.append(request.headers['Authorization'])
+
+        user = getattr(request, 'user', None)
+        if user is not None:
+            # Use the identity key of the instance, which does not require loading it
+            identities.append(inspect(user).identity_key)
+
+        return identities
+
+    def record_write(self):
+        """Remember that the client of the current request wrote to the database.
+        The commits of safe requests (e.g. storing the ETag of a GET response)
+        are bookkeeping, not changes of the client, and are not remembered"""
+        if has_request_context() and request.method in ('GET', 'HEAD', 'OPTIONS'):
+            return
+
+        identities = self.identities()
+        if not identities:
+            return
+
+        now = time.time()
+        expires = now + self.get_app().config.get('SQLALCHEMY_READ_YOUR_WRITES')
+        with self._writes_lock:
+            for identity in identities:
+                self._writes[identity] = expires
+
+            if len(self._writes) > 10000:
+                # Forget expired writes
+                self._writes = dict((k, v) for k, v in self._writes.items() if v > now)
+
+    def recently_written(self):
+        now = time.time()
+        for identity in self.identities():
+            if self._writes.get(identity, 0) > now:
+                return True
+
+        return False
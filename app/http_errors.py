@@ -1,5 +1,5 @@
 from restless.exceptions import HttpError
-from .constants import PRECONDITION_FAILED, PRECONDITION_REQUIRED
+from .constants import PRECONDITION_FAILED, PRECONDITION_REQUIRED, TOO_MANY_REQUESTS, SERVICE_UNAVAILABLE
 
 
 class PreconditionRequired(HttpError):
@@ -9,4 +9,14 @@ class PreconditionRequired(HttpError):
 
 class PreconditionFailed(HttpError):
     status = PRECONDITION_FAILED
-    msg = "Precondition failed."
\ No newline at end of file
+    msg = "Precondition failed."
+
+
+class TooManyRequests(HttpError):
+    status = TOO_MANY_REQUESTS
+    msg = "Too many requests, try again later."
+
+
+class ServiceUnavailable(HttpError):
+    status = SERVICE_UNAVAILABLE
+    msg = "The service is overloaded, try again later."
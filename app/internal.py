@@ -0,0 +1,178 @@
+from __future__ import absolute_import
+from __future__ import unicode_literals
+import functools
+import hmac
+import os
+
+from flask import Blueprint, current_app, request, jsonify, abort, make_response
+
+from app import oauth
+from .memory import snapshot_pid
+from .metrics import CONTENT_TYPE
+from .util import is_admin_request
+
+# Grouping of the memory statistics
+MEMORY_KEYS = ('lineno', 'filename', 'traceback')
+
+# Internal endpoints, for operations and monitoring only
+internal = Blueprint('internal', __name__, url_prefix='/internal')
+
+
+@internal.before_request
+def restrict_access():
+    """Internal endpoints need the INTERNAL_TOKEN, or a request from INTERNAL_ALLOWED_ADDRS,
+    except for the readiness checks of the load balancers"""
+    if request.endpoint == 'internal.ready':
+        return
+
+    token = current_app.config.get('INTERNAL_TOKEN')
+    if token and hmac.compare_digest(request.headers.get('X-Internal-Token', '').encode('utf-8'),
+                                     token.encode('utf-8')):
+        return
+
+    if request.remote_addr not in current_app.config.get('INTERNAL_ALLOWED_ADDRS'):
+        abort(404)
+
+
+@internal.route('/pool')
+def pool():
+    """Statistics of the database connection pools"""
+    return jsonify(current_app.extensions['pool_monitor'].stats())
+
+
+@internal.route('/logs')
+def logs():
+    """Statistics of the log queue"""
+    return jsonify(current_app.extensions['logging'].stats())
+
+
+@internal.route('/ready')
+def ready():
+    """Readiness of the process, 503 until it is warmed up"""
+    warmup = current_app.extensions['warmup']
+    ready = warmup.ready or not current_app.config.get('WARMUP_ENABLED')
+    response = jsonify(warmup.stats())
+    response.status_code = 200 if ready else 503
+    return response
+
+
+@internal.route('/metrics')
+def metrics():
+    """Metrics of all the processes, in the Prometheus text format"""
+    return make_response(current_app.extensions['metrics'].expose(), 200, {'Content-Type': CONTENT_TYPE})
+
+
+def admin_required(view):
+    """Only for requests with the bearer token of an administrator"""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        if not is_admin_request(oauth):
+            abort(401)
+        return view(*args, **kwargs)
+
+    return wrapper
+
+
+def memory_error(message, status):
+    response = jsonify(error=message)
+    response.status_code = status
+    return response
+
+
+def snapshot_error(memory, id):
+    """Error response if the id is not that of a snapshot of this process"""
+    pid = snapshot_pid(id)
+    if pid is None:
+        return memory_error('%s is not a snapshot id' % id, 400)
+    if pid != os.getpid():
+        # Every worker process keeps its own snapshots
+        return memory_error('Snapshot %s belongs to the process %d, not to %d' % (id, pid, os.getpid()), 404)
+    if id not in memory.snapshots:
+        return memory_error('Snapshot %s does not exist' % id, 404)
+
+
+@internal.route('/memory')
+@admin_required
+def memory():
+    """Memory tracing status of the process, and memory allocated by the sampled requests by endpoint"""
+    memory = current_app.extensions['memory']
+    return jsonify(memory.stats())
+
+
+@internal.route('/memory/start', methods=['POST'])
+@admin_required
+def memory_start():
+    """Start tracing the memory allocations"""
+    memory = current_app.extensions['memory']
+    if not memory.available:
+        return memory_error('tracemalloc is not available', 501)
+
+    memory.start(request.args.get('frames', None, type=int))
+    return jsonify(memory.stats())
+
+
+@internal.route('/memory/stop', methods=['POST'])
+@admin_required
+def memory_stop():
+    """Stop tracing the memory allocations and discard the snapshots"""
+    memory = current_app.extensions['memory']
+    memory.stop()
+    return jsonify(memory.stats())
+
+
+@internal.route('/memory/snapshots', methods=['POST'])
+@admin_required
+def memory_snapshot():
+    """Take a snapshot of the allocations, to compare with later snapshots"""
+    memory = current_app.extensions['memory']
+    if not memory.tracing:
+        return memory_error('Memory allocations are not being traced', 409)
+
+    id = memory.snapshot()
+    return jsonify(id=id, top=memory.top(id, limit=request.args.get('limit', None, type=int)))
+
+
+@internal.route('/memory/top')
+@admin_required
+def memory_top():
+    """Top allocating call sites of a snapshot (?snapshot=<id>) or of the current allocations,
+    by line (?key=lineno, by default), file (?key=filename) or stack (?key=traceback)"""
+    memory = current_app.extensions['memory']
+    if not memory.tracing:
+        return memory_error('Memory allocations are not being traced', 409)
+
+    id = request.args.get('snapshot', None)
+    error = snapshot_error(memory, id) if id is not None else None
+    if error is not None:
+        return error
+
+    key = request.args.get('key', 'lineno')
+    if key not in MEMORY_KEYS:
+        return memory_error('Key must be one of (%s)' % ', '.join(MEMORY_KEYS), 400)
+
+    return jsonify(top=memory.top(id, key, request.args.get('limit', None, type=int)))
+
+
+@internal.route('/memory/diff')
+@admin_required
+def memory_diff():
+    """Call sites with the largest allocation growth from a snapshot (?from=<id>) to another
+    (?to=<id>) or to the current allocations"""
+    memory = current_app.extensions['memory']
+    if not memory.tracing:
+        return memory_error('Memory allocations are not being traced', 409)
+
+    first = request.args.get('from', None)
+    second = request.args.get('to', None)
+    if first is None:
+        return memory_error('Parameter from must be a snapshot id', 400)
+    for id in (first, second):
+        error = snapshot_error(memory, id) if id is not None else None
+        if error is not None:
+            return error
+
+    key = request.args.get('key', 'lineno')
+    if key not in MEMORY_KEYS:
+        return memory_error('Key must be one of (%s)' % ', '.join(MEMORY_KEYS), 400)
+
+    return jsonify(diff=memory.diff(first, second, key, request.args.get('limit', None, type=int)))
@@ -0,0 +1,167 @@
+from __future__ import absolute_import
+from __future__ import unicode_literals
+import atexit
+import copy
+import logging
+import threading
+
+from six.moves import queue
+
+
+class QueueHandler(logging.Handler):
+    """Handler putting the records in a bounded queue, without blocking.
+
+    Records are formatted on the logging thread (the message is merged with
+    its arguments and the exception is rendered), so they do not keep
+    references to request objects. When the queue is full the record is
+    dropped and counted. The target identifies the handlers of the record
+    in the listener."""
+
+    def __init__(self, queue, target):
+        super(QueueHandler, self).__init__()
+        self.queue = queue
+        self.target = target
+        self.dropped = 0
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        record.target = self.target
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def emit(self, record):
+        try:
+            self.queue.put_nowait(self.prepare(record))
+        except queue.Full:
+            self.dropped += 1
+        except Exception:
+            self.handleError(record)
+
+
+class QueueListener(object):
+    """Background thread writing the records in the queue to their handlers"""
+
+    _stop = object()
+
+    def __init__(self, queue):
+        self.queue = queue
+        self.handlers = dict()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def add(self, target, handler):
+        """Add a handler for the records of the target"""
+        self.handlers.setdefault(target, []).append(handler)
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self.run, name='log-listener')
+                self._thread.daemon = True
+                self._thread.start()
+
+    def stop(self):
+        """Write the pending records and stop the thread"""
+        with self._lock:
+            thread, self._thread = self._thread, None
+
+        if thread is not None:
+            self.queue.put(self._stop)
+            thread.join()
+
+    def run(self):
+        while True:
+            record = self.queue.get()
+            if record is self._stop:
+                break
+
+            for handler in self.handlers.get(record.target, []):
+                if record.levelno >= handler.level:
+                    handler.handle(record)
+
+
+class QueueLogging(object):
+    """Routes log handlers through an in-memory queue drained by a background
+    thread, so requests never wait for the log files.
+
+    The queue holds at most LOG_QUEUE_SIZE records, records logged when it is
+    full are dropped and counted (see stats()) instead of blocking the
+    request.
+
+    Loggers are shared by the applications of a process, so the last
+    application initialized replaces the handlers of the previous ones."""
+
+    def __init__(self, app=None):
+        self.queue = None
+        self.listener = None
+        self.queue_handlers = dict()
+
+        if app:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('LOG_QUEUE_SIZE', 10000)
+
+        if self.listener is not None:
+            self.reset()
+
+        self.queue = queue.Queue(app.config.get('LOG_QUEUE_SIZE'))
+        self.listener = QueueListener(self.queue)
+        atexit.register(self.listener.stop)
+
+        app.extensions['logging'] = self
+
+    def reset(self):
+        """Write the pending records, and remove the handlers of the previous application"""
+        self.listener.stop()
+        for name, queue_handler in self.queue_handlers.items():
+            logging.getLogger(name).removeHandler(queue_handler)
+        for handlers in self.listener.handlers.values():
+            for handler in handlers:
+                handler.close()
+        self.queue_handlers = dict()
+
+    def add_handler(self, logger, handler):
+        """Add the handler to the logger, through the queue"""
+        queue_handler = self.queue_handlers.get(logger.name, None)
+        if queue_handler is None:
+            queue_handler = self.queue_handlers[logger.name] = QueueHandler(self.queue, logger.name)
+
+        # Flask removes the handlers of the logger when an application creates it
+        if queue_handler not in logger.handlers:
+            logger.addHandler(queue_handler)
+
+        self.listener.add(logger.name, handler)
+        self.listener.start()
+
+    def after_fork(self):
+        """Start the thread in a forked process, with a new queue"""
+        self.queue = queue.Queue(self.queue.maxsize)
+        for handler in self.queue_handlers.values():
+            handler.queue = self.queue
+            handler.createLock()
+
+        handlers = self.listener.handlers
+        self.listener = QueueListener(self.queue)
+        for target, target_handlers in handlers.items():
+            for handler in target_handlers:
+                handler.createLock()
+                self.listener.add(target, handler)
+
+        atexit.register(self.listener.stop)
+        if handlers:
+            self.listener.start()
+
+    def stats(self):
+        return dict(
+            queued=self.queue.qsize(),
+            capacity=self.queue.maxsize,
+            dropped=sum(h.dropped for h in self.queue_handlers.values())
+        )
+
+
+queue_logging = QueueLogging()
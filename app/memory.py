@@ -0,0 +1,205 @@
+from __future__ import absolute_import
+from __future__ import unicode_literals
+import itertools
+import os
+import random
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app, request
+
+try:
+    # Python 3.4+
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+# Frames of the tracing itself
+_ignored = ('<frozen importlib._bootstrap>', '<unknown>', tracemalloc.__file__ if tracemalloc else '')
+
+# Snapshot ids, <pid>-<number>
+_snapshot_id = re.compile(r'^(\d+)-\d+$')
+
+
+def snapshot_pid(id):
+    """The process that took the snapshot, None if the id is not a snapshot id"""
+    match = _snapshot_id.match(id)
+    return int(match.group(1)) if match else None
+
+
+def filtered(snapshot):
+    return snapshot.filter_traces([tracemalloc.Filter(False, name) for name in _ignored])
+
+
+def statistics(stats, limit):
+    """The top limit statistics (or statistic differences) as dicts"""
+    top = []
+    for stat in stats[:limit]:
+        item = dict(
+            size=stat.size,
+            count=stat.count,
+            traceback=[('%s:%d' % (frame.filename, frame.lineno)) for frame in stat.traceback]
+        )
+        if hasattr(stat, 'size_diff'):
+            item.update(size_diff=stat.size_diff, count_diff=stat.count_diff)
+        top.append(item)
+    return top
+
+
+class EndpointMemory(object):
+    """Memory allocated (and not freed) by the sampled requests of an endpoint"""
+
+    def __init__(self):
+        self.requests = 0
+        self.total = 0
+        self.max = 0
+
+    def record(self, allocated):
+        self.requests += 1
+        self.total += allocated
+        self.max = max(self.max, allocated)
+
+    def stats(self):
+        return dict(requests=self.requests, max=self.max, avg=self.total // self.requests if self.requests else 0)
+
+
+class MemoryProfiler(object):
+    """Memory allocation profiling with tracemalloc, to find the call sites
+    and endpoints driving the memory growth of the processes.
+
+    Tracing starts with the application when MEMORY_TRACING is set, or later
+    with start(), keeping MEMORY_FRAMES frames per allocation (tracing slows
+    down the process). While tracing, a MEMORY_SAMPLE_RATE fraction of the
+    requests record the memory allocated during the request and not freed at
+    its end, by endpoint. The traced memory is that of the whole process, so
+    it includes the allocations of concurrent requests in other threads.
+
+    Snapshots are taken on demand and kept (the last MEMORY_SNAPSHOTS) to be
+    compared with later snapshots.
+
+    The tracing and the snapshots belong to the process: with several worker
+    processes, start() and the snapshots only apply to the process serving the
+    request (MEMORY_TRACING starts tracing in all of them), and the snapshot
+    ids include the pid of their process ("<pid>-<number>").
+    """
+
+    def __init__(self, app=None):
+        self.snapshots = OrderedDict()
+        self.endpoints = dict()
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+        if app:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('MEMORY_TRACING', False)
+        app.config.setdefault('MEMORY_FRAMES', 10)
+        app.config.setdefault('MEMORY_SAMPLE_RATE', 0.01)
+        app.config.setdefault('MEMORY_SNAPSHOTS', 5)
+        app.config.setdefault('MEMORY_TOP', 20)
+
+        app.extensions['memory'] = self
+        if app.config.get('MEMORY_TRACING'):
+            self.start(app.config.get('MEMORY_FRAMES'))
+
+        app.before_request(self.before_request)
+        app.after_request(self.after_request)
+
+    @property
+    def available(self):
+        return tracemalloc is not None
+
+    @property
+    def tracing(self):
+        return self.available and tracemalloc.is_tracing()
+
+    def start(self, frames=None):
+        if not self.available:
+            raise RuntimeError("tracemalloc is not available")
+
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(frames or current_app.config.get('MEMORY_FRAMES'))
+
+    def stop(self):
+        """Stop tracing, releasing the traces and the snapshots"""
+        if self.tracing:
+            tracemalloc.stop()
+
+        with self._lock:
+            self.snapshots.clear()
+            self.endpoints.clear()
+
+    def after_fork(self):
+        """The snapshots of the parent process are not those of the worker"""
+        with self._lock:
+            self.snapshots.clear()
+            self.endpoints.clear()
+            self._ids = itertools.count(1)
+
+    def before_request(self):
+        if not self.tracing or random.random() >= current_app.config.get('MEMORY_SAMPLE_RATE'):
+            return
+
+        # The peak of the process is not reset, it is shared with the concurrent requests
+        current, peak = tracemalloc.get_traced_memory()
+        request.memory_start = current
+
+    def after_request(self, response):
+        start = getattr(request, 'memory_start', None)
+        if start is None or not self.tracing:
+            return response
+
+        current, peak = tracemalloc.get_traced_memory()
+        with self._lock:
+            endpoint = self.endpoints.get(request.endpoint, None)
+            if endpoint is None:
+                endpoint = self.endpoints[request.endpoint] = EndpointMemory()
+            endpoint.record(max(current - start, 0))
+
+        return response
+
+    def snapshot(self):
+        """Take a snapshot, returning its id"""
+        snapshot = filtered(tracemalloc.take_snapshot())
+        with self._lock:
+            id = '%d-%d' % (os.getpid(), next(self._ids))
+            self.snapshots[id] = (time.time(), snapshot)
+            while len(self.snapshots) > current_app.config.get('MEMORY_SNAPSHOTS'):
+                self.snapshots.popitem(last=False)
+
+        return id
+
+    def top(self, id=None, key_type='lineno', limit=None):
+        """Top allocating call sites in the snapshot (or a new one)"""
+        snapshot = self.snapshots[id][1] if id is not None else filtered(tracemalloc.take_snapshot())
+        return statistics(snapshot.statistics(key_type), limit or current_app.config.get('MEMORY_TOP'))
+
+    def diff(self, first, second=None, key_type='lineno', limit=None):
+        """Call sites allocating the most memory between the first and the
+        second snapshot (or a new one)"""
+        old = self.snapshots[first][1]
+        new = self.snapshots[second][1] if second is not None else filtered(tracemalloc.take_snapshot())
+        return statistics(new.compare_to(old, key_type), limit or current_app.config.get('MEMORY_TOP'))
+
+    def stats(self):
+        stats = dict(available=self.available, tracing=self.tracing, pid=os.getpid())
+        if not self.tracing:
+            return stats
+
+        current, peak = tracemalloc.get_traced_memory()
+        with self._lock:
+            stats.update(
+                current=current,
+                peak=peak,
+                overhead=tracemalloc.get_tracemalloc_memory(),
+                frames=tracemalloc.get_traceback_limit(),
+                snapshots=[dict(id=id, time=taken) for id, (taken, snapshot) in self.snapshots.items()],
+                endpoints=dict((name, endpoint.stats()) for name, endpoint in self.endpoints.items())
+            )
+        return stats
+
+
+memory = MemoryProfiler()
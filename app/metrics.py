@@ -0,0 +1,363 @@
+from __future__ import absolute_import
+from __future__ import unicode_literals
+import atexit
+import errno
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app, request
+import six
+
+# Default buckets of the latency histograms, in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def escape(value):
+    """Escape a label value for the text exposition format"""
+    return six.text_type(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+def format_labels(names, values):
+    if not names:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (name, escape(value)) for name, value in zip(names, values))
+
+
+class Metric(object):
+    """Base of the metrics, the samples are kept by the tuple of label values"""
+
+    type = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.values = dict()
+        self._lock = threading.Lock()
+
+    def key(self, labels):
+        if set(labels) != set(self.labels):
+            raise ValueError("Expected the labels (%s) for %s" % (', '.join(self.labels), self.name))
+        return tuple(six.text_type(labels[name]) for name in self.labels)
+
+    def reset(self):
+        with self._lock:
+            self.values = dict()
+
+    def snapshot(self):
+        with self._lock:
+            return [[list(key), value] for key, value in six.iteritems(self.values)]
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    @staticmethod
+    def merge(current, value):
+        return (current or 0) + value
+
+    def expose(self, key, value):
+        yield self.name + '_total' + format_labels(self.labels, key), value
+
+
+class Gauge(Metric):
+    """Current value in each process. Values of the processes still running
+    are exposed with a pid label"""
+
+    type = 'gauge'
+
+    def set(self, value, **labels):
+        key = self.key(labels)
+        with self._lock:
+            self.values[key] = value
+
+    def expose(self, key, value):
+        yield self.name + format_labels(self.labels, key), value
+
+
+class Histogram(Metric):
+    """Samples counted in cumulative buckets, with their sum and count.
+    Values are kept as the list of bucket counts followed by the sum"""
+
+    type = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        super(Histogram, self).__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        with self._lock:
+            counts = self.values.get(key, None)
+            if counts is None:
+                counts = self.values[key] = [0] * len(self.buckets) + [0.0]
+
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            counts[-1] += value
+
+    def time(self, **labels):
+        return Timer(self, labels)
+
+    @staticmethod
+    def merge(current, value):
+        if current is None:
+            return list(value)
+        return [a + b for a, b in zip(current, value)]
+
+    def expose(self, key, value):
+        total = 0
+        for bound, count in zip(self.buckets, value):
+            total += count
+            yield (self.name + '_bucket' + format_labels(self.labels + ('le',), key + (format_value(bound),)),
+                   total)
+        yield self.name + '_sum' + format_labels(self.labels, key), value[-1]
+        yield self.name + '_count' + format_labels(self.labels, key), total
+
+
+class Timer(object):
+    """Context manager observing the seconds spent in the block"""
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.time() - self.start, **self.labels)
+
+
+class Registry(object):
+    """Metrics of the process. Metrics are defined once, at import time, by
+    the modules updating them:
+
+        lookups = registry.counter('etag_lookups', 'ETag store lookups', ['result'])
+        lookups.inc(result='hit')
+
+    Collectors are called before reading the metrics, to update the gauges
+    with the current state of the process (e.g. the connection pools).
+    """
+
+    def __init__(self):
+        self.metrics = OrderedDict()
+        self.collectors = []
+        self.pid = os.getpid()
+
+    def register(self, metric):
+        if metric.name in self.metrics:
+            raise ValueError("Metric %s is already registered" % metric.name)
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help, labels=()):
+        return self.register(Counter(name, help, labels))
+
+    def gauge(self, name, help, labels=()):
+        return self.register(Gauge(name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def collector(self, fn):
+        """Register a function called before reading the metrics"""
+        self.collectors.append(fn)
+        return fn
+
+    def check_pid(self):
+        """Forget the values inherited from the parent in a forked process"""
+        pid = os.getpid()
+        if pid != self.pid:
+            self.pid = pid
+            for metric in self.metrics.values():
+                metric.reset()
+
+    def collect(self):
+        for fn in self.collectors:
+            fn()
+
+    def snapshot(self):
+        """Values of the metrics, as a JSON serializable dict"""
+        self.collect()
+        return dict((name, metric.snapshot()) for name, metric in six.iteritems(self.metrics))
+
+
+# Metrics of the application
+registry = Registry()
+
+# Requests by endpoint and method
+requests_total = registry.counter('http_requests', 'HTTP requests by endpoint, method and status',
+                                  ['endpoint', 'method', 'status'])
+request_latency = registry.histogram('http_request_duration_seconds', 'HTTP request latency by endpoint and method',
+                                     ['endpoint', 'method'])
+
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as err:
+        return err.errno == errno.EPERM
+    return True
+
+
+class Metrics(object):
+    """Exposes the metrics in the Prometheus text format, and records the
+    request count and latency of every endpoint and method.
+
+    With METRICS_DIR, every process writes its metrics to its own file in the
+    directory (at most every METRICS_FLUSH_INTERVAL seconds, after a request)
+    and the exposed metrics aggregate the files of all processes: counters and
+    histograms are added (including those of processes that exited, so they
+    never go backwards), gauges are reported by process with a pid label, and
+    only for running processes. The directory must be emptied when the server
+    starts. The metrics belong to the process, so the applications of a process
+    share the registry and the directory.
+    """
+
+    def __init__(self, app=None, registry=registry):
+        self.registry = registry
+        self.directory = None
+        self.flushed = 0
+
+        if app:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('METRICS_ENABLED', True)
+        app.config.setdefault('METRICS_DIR', None)
+        app.config.setdefault('METRICS_FLUSH_INTERVAL', 1.0)
+
+        app.extensions['metrics'] = self
+        if not app.config.get('METRICS_ENABLED'):
+            return
+
+        if app.config.get('METRICS_DIR') and not self.directory:
+            atexit.register(self.flush)
+        self.directory = app.config.get('METRICS_DIR') or self.directory
+
+        app.before_request(self.before_request)
+        app.after_request(self.after_request)
+
+    def before_request(self):
+        self.registry.check_pid()
+        request.metrics_start = time.time()
+
+    def after_request(self, response):
+        start = getattr(request, 'metrics_start', None)
+        if start is None:
+            return response
+
+        endpoint = request.endpoint or 'none'
+        requests_total.inc(endpoint=endpoint, method=request.method, status=response.status_code)
+        request_latency.observe(time.time() - start, endpoint=endpoint, method=request.method)
+
+        if self.directory and time.time() - self.flushed >= current_app.config.get('METRICS_FLUSH_INTERVAL'):
+            self.flush()
+
+        return response
+
+    def path(self, pid):
+        return os.path.join(self.directory, 'metrics-%d.json' % pid)
+
+    def clear(self):
+        """Remove the files of all processes, when the server starts"""
+        if not self.directory:
+            return
+
+        for name in os.listdir(self.directory):
+            if name.startswith('metrics-') and (name.endswith('.json') or name.endswith('.tmp')):
+                os.remove(os.path.join(self.directory, name))
+
+    def flush(self):
+        """Write the metrics of the process to its file"""
+        if not self.directory:
+            return
+
+        self.flushed = time.time()
+        path = self.path(os.getpid())
+        with open(path + '.tmp', 'w') as f:
+            json.dump(self.registry.snapshot(), f)
+
+        # Readers never see a partially written file
+        os.rename(path + '.tmp', path)
+
+    def snapshots(self):
+        """Snapshots of the metrics by process id"""
+        if not self.directory:
+            return {os.getpid(): self.registry.snapshot()}
+
+        self.flush()
+        snapshots = dict()
+        for name in os.listdir(self.directory):
+            if not (name.startswith('metrics-') and name.endswith('.json')):
+                continue
+
+            try:
+                with open(os.path.join(self.directory, name)) as f:
+                    snapshots[int(name[8:-5])] = json.load(f)
+            except (IOError, ValueError):
+                # Removed or being replaced
+                continue
+
+        return snapshots
+
+    def aggregate(self):
+        """Values of every metric as a dict of label values to value"""
+        values = dict((name, dict()) for name in self.registry.metrics)
+        for pid, snapshot in six.iteritems(self.snapshots()):
+            for name, samples in six.iteritems(snapshot):
+                metric = self.registry.metrics.get(name, None)
+                if metric is None:
+                    continue
+
+                for key, value in samples:
+                    if metric.type == 'gauge':
+                        if self.directory and pid_alive(pid):
+                            values[name][tuple(key) + (six.text_type(pid),)] = value
+                        elif not self.directory:
+                            values[name][tuple(key)] = value
+                    else:
+                        values[name][tuple(key)] = metric.merge(values[name].get(tuple(key), None), value)
+
+        return values
+
+    def expose(self):
+        """Metrics in the Prometheus text exposition format"""
+        lines = []
+        for name, values in six.iteritems(self.aggregate()):
+            metric = self.registry.metrics[name]
+            lines.append('# HELP %s %s' % (name, metric.help.replace('\\', '\\\\').replace('\n', '\\n')))
+            lines.append('# TYPE %s %s' % (name, metric.type))
+
+            labels = metric.labels
+            if metric.type == 'gauge' and self.directory:
+                metric = Gauge(name, metric.help, labels + ('pid',))
+
+            for key in sorted(values):
+                for sample, value in metric.expose(key, values[key]):
+                    lines.append('%s %s' % (sample, format_value(value)))
+
+        return '\n'.join(lines) + '\n'
+
+
+metrics = Metrics()
@@ -0,0 +1,237 @@
+from __future__ import absolute_import
+from __future__ import unicode_literals
+import threading
+import time
+import traceback
+from collections import OrderedDict
+
+from flask import current_app
+from sqlalchemy import event
+from sqlalchemy.pool import QueuePool
+
+from .metrics import LATENCY_BUCKETS, format_value, registry
+
+checkout_wait = registry.histogram('db_pool_checkout_wait_seconds', 'Time waiting for a connection of the pool',
+                                   ['pool'])
+connect_latency = registry.histogram('db_pool_connect_seconds', 'Time opening a database connection')
+connections_held = registry.counter('db_pool_long_held', 'Database connections held over SQLALCHEMY_POOL_HOLD_WARN')
+connections_in_use = registry.gauge('db_pool_in_use', 'Database connections checked out of the pools')
+connections_overflow = registry.gauge('db_pool_overflow', 'Database connections in overflow by pool', ['pool'])
+
+
+class TimedQueuePool(QueuePool):
+    """Queue pool timing the checkouts: the time waiting for a connection to
+    be returned when the pool is exhausted, and opening new connections.
+    The pools of the engines instrumented by PoolMonitor report the time to
+    its on_wait callback"""
+
+    on_wait = None
+
+    def _do_get(self):
+        start = time.time()
+        try:
+            return super(TimedQueuePool, self)._do_get()
+        finally:
+            if self.on_wait is not None:
+                self.on_wait(time.time() - start)
+
+    def recreate(self):
+        # Disposing the engine recreates the pool
+        pool = super(TimedQueuePool, self).recreate()
+        pool.on_wait = self.on_wait
+        return pool
+
+
+class PoolMonitor(object):
+    """Instruments the connection pools of the database engines.
+
+    Records the time waiting for a connection of the pool (with a
+    TimedQueuePool, which is used instead of the QueuePool of the engines),
+    the time spent opening new connections (connections slower than
+    SQLALCHEMY_POOL_CONNECT_WARN seconds are logged, as checkouts waiting
+    longer than SQLALCHEMY_POOL_CHECKOUT_WARN seconds), the connections in
+    use and in overflow, and the connections held for longer than
+    SQLALCHEMY_POOL_HOLD_WARN seconds, which are reported in the application
+    log with the stack that checked them out (when
+    SQLALCHEMY_POOL_TRACK_STACKS is enabled).
+    """
+
+    def __init__(self, app=None, db=None):
+        self.engines = []
+        self.checkouts = 0
+        self.waits = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.wait_time = 0.0
+        self.wait_time_max = 0.0
+        self.slow_waits = 0
+        self.connects = 0
+        self.connect_time = 0.0
+        self.connect_time_max = 0.0
+        self.slow_connects = 0
+        self.long_held = 0
+
+        self._held = dict()
+        self._lock = threading.Lock()
+
+        if app and db:
+            self.init_app(app, db)
+
+    def init_app(self, app, db):
+        app.config.setdefault('SQLALCHEMY_POOL_CHECKOUT_WARN', 1.0)
+        app.config.setdefault('SQLALCHEMY_POOL_CONNECT_WARN', 1.0)
+        app.config.setdefault('SQLALCHEMY_POOL_HOLD_WARN', 5.0)
+        app.config.setdefault('SQLALCHEMY_POOL_TRACK_STACKS', False)
+
+        app.extensions['pool_monitor'] = self
+        if self.collect not in registry.collectors:
+            registry.collector(self.collect)
+        db.pool_class = TimedQueuePool
+        db.on_engine_created(self.attach)
+
+    def attach(self, engine, app):
+        # The configuration of the application of the engine, not of the
+        # current one, as connections are also used outside of requests
+        def on_do_connect(dialect, connection_record, cargs, cparams):
+            connection_record.info['connect_start'] = time.time()
+
+        def on_connect(dbapi_connection, connection_record):
+            start = connection_record.info.pop('connect_start', None)
+            if start is not None:
+                self.record_connect(app, time.time() - start)
+
+        def on_checkout(dbapi_connection, connection_record, connection_proxy):
+            self.on_checkout(app, connection_record)
+
+        def on_checkin(dbapi_connection, connection_record):
+            self.on_checkin(app, connection_record)
+
+        if isinstance(engine.pool, TimedQueuePool):
+            name = repr(engine.url)
+            engine.pool.on_wait = lambda elapsed: self.record_wait(app, name, elapsed)
+
+        event.listen(engine, 'do_connect', on_do_connect)
+        event.listen(engine, 'connect', on_connect)
+        event.listen(engine, 'checkout', on_checkout)
+        event.listen(engine, 'checkin', on_checkin)
+        self.engines.append(engine)
+
+    def record_wait(self, app, name, elapsed):
+        slow = elapsed > app.config.get('SQLALCHEMY_POOL_CHECKOUT_WARN')
+        with self._lock:
+            self.wait_time += elapsed
+            self.wait_time_max = max(self.wait_time_max, elapsed)
+            for i, bound in enumerate(LATENCY_BUCKETS + (float('inf'), )):
+                if elapsed <= bound:
+                    self.waits[i] += 1
+                    break
+            if slow:
+                self.slow_waits += 1
+        checkout_wait.observe(elapsed, pool=name)
+
+        if slow:
+            app.logger.warning('Waited %.3f seconds for a database connection', elapsed)
+
+    def record_connect(self, app, elapsed):
+        slow = elapsed > app.config.get('SQLALCHEMY_POOL_CONNECT_WARN')
+        with self._lock:
+            self.connects += 1
+            self.connect_time += elapsed
+            self.connect_time_max = max(self.connect_time_max, elapsed)
+            if slow:
+                self.slow_connects += 1
+        connect_latency.observe(elapsed)
+
+        if slow:
+            app.logger.warning('Opening a database connection took %.3f seconds', elapsed)
+
+    def on_checkout(self, app, connection_record):
+        stack = None
+        if app.config.get('SQLALCHEMY_POOL_TRACK_STACKS'):
+            # Skip the frames of this function and the listener
+            stack = traceback.format_stack()[:-2]
+
+        with self._lock:
+            self.checkouts += 1
+            self._held[id(connection_record)] = (time.time(), threading.current_thread().name, stack)
+
+    def on_checkin(self, app, connection_record):
+        with self._lock:
+            held = self._held.pop(id(connection_record), None)
+
+        if held is None:
+            return
+
+        start, thread, stack = held
+        elapsed = time.time() - start
+        if elapsed > app.config.get('SQLALCHEMY_POOL_HOLD_WARN'):
+            with self._lock:
+                self.long_held += 1
+            connections_held.inc()
+            app.logger.warning('Database connection held for %.3f seconds by thread %s%s', elapsed, thread,
+                               (', checked out at:\n' + ''.join(stack)) if stack else '')
+
+    def held(self, min_time=0):
+        """List of the connections in use for at least min_time seconds"""
+        with self._lock:
+            held = list(self._held.values())
+
+        now = time.time()
+        return [dict(held=now - start, thread=thread, stack=stack)
+                for start, thread, stack in sorted(held, key=lambda h: h[0]) if now - start >= min_time]
+
+    def before_fork(self):
+        """Close the connections of the pools, so forked processes do not share them"""
+        for engine in self.engines:
+            engine.dispose()
+
+    def collect(self):
+        """Update the gauges of the metrics"""
+        connections_in_use.set(len(self._held))
+        for engine in self.engines:
+            if hasattr(engine.pool, 'overflow'):
+                connections_overflow.set(engine.pool.overflow(), pool=repr(engine.url))
+
+    def wait_stats(self):
+        """Histogram of the time waiting for connections (by upper bound in
+        seconds, not cumulative) with its count, sum and maximum"""
+        with self._lock:
+            waits = list(self.waits)
+            count = sum(waits)
+            return dict(
+                count=count,
+                sum=self.wait_time,
+                max=self.wait_time_max,
+                avg=self.wait_time / count if count else 0.0,
+                slow=self.slow_waits,
+                buckets=OrderedDict(zip([format_value(bound) for bound in LATENCY_BUCKETS + (float('inf'), )],
+                                        waits))
+            )
+
+    def stats(self):
+        pools = []
+        for engine in self.engines:
+            pool = engine.pool
+            pools.append(dict(
+                url=repr(engine.url),
+                pool=pool.__class__.__name__,
+                size=pool.size() if hasattr(pool, 'size') else None,
+                checked_in=pool.checkedin() if hasattr(pool, 'checkedin') else None,
+                checked_out=pool.checkedout() if hasattr(pool, 'checkedout') else None,
+                overflow=pool.overflow() if hasattr(pool, 'overflow') else None
+            ))
+
+        return dict(
+            pools=pools,
+            in_use=len(self._held),
+            checkouts=self.checkouts,
+            checkout_wait=self.wait_stats(),
+            connects=self.connects,
+            connect_time=self.connect_time,
+            connect_time_max=self.connect_time_max,
+            connect_time_avg=self.connect_time / self.connects if self.connects else 0.0,
+            slow_connects=self.slow_connects,
+            long_held=self.long_held,
+            held=self.held(current_app.config.get('SQLALCHEMY_POOL_HOLD_WARN'))
+        )
+
+
+pool_monitor = PoolMonitor()
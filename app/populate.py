@@ -0,0 +1,154 @@
+from __future__ import absolute_import
+from __future__ import unicode_literals
+import hashlib
+import random
+from datetime import datetime, timedelta
+
+from app import db
+from app.util import now
+from app.constants import Genders, GrantTypes, ResponseTypes
+from app.auth.models import User, UserDetails, Application, Client, Token, hash_password
+from app.cache.models import Etag
+
+FIRST_NAMES = ('Juan', 'Pablo', 'Maria', 'Ana', 'Pedro', 'Carolina', 'Diego', 'Francisca', 'Tomas', 'Valentina',
+               'Jose', 'Camila', 'Felipe', 'Javiera', 'Matias', 'Catalina', 'Benjamin', 'Fernanda', 'Vicente', 'Sofia')
+LAST_NAMES = ('Perez', 'Gonzalez', 'Munoz', 'Rojas', 'Diaz', 'Soto', 'Contreras', 'Silva', 'Martinez', 'Sepulveda',
+              'Morales', 'Rodriguez', 'Lopez', 'Fuentes', 'Hernandez', 'Torres', 'Araya', 'Flores', 'Espinoza', 'Valdes')
+WORDS = ('data', 'cloud', 'mobile', 'open', 'city', 'social', 'smart', 'green', 'fast', 'local', 'media', 'labs')
+
+
+class Generator(object):
+    """Generates synthetic users, with details, applications, clients,
+    tokens and ETags, inserted in batches with executemany.
+
+    The same seed generates the same data. All the users share the same
+    password, hashed only once, so generation is not bound by the cost of
+    password hashing. Primary keys are assigned by the generator, starting
+    after the existing rows, so the rows can be inserted without reading back
+    the generated identifiers.
+    """
+
+    def __init__(self, seed=None, password='password', users_per_app=100, batch_size=10000):
+        self.random = random.Random(seed)
+        self.password = hash_password(password)
+        self.users_per_app = users_per_app
+        self.batch_size = batch_size
+        self.timestamp = now()
+
+    def hex(self, size):
+        """Random hexadecimal string of the given size, from the generator seed"""
+        return '%0*x' % (size, self.random.getrandbits(size * 4))
+
+    def next_id(self, model):
+        return (db.session.query(db.func.max(model.id)).scalar() or 0) + 1
+
+    def user(self, user_id, details_id):
+        rnd = self.random
+        first, last = rnd.choice(FIRST_NAMES), rnd.choice(LAST_NAMES)
+        username = self.hex(32)
+
+        user = dict(id=user_id, created=self.timestamp, modified=self.timestamp,
+                    email='%s.%s.%d@example.com' % (first.lower(), last.lower(), user_id),
+                    username=username, _password=self.password, is_admin=False)
+        details = dict(id=details_id, created=self.timestamp, modified=self.timestamp, user_id=user_id,
+                       name='%s %s' % (first, last),
+                       url='http://%s.example.com/%s' % (rnd.choice(WORDS), username[:8]) if rnd.random() < 0.3 else None,
+                       bio=' '.join(rnd.choice(WORDS) for i in range(rnd.randint(3, 20))) if rnd.random() < 0.5 else None,
+                       born=datetime(1950, 1, 1) + timedelta(days=rnd.randint(0, 365 * 55)),
+                       gender=rnd.choice((Genders.M, Genders.F, None)))
+
+        return user, details
+
+    def application(self, app_id, owner_id):
+        rnd = self.random
+        name = '%s %s' % (rnd.choice(WORDS).capitalize(), rnd.choice(WORDS))
+        application = dict(id=app_id, created=self.timestamp, modified=self.timestamp, owner_id=owner_id,
+                           name=name, description='The %s application' % name,
+                           url='http://%s.example.com' % name.replace(' ', '-').lower())
+        client = dict(client_id=self.hex(32), client_secret=self.hex(16), created=self.timestamp,
+                      modified=self.timestamp, app_id=app_id, name='%s client' % name,
+                      is_confidential=rnd.random() < 0.5, _redirect_uris='http://localhost',
+                      _default_scopes='user',
+                      allowed_grant_types=[GrantTypes.PASSWORD, GrantTypes.REFRESH_TOKEN],
+                      allowed_response_types=[ResponseTypes.TOKEN])
+
+        return application, client
+
+    def token(self, token_id, user_id, client_id):
+        # A quarter of the tokens are expired
+        expires = self.timestamp + timedelta(seconds=self.random.randint(-3600, 3 * 3600))
+        return dict(id=token_id, client_id=client_id, user_id=user_id, token_type='Bearer',
+                    access_token=self.hex(30), refresh_token=self.hex(30), expires=expires, _scopes='user')
+
+    def etag(self, username):
+        uri = '/v1/user/%s/' % username
+        return dict(uri=uri, created=self.timestamp, modified=self.timestamp,
+                    value=hashlib.sha1(uri.encode()).hexdigest())
+
+    def insert(self, model, rows):
+        if rows:
+            # Keep the None values, so all the rows go in a single executemany
+            db.session.bulk_insert_mappings(model, rows, render_nulls=True)
+
+    def generate(self, users, progress=None):
+        """Generate and insert the given number of users, committing after every
+        batch. The progress callback is called with the number of users
+        inserted after every batch. Return the number of rows per model"""
+        counts = dict((model.__name__, 0) for model in (User, UserDetails, Application, Client, Token, Etag))
+
+        user_id = self.next_id(User)
+        details_id = self.next_id(UserDetails)
+        app_id = self.next_id(Application)
+        token_id = self.next_id(Token)
+        clients = [client_id for client_id, in db.session.query(Client.client_id).limit(100)]
+
+        generated = 0
+        while generated < users:
+            batch = dict((model, []) for model in (User, UserDetails, Application, Client, Token, Etag))
+
+            for i in range(min(self.batch_size, users - generated)):
+                user, details = self.user(user_id, details_id)
+                batch[User].append(user)
+                batch[UserDetails].append(details)
+                batch[Etag].append(self.etag(user['username']))
+
+                if generated % self.users_per_app == 0 or not clients:
+                    application, client = self.application(app_id, user_id)
+                    batch[Application].append(application)
+                    batch[Client].append(client)
+                    clients.append(client['client_id'])
+                    app_id += 1
+
+                batch[Token].append(self.token(token_id, user_id, self.random.choice(clients)))
+                token_id += 1
+                details_id += 1
+                user_id += 1
+                generated += 1
+
+            # Insert parents first
+            for model in (User, UserDetails, Application, Client, Token, Etag):
+                self.insert(model, batch[model])
+                counts[model.__name__] += len(batch[model])
+            db.session.commit()
+
+            if progress is not None:
+                progress(generated)
+
+        self.fix_sequences()
+        return counts
+
+    def fix_sequences(self):
+        """Move the PostgreSQL sequences after the identifiers assigned by the generator"""
+        if db.session.get_bind().dialect.name != 'postgresql':
+            return
+
+        for model in (User, UserDetails, Application, Token):
+            table = model.__table__.name
+            db.session.execute("SELECT setval(pg_get_serial_sequence('%s', 'id'), (SELECT max(id) FROM %s))"
+                               % (table, table))
+        db.session.commit()
+
+
+def populate(users, seed=None, batch_size=10000, progress=None):
+    """Generate the given number of synthetic users, see Generator"""
+    return Generator(seed=seed, batch_size=batch_size).generate(users, progress=progress)
@@ -0,0 +1,145 @@
+from __future__ import absolute_import
+from __future__ import unicode_literals
+import cProfile
+import io
+import os
+import pstats
+import random
+import re
+import time
+from datetime import datetime
+
+from flask import current_app, request
+
+from .util import is_admin_request
+
+# Name of the profile files: <time>-<latency>ms-<method>-<endpoint>.prof
+_profile_name = re.compile(r'^(\d{8}T\d{6}\.\d{6})-(\d+)ms-([A-Z]+)-(.+)\.prof$')
+
+
+def profile_name(start, latency, method, endpoint):
+    return '%s-%dms-%s-%s.prof' % (datetime.utcfromtimestamp(start).strftime('%Y%m%dT%H%M%S.%f'),
+                                   latency * 1000, method, endpoint)
+
+
+def list_profiles(directory):
+    """Profiles in the directory, newest first, as dicts with the name, time,
+    latency (in milliseconds), method and endpoint of the request"""
+    profiles = []
+    if not os.path.isdir(directory):
+        return profiles
+
+    for name in os.listdir(directory):
+        match = _profile_name.match(name)
+        if match:
+            profiles.append(dict(
+                name=name,
+                time=datetime.strptime(match.group(1), '%Y%m%dT%H%M%S.%f'),
+                latency=int(match.group(2)),
+                method=match.group(3),
+                endpoint=match.group(4)
+            ))
+
+    return sorted(profiles, key=lambda p: p['name'], reverse=True)
+
+
+def summarize(paths, sort='cumulative', limit=30):
+    """Text summary of the profile files (their stats are added), with the
+    limit functions with the highest sort key"""
+    stream = io.StringIO() if str is not bytes else io.BytesIO()
+    stats = pstats.Stats(*paths, stream=stream)
+    stats.strip_dirs().sort_stats(sort).print_stats(limit)
+    return stream.getvalue()
+
+
+class Profiler(object):
+    """Runs requests under cProfile and writes their stats to PROFILE_DIR.
+
+    When PROFILE_ENABLED, a request is profiled if it has the PROFILE_HEADER
+    header and a bearer token of an administrator, or else with a probability
+    of PROFILE_SAMPLE_RATE. Only the newest PROFILE_MAX_FILES profiles are kept.
+    The name of the profile is returned in the PROFILE_HEADER header of the
+    response. Requests failing with an uncaught exception are not profiled.
+    """
+
+    def __init__(self, app=None, auth=None):
+
+        if app:
+            self.init_app(app, auth)
+
+    def init_app(self, app, auth=None):
+        self.auth = auth
+        app.config.setdefault('PROFILE_ENABLED', False)
+        app.config.setdefault('PROFILE_HEADER', 'X-Profile')
+        app.config.setdefault('PROFILE_SAMPLE_RATE', 0.0)
+        app.config.setdefault('PROFILE_DIR', os.path.join(os.path.dirname(app.root_path), 'log', 'profiles'))
+        app.config.setdefault('PROFILE_MAX_FILES', 100)
+
+        app.extensions['profiler'] = self
+
+        # Run first and last, to profile the other request hooks
+        app.before_request_funcs.setdefault(None, []).insert(0, self.before_request)
+        app.after_request_funcs.setdefault(None, []).insert(0, self.after_request)
+        app.teardown_request(self.teardown_request)
+
+    def requested(self):
+        """The request asks for profiling with the header, and is from an administrator"""
+        return current_app.config.get('PROFILE_HEADER') in request.headers and is_admin_request(self.auth)
+
+    def before_request(self):
+        if not current_app.config.get('PROFILE_ENABLED'):
+            return
+
+        sample_rate = current_app.config.get('PROFILE_SAMPLE_RATE')
+        if not (self.requested() or (sample_rate and random.random() < sample_rate)):
+            return
+
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Another profiler is active (e.g. a concurrent request)
+            return
+
+        request.profiler = profiler
+        request.profile_start = time.time()
+
+    def after_request(self, response):
+        profiler = getattr(request, 'profiler', None)
+        if profiler is None:
+            return response
+
+        profiler.disable()
+        request.profiler = None
+
+        start = request.profile_start
+        name = profile_name(start, time.time() - start, request.method, request.endpoint or 'none')
+        self.write(profiler, name)
+
+        response.headers[current_app.config.get('PROFILE_HEADER')] = name
+        return response
+
+    def teardown_request(self, exc=None):
+        # Uncaught exceptions skip the after request functions, the thread
+        # must not stay profiled
+        profiler = getattr(request, 'profiler', None)
+        if profiler is not None:
+            profiler.disable()
+            request.profiler = None
+
+    def write(self, profiler, name):
+        directory = current_app.config.get('PROFILE_DIR')
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        profiler.dump_stats(os.path.join(directory, name))
+
+        for profile in list_profiles(directory)[current_app.config.get('PROFILE_MAX_FILES'):]:
+            try:
+                os.remove(os.path.join(directory, profile['name']))
+            except OSError:
+                # Removed by another process
+                pass
+
+
+profiler = Profiler()
@@ -0,0 +1,130 @@
+from __future__ import absolute_import
+from __future__ import unicode_literals
+import re
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from flask import current_app, request, has_request_context
+from sqlalchemy import event
+
+# Lists of parameters in IN clauses change with the number of values
+_in_params = re.compile(r'IN \((?:[^()]*?)\)', re.IGNORECASE)
+_spaces = re.compile(r'\s+')
+
+
+def statement_shape(statement):
+    """Normalize the statement so queries differing only in their
+    parameters have the same shape"""
+    return _in_params.sub('IN (...)', _spaces.sub(' ', statement)).strip()
+
+
+class Queries(object):
+    """Count and time of the SQL statements of a request (or block)"""
+
+    def __init__(self):
+        self.count = 0
+        self.time = 0.0
+        self.shapes = Counter()
+
+    def record(self, statement, elapsed):
+        self.count += 1
+        self.time += elapsed
+        self.shapes[statement_shape(statement)] += 1
+
+    def repeated(self, threshold):
+        """List of (shape, count) of the statements executed at least threshold times"""
+        return [(shape, count) for shape, count in self.shapes.most_common() if count >= threshold]
+
+
+class QueryStats(object):
+    """Counts the SQL statements and total SQL time of every request.
+
+    Requests with more than SQL_WARN_COUNT statements or SQL_WARN_TIME seconds
+    spent in the database, or executing the same statement shape at least
+    SQL_REPEAT_WARN times (the sign of an N+1 query pattern) are logged in the
+    application log. With SQL_STATS_HEADERS (by default in debug mode),
+    the X-Query-Count and X-Query-Time (in milliseconds) headers are added
+    to the responses.
+    """
+
+    def __init__(self, app=None, db=None):
+        self._captures = []
+        self._lock = threading.Lock()
+
+        if app and db:
+            self.init_app(app, db)
+
+    def init_app(self, app, db):
+        app.config.setdefault('SQL_WARN_COUNT', 20)
+        app.config.setdefault('SQL_WARN_TIME', 0.5)
+        app.config.setdefault('SQL_REPEAT_WARN', 5)
+        app.config.setdefault('SQL_STATS_HEADERS', None)
+
+        app.extensions['query_stats'] = self
+        db.on_engine_created(self.attach)
+        app.before_request(self.before_request)
+        app.after_request(self.after_request)
+
+    def attach(self, engine, app):
+        event.listen(engine, 'before_cursor_execute', self.before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', self.after_cursor_execute)
+        event.listen(engine, 'handle_error', self.handle_error)
+
+    def before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_start', []).append(time.time())
+
+    def after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.time() - conn.info['query_start'].pop()
+
+        if has_request_context():
+            queries = getattr(request, 'queries', None)
+            if queries is not None:
+                queries.record(statement, elapsed)
+
+        if self._captures:
+            for queries in list(self._captures):
+                queries.record(statement, elapsed)
+
+    def handle_error(self, context):
+        # Failed statements are not executed after, forget their start time
+        if context.execution_context is not None and context.connection.info.get('query_start'):
+            context.connection.info['query_start'].pop()
+
+    def before_request(self):
+        request.queries = Queries()
+
+    def after_request(self, response):
+        queries = getattr(request, 'queries', None)
+        if queries is None:
+            return response
+
+        repeated = queries.repeated(current_app.config.get('SQL_REPEAT_WARN'))
+        if repeated or queries.count > current_app.config.get('SQL_WARN_COUNT') or \
+                queries.time > current_app.config.get('SQL_WARN_TIME'):
+            current_app.logger.warning('%s %s executed %d SQL statements in %.3f seconds%s',
+                                       request.method, request.path, queries.count, queries.time,
+                                       ''.join('\n  %d times: %s' % (count, shape) for shape, count in repeated))
+
+        headers = current_app.config.get('SQL_STATS_HEADERS')
+        if headers or (headers is None and current_app.debug):
+            response.headers['X-Query-Count'] = str(queries.count)
+            response.headers['X-Query-Time'] = '%.3f' % (queries.time * 1000)
+
+        return response
+
+    @contextmanager
+    def capture(self):
+        """Count the statements executed in the block, by any request"""
+        queries = Queries()
+        with self._lock:
+            self._captures.append(queries)
+        try:
+            yield queries
+        finally:
+            with self._lock:
+                self._captures.remove(queries)
+
+
+query_stats = QueryStats()
@@ -3,29 +3,91 @@ from __future__ import unicode_literals
 import types
 import re
 import functools
+import threading
 
-from flask import make_response, json, request
+from flask import current_app, make_response, json, request
+from werkzeug.exceptions import HTTPException
+from werkzeug.test import EnvironBuilder
 from restless.fl import FlaskResource
 from restless.preparers import FieldsPreparer
-from restless.exceptions import BadRequest, NotFound, Unauthorized
+from restless.exceptions import HttpError, BadRequest, Conflict, NotFound, Unauthorized
 from .http_errors import PreconditionFailed, PreconditionRequired
 from .constants import NOT_MODIFIED
+from .metrics import registry
+from . import tracing
 import six
 
-from .cache import etag
-
 # Abstract the exceptions
+HttpError = HttpError
 BadRequest = BadRequest
+Conflict = Conflict
 NotFound = NotFound
 Unauthorized = Unauthorized
 PreconditionRequired = PreconditionRequired
 PreconditionFailed = PreconditionFailed
 
+# Responses to GET requests, to follow the ratio of not modified responses
+get_responses = registry.counter('api_get_responses', 'Responses to GET requests of API resources by endpoint, '
+                                 'status and whether the request was conditional (If-None-Match)',
+                                 ['endpoint', 'status', 'conditional'])
+
+
+class SingleFlight(object):
+    """Coalesces concurrent calls with the same key.
+
+    The first caller for a key (the leader) executes the function, while callers
+    arriving before it finishes wait and share its result (or its exception).
+    The number of executed and coalesced calls is kept for monitoring.
+    """
+
+    class Call(object):
+        def __init__(self):
+            self.event = threading.Event()
+            self.result = None
+            self.error = None
+
+    def __init__(self):
+        self.executed = 0
+        self.coalesced = 0
+        self._calls = dict()
+        self._lock = threading.Lock()
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key, None)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = SingleFlight.Call()
+                self.executed += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+        except Exception as err:
+            call.error = err
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+
+        return call.result
+
+    def stats(self):
+        return dict(executed=self.executed, coalesced=self.coalesced)
+
 
 class Resource(FlaskResource):
     def __init__(self, api):
         self.api = api
-        self.app = api.app
+        self.app = current_app._get_current_object()
         self.auth = api.auth
         self.user = None
         self.client = None
@@ -49,7 +111,38 @@ class Resource(FlaskResource):
 
         return not_null_data
 
+    def serialize_list(self, data):
+        # Same as restless, with the preparation and serialization traced
+        if data is None:
+            return ''
+
+        with tracing.span('prepare'):
+            if not getattr(data, 'should_prepare', True):
+                prepped_data = data.value
+            else:
+                prepped_data = [self.prepare(item) for item in data]
+
+        with tracing.span('serialize'):
+            return self.serializer.serialize(self.wrap_list_response(prepped_data))
+
+    def serialize_detail(self, data):
+        if data is None:
+            return ''
+
+        with tracing.span('prepare'):
+            if not getattr(data, 'should_prepare', True):
+                prepped_data = data.value
+            else:
+                prepped_data = self.prepare(data)
+
+        with tracing.span('serialize'):
+            return self.serializer.serialize(prepped_data)
+
     def is_authenticated(self):
+        with tracing.span('authenticate'):
+            return self.authenticate()
+
+    def authenticate(self):
         if not self.auth:
             return True
 
@@ -66,7 +159,13 @@ class Resource(FlaskResource):
         if hasattr(callback, 'scopes'):
             scopes = callback.scopes
 
-        valid, req = self.auth.verify_request(scopes)
+        if getattr(request, 'oauth', None) is not None:
+            # The token was already verified (e.g. by a batch request),
+            # only the scopes need to be checked
+            req = request.oauth
+            valid = not scopes or bool(set(req.access_token.scopes) & set(scopes))
+        else:
+            valid, req = self.auth.verify_request(scopes)
 
         if hasattr(callback, 'admin') and \
            callback.admin and \
@@ -82,17 +181,65 @@ class Resource(FlaskResource):
 
     def handle(self, endpoint, *args, **kwargs):
         '''
-        Overrides method handle of restless to handle etags.
+        Overrides method handle of restless to coalesce identical concurrent GET requests
+        (same path, query, credentials and conditional headers), so only one of them is
+        computed and the rest share the response.
+        '''
+        if self.request.method != 'GET':
+            return self.handle_admitted(endpoint, *args, **kwargs)
+
+        if not self.app.config.get('API_COALESCE_GETS'):
+            return self.count(self.handle_admitted(endpoint, *args, **kwargs))
+
+        key = (self.request.full_path,
+               self.request.headers.get('Authorization', None),
+               self.request.headers.get('If-None-Match', None))
+
+        def freeze():
+            # Responses are not shared between threads, only their contents
+            response = self.handle_admitted(endpoint, *args, **kwargs)
+            return response.get_data(), response.status_code, list(response.headers.items())
+
+        data, status, headers = self.api.flights.do(key, freeze)
+        return self.count(make_response(data, status, headers))
+
+    def count(self, response):
+        get_responses.inc(endpoint=self.request.endpoint, status=response.status_code,
+                          conditional=bool(self.request.if_none_match))
+        return response
+
+    def handle_admitted(self, endpoint, *args, **kwargs):
+        '''
+        Handles the request once it is admitted by the admission control of the
+        application, if configured.
+        '''
+        admission = self.app.extensions.get('admission', None)
+        if admission is None:
+            return self.handle_etag(endpoint, *args, **kwargs)
+
+        from .admission import resource_class
+        with admission.limit(*resource_class(self.request)):
+            return self.handle_etag(endpoint, *args, **kwargs)
+
+    def handle_etag(self, endpoint, *args, **kwargs):
+        '''
+        Handles etags over the method handle of restless.
         For now only handles etag for conditional gets (http://fideloper.com/api-etag-conditional-get)
         (with strong etags) and concurrency control (http://fideloper.com/etags-and-optimistic-concurrency-control).
+        The etags of the compressed representations (see Compress) are accepted as well.
         Based on http://flask.pocoo.org/snippets/95/.
         '''
+        # The etags are stored with the models, imported with the views
+        from .cache import etag
+        from .cache.compress import etag_matches
+
         local_etag = None
+        stored_etag = None
 
         # First case is the request for a single resource, ex: '/blog/post/1'
         if endpoint == 'detail':
             # See if there is an etag stored from the URI
-            local_etag = etag.get_etag(self.request.path)
+            stored_etag = local_etag = etag.get_etag(self.request.path)
 
             if self.request.method in ('PUT', 'DELETE'):
                 # for put and delete methods, it must have an if if_match header
@@ -102,11 +249,11 @@ class Resource(FlaskResource):
 
                 # If the stored etag is not the same in the if_match header,
                 # then the content has changed and we fail the update with a 412
-                if local_etag not in self.request.if_match:
+                if not etag_matches(local_etag, self.request.if_match):
                     raise PreconditionFailed
 
             elif self.request.method == 'GET' and self.request.if_none_match and \
-                    local_etag in self.request.if_none_match:
+                    etag_matches(local_etag, self.request.if_none_match):
                 # if the method is get, if it have a header if_none_match end the etag is the same one stored,
                 # do nothing and return the same etag
                 response = make_response()
@@ -117,15 +264,19 @@ class Resource(FlaskResource):
 
         # Obtain the real response for the method
         response = super(Resource, self).handle(endpoint, *args, **kwargs)
+        if endpoint == 'list' and self.request.method in ('POST', 'PUT') and isinstance(self.data, list):
+            # Bulk operations store the etag of every item in the list themselves
+            return response
+
         if endpoint == 'list':
             #  for a list, the etag is checked after the request, to check if a resource of the list has changed
-            local_etag = etag.get_etag(self.request.path)
+            stored_etag = local_etag = etag.get_etag(self.request.path)
 
             # Calculate the etag for the response
             new_etag = etag.calculate_etag_from_data(str(response.data))
 
             if self.request.method == 'GET' and self.request.if_none_match and \
-                    local_etag in self.request.if_none_match and local_etag == new_etag:
+                    etag_matches(local_etag, self.request.if_none_match) and local_etag == new_etag:
                 # for a list, if the method is get, we check that the sent etag is the same as the one stored
                 # and the stored one is equal to the one generated by the query
                 response = make_response()
@@ -149,8 +300,9 @@ class Resource(FlaskResource):
             # we will only fall here if the resource was created manually
             local_etag = etag.calculate_etag_from_data(str(response.data))
 
-        # Store the etag
-        etag.set_etag(uri, local_etag)
+        # Store the etag, only if it has changed
+        if self.request.method == 'POST' or local_etag != stored_etag:
+            etag.set_etag(uri, local_etag)
 
         # Update the response
         response.set_etag(local_etag)
@@ -162,6 +314,17 @@ class Api:
     """Provides an abstraction from the rest API framework being used"""
 
     def __init__(self, app=None, auth=None):
+        self.app = None
+
+        # Resources and their prefixes, added to the application by init_app
+        self.resources = []
+
+        # Endpoint names of the registered resources
+        self.endpoints = set()
+
+        # Concurrent identical GET requests
+        self.flights = SingleFlight()
+
         if app:
             self.init_app(app, auth)
 
@@ -169,6 +332,9 @@ class Api:
         self.app = app
         self.auth = auth
 
+        for cls, prefix in self.resources:
+            cls.add_url_rules(app, prefix)
+
     def public(self, view):
         """Define the class method as public.
 
@@ -245,9 +411,122 @@ class Api:
 
             cls.__init__ = __init__
 
-            # Add the resource to the API
-            cls.add_url_rules(self.app, prefix)
+            # Trace the methods of the resource
+            for name in set(m for methods in cls.http_methods.values() for m in methods.values()):
+                if name in cls.__dict__:
+                    setattr(cls, name, tracing.traced(cls.__name__ + '.' + name)(cls.__dict__[name]))
+
+            # Add the resource to the API, and to the application if already created
+            self.resources.append((cls, prefix))
+            if self.app is not None:
+                cls.add_url_rules(self.app, prefix)
+            self.endpoints.add(cls.build_endpoint_name('list'))
+            self.endpoints.add(cls.build_endpoint_name('detail'))
 
             return cls
 
         return wrapper
+
+    def batch(self, rule):
+        """Register the batch endpoint in the specified rule.
+
+        The batch endpoint receives a list of sub-requests for API resources
+        as the request body, each one in the form
+
+            {"method": "GET", "path": "/v1/user/", "headers": {...}, "body": {...}}
+
+        The bearer token is verified once for the whole batch, and the sub-requests
+        are dispatched in order, through the resource handlers, sharing the token.
+        Every sub-request runs the request hooks (before_request, after_request
+        and teardown_request), so it is logged and measured like any other
+        request.
+        Headers such as If-None-Match and If-Match are honored for each sub-request.
+        The response contains the status, headers and body of every sub-request.
+        """
+        self.app.add_url_rule(rule, endpoint='api_batch', view_func=self.dispatch_batch, methods=['POST'])
+
+    def dispatch_batch(self):
+        try:
+            requests = json.loads(request.get_data(as_text=True) or '[]')
+        except ValueError:
+            return self.batch_response({'error': 'Invalid JSON body'}, 400)
+
+        if not isinstance(requests, list):
+            return self.batch_response({'error': 'Expected a list of requests'}, 400)
+
+        if len(requests) > current_app.config.get('API_BATCH_MAX_REQUESTS'):
+            return self.batch_response({'error': 'At most %d requests are allowed per batch' %
+                                        current_app.config.get('API_BATCH_MAX_REQUESTS')}, 400)
+
+        oauth = None
+        if self.auth:
+            valid, oauth = self.auth.verify_request([])
+            if not valid:
+                return self.batch_response({'error': Unauthorized.msg}, Unauthorized.status)
+
+        results = []
+        for sub in requests:
+            if not isinstance(sub, dict) or not sub.get('path', None):
+                results.append({'status': BadRequest.status, 'body': {'error': 'Missing required parameter path'}})
+                continue
+
+            results.append(self.dispatch_sub_request(sub, oauth))
+
+        return self.batch_response({'objects': results})
+
+    def dispatch_sub_request(self, sub, oauth):
+        """Dispatch a sub-request of a batch and return its result"""
+        # The batch response is encoded as a whole, the bodies of the
+        # sub-requests are not compressed
+        headers = dict((name, value) for name, value in six.iteritems(sub.get('headers', None) or {})
+                       if name.lower() != 'accept-encoding')
+        if 'Authorization' in request.headers:
+            headers['Authorization'] = request.headers['Authorization']
+
+        body = sub.get('body', None)
+        if body is not None and not isinstance(body, six.string_types):
+            body = json.dumps(body)
+
+        # The sub-request is a request of its own, with the host, script root
+        # and client address of the batch
+        app = current_app._get_current_object()
+        environ = EnvironBuilder(sub.get('path'),
+                                 base_url=request.host_url + request.script_root.lstrip('/'),
+                                 method=sub.get('method', 'GET').upper(),
+                                 headers=headers,
+                                 data=body,
+                                 environ_base={'REMOTE_ADDR': request.remote_addr}).get_environ()
+
+        with app.request_context(environ):
+            try:
+                if request.routing_exception is not None:
+                    raise request.routing_exception
+
+                if request.url_rule.endpoint not in self.endpoints:
+                    raise NotFound('Only API resources can be requested in a batch')
+
+                # Share the verified token with the resource, which is then
+                # dispatched as any other request, running the request hooks
+                request.oauth = oauth
+                response = app.full_dispatch_request()
+            except HttpError as err:
+                # Raised only when exceptions bubble up (i.e. testing)
+                return {'status': getattr(err, 'status', 500), 'body': {'error': err.args[0]}}
+            except HTTPException as err:
+                return {'status': err.code, 'body': {'error': err.description}}
+
+            data = response.get_data(as_text=True)
+            if response.mimetype == 'application/json' and data:
+                data = json.loads(data)
+
+            return {
+                'status': response.status_code,
+                'headers': dict((k, v) for k, v in six.iteritems(response.headers)
+                                if k not in ('Content-Length', 'Content-Type')),
+                'body': data or None
+            }
+
+    def batch_response(self, data, status=200):
+        return make_response(json.dumps(data), status, {
+            'Content-Type': 'application/json'
+        })
@@ -0,0 +1,341 @@
+from __future__ import absolute_import
+from __future__ import unicode_literals
+import errno
+import os
+import random
+import select
+import signal
+import socket
+import sys
+import threading
+import time
+from wsgiref.simple_server import WSGIServer, WSGIRequestHandler
+
+# Exit status of the workers failing to create (or reset) their application
+BOOT_ERROR = 3
+
+
+class RequestHandler(WSGIRequestHandler):
+    """Requests are written to the access log by the application"""
+
+    def log_message(self, format, *args):
+        pass
+
+
+def log(stream, message, *args):
+    stream.write('[%s] [%d] %s\n' % (time.strftime('%Y-%m-%d %H:%M:%S'), os.getpid(), message % args))
+    stream.flush()
+
+
+def before_fork(app):
+    """Release the state of the extensions that cannot be inherited by the
+    workers (e.g. database connections)"""
+    for extension in list(app.extensions.values()):
+        release = getattr(extension, 'before_fork', None)
+        if release is not None:
+            release()
+
+
+def warm_up(app):
+    """Warm up the worker, if enabled, before it accepts requests"""
+    warmup = app.extensions.get('warmup')
+    if warmup is not None and app.config.get('WARMUP_ENABLED'):
+        warmup.run(app)
+        return warmup.timings.get('total')
+
+
+def after_fork(app):
+    """Reset the state of the extensions that must not be shared with the
+    parent process (connection pools, threads). The random generator is
+    seeded again, so the processes do not sample the same requests"""
+    random.seed()
+    for extension in list(app.extensions.values()):
+        reset = getattr(extension, 'after_fork', None)
+        if reset is not None:
+            reset()
+
+
+class Worker(object):
+    """Process serving requests from the listening socket inherited from the
+    arbiter, with a fixed number of threads accepting connections.
+
+    The worker stops accepting connections on SIGTERM (or SIGINT), or after
+    max_requests requests, and exits when the requests in progress finish."""
+
+    def __init__(self, listener, app, threads, max_requests=0, stream=sys.stderr):
+        self.listener = listener
+        self.app = app
+        self.threads = threads
+        self.max_requests = max_requests
+        self.stream = stream
+        self.requests = 0
+        self.alive = True
+        self._lock = threading.Lock()
+
+    def stop(self, *args):
+        self.alive = False
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+
+        host, port = self.listener.getsockname()[:2]
+        server = WSGIServer((host, port), RequestHandler, bind_and_activate=False)
+        server.socket.close()
+        server.socket = self.listener
+        server.server_name = socket.getfqdn(host)
+        server.server_port = port
+        server.setup_environ()
+        server.set_app(self.app)
+
+        # Connections wait in the backlog until the worker is warm
+        seconds = warm_up(self.app)
+        if seconds is not None:
+            log(self.stream, 'Worker ready in %.1fms', seconds * 1000)
+
+        threads = [threading.Thread(target=self.accept, args=(server,), name='worker-%d' % i)
+                   for i in range(self.threads)]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+
+        # Signals are only delivered to the main thread, so do not block in join
+        while any(thread.is_alive() for thread in threads):
+            for thread in threads:
+                thread.join(0.5)
+
+    def accept(self, server):
+        while self.alive:
+            try:
+                readable, _, _ = select.select([self.listener], [], [], 1.0)
+                if not readable:
+                    continue
+                connection, address = self.listener.accept()
+            except (socket.error, select.error) as err:
+                # Accepted by another worker, or interrupted by a signal
+                if err.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR, errno.ECONNABORTED):
+                    continue
+                raise
+
+            connection.setblocking(True)
+            try:
+                RequestHandler(connection, address, server)
+            except Exception:
+                server.handle_error(connection, address)
+            finally:
+                server.shutdown_request(connection)
+
+            with self._lock:
+                self.requests += 1
+                if self.max_requests and self.requests >= self.max_requests:
+                    self.alive = False
+
+
+class Arbiter(object):
+    """Pre-forking server. The arbiter opens the listening socket, and keeps
+    the given number of worker processes serving requests from it, replacing
+    the workers that exit.
+
+    With preload, the application is created in the arbiter before forking,
+    so the workers share its imported code and state copy-on-write (and
+    start faster), otherwise every worker creates its own application. The
+    code is imported by the arbiter in both cases, so new code is only loaded
+    by restarting the arbiter.
+
+    Signals:
+    - SIGTERM, SIGINT: graceful shutdown, the workers finish the requests in
+      progress (for at most graceful_timeout seconds)
+    - SIGHUP: graceful restart, new workers are started and the old ones stop
+      after finishing their requests. Without preload, the new workers create
+      their application again, with new connections and extension state
+
+    Workers failing to create their application exit with BOOT_ERROR, and are
+    replaced after a delay doubling with every consecutive failure (up to
+    max_backoff seconds). After max_boot_failures consecutive failures (0 to
+    retry forever) the arbiter stops, exiting with BOOT_ERROR as well.
+    """
+
+    def __init__(self, create_app, host='127.0.0.1', port=5000, workers=2, threads=4, max_requests=0,
+                 max_requests_jitter=0, graceful_timeout=30, preload=True, backlog=128, max_boot_failures=10,
+                 max_backoff=30, stream=sys.stderr):
+        self.create_app = create_app
+        self.host = host
+        self.port = port
+        self.workers = workers
+        self.threads = threads
+        self.max_requests = max_requests
+        self.max_requests_jitter = max_requests_jitter
+        self.graceful_timeout = graceful_timeout
+        self.preload = preload
+        self.backlog = backlog
+        self.max_boot_failures = max_boot_failures
+        self.max_backoff = max_backoff
+        self.stream = stream
+
+        self.app = None
+        self.listener = None
+        self.children = dict()
+        self.signals = []
+        self.boot_failures = 0
+        self.backoff_until = 0
+
+    def log(self, message, *args):
+        log(self.stream, message, *args)
+
+    def listen(self):
+        listener = socket.socket(socket.AF_INET6 if ':' in self.host else socket.AF_INET, socket.SOCK_STREAM)
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        listener.bind((self.host, self.port))
+        listener.listen(self.backlog)
+
+        # Workers wait for connections with select, and a connection can be
+        # taken by another worker in between, so accept must not block
+        listener.setblocking(False)
+        return listener
+
+    def spawn(self):
+        max_requests = self.max_requests
+        if max_requests and self.max_requests_jitter:
+            # Workers started together do not restart together
+            max_requests += random.randint(0, self.max_requests_jitter)
+
+        if self.app is not None:
+            before_fork(self.app)
+
+        pid = os.fork()
+        if pid:
+            self.children[pid] = time.time()
+            return pid
+
+        # Worker process, exits through the interpreter to run the exit
+        # functions of the application (e.g. writing the pending logs)
+        for sig in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+            signal.signal(sig, signal.SIG_DFL)
+
+        import traceback
+        try:
+            app = self.app
+            if app is None:
+                app = self.create_app()
+            else:
+                after_fork(app)
+        except Exception:
+            traceback.print_exc()
+            sys.exit(BOOT_ERROR)
+
+        code = 0
+        try:
+            Worker(self.listener, app, self.threads, max_requests, self.stream).run()
+        except Exception:
+            traceback.print_exc()
+            code = 1
+        sys.exit(code)
+
+    def signal(self, signum, frame):
+        self.signals.append(signum)
+
+    def reap(self):
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except OSError as err:
+                if err.errno == errno.ECHILD:
+                    return
+                raise
+
+            if not pid:
+                return
+
+            if self.children.pop(pid, None) is None:
+                continue
+
+            if status >> 8 != BOOT_ERROR:
+                self.log('Worker %d exited with status %d', pid, status >> 8)
+                self.boot_failures = 0
+                continue
+
+            # Do not replace the workers in a loop while the application cannot be created
+            self.boot_failures += 1
+            backoff = min(0.1 * 2 ** self.boot_failures, self.max_backoff)
+            self.backoff_until = time.time() + backoff
+            self.log('Worker %d failed to boot (%d consecutive failures), retrying in %.1f seconds', pid,
+                     self.boot_failures, backoff)
+
+    def kill(self, pids, sig):
+        for pid in pids:
+            try:
+                os.kill(pid, sig)
+            except OSError as err:
+                if err.errno != errno.ESRCH:
+                    raise
+
+    def stop(self):
+        """Stop the workers gracefully, killing them after graceful_timeout seconds"""
+        self.kill(list(self.children), signal.SIGTERM)
+        deadline = time.time() + self.graceful_timeout
+        while self.children and time.time() < deadline:
+            self.reap()
+            time.sleep(0.1)
+
+        if self.children:
+            self.log('Killing %d workers', len(self.children))
+            self.kill(list(self.children), signal.SIGKILL)
+            while self.children:
+                self.reap()
+                time.sleep(0.1)
+
+    def restart(self):
+        """Replace the workers by new ones, stopping the old after their requests"""
+        old = list(self.children)
+        for i in range(self.workers):
+            self.spawn()
+        self.kill(old, signal.SIGTERM)
+
+    def run(self):
+        self.listener = self.listen()
+        self.port = self.listener.getsockname()[1]
+
+        if self.preload and self.app is None:
+            self.app = self.create_app()
+        if self.app is not None and 'warmup' in self.app.extensions:
+            # Shared by the workers, copy-on-write
+            self.app.extensions['warmup'].prepare(self.app)
+
+        for sig in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+            signal.signal(sig, self.signal)
+
+        self.log('Listening at http://%s:%d with %d workers of %d threads (pid %d)', self.host, self.port,
+                 self.workers, self.threads, os.getpid())
+
+        restarting = set()
+        try:
+            while True:
+                while self.signals:
+                    sig = self.signals.pop(0)
+                    if sig == signal.SIGHUP:
+                        self.log('Restarting the workers')
+                        self.boot_failures = 0
+                        self.backoff_until = 0
+                        restarting.update(self.children)
+                        self.restart()
+                    else:
+                        self.log('Shutting down')
+                        return self.stop()
+
+                self.reap()
+                restarting.intersection_update(self.children)
+
+                if self.max_boot_failures and self.boot_failures >= self.max_boot_failures:
+                    self.log('Shutting down, the workers failed to boot %d times', self.boot_failures)
+                    self.stop()
+                    sys.exit(BOOT_ERROR)
+
+                # Replace the workers that exited, not counting those being restarted
+                if time.time() >= self.backoff_until:
+                    for i in range(self.workers - len(self.children) + len(restarting)):
+                        self.spawn()
+
+                time.sleep(0.2)
+        finally:
+            self.listener.close()
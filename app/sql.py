@@ -1,9 +1,15 @@
 from __future__ import absolute_import
 from __future__ import unicode_literals
+import sqlalchemy.dialects.mysql
 import sqlalchemy.dialects.postgresql
+import binascii
+import re
 import uuid
+import sqlalchemy
 import sqlalchemy.types as types
 import six
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import ColumnElement
 
 try:
     # Check if the psycopg2 module exists
@@ -15,25 +21,46 @@ except ImportError:
     pass
 
 
+def _compose(first, second):
+    """Processor applying first and then second, either of them may be None"""
+    if first is None:
+        return second
+    if second is None:
+        return first
+
+    def process(value):
+        return second(first(value))
+
+    return process
+
+
 class ChoiceType(types.TypeDecorator):
+    """Stores the key of a choice and loads its value.
+
+    The choices are given as a mapping (or an enum) of keys to values. Values
+    without a key are stored as NULL.
+    """
+
     impl = types.String
     python_type = str
 
     def __init__(self, choices, **kw):
         self.choices = dict(choices)
+        self.keys = dict((v, k) for k, v in six.iteritems(self.choices))
         super(ChoiceType, self).__init__(**kw)
 
     def process_bind_param(self, value, dialect):
-        chosen = [k for k, v in six.iteritems(self.choices) if v == value]
-        if len(chosen) > 0:
-            return chosen[0]
-
-        return None
+        return self.keys.get(value)
 
     def process_result_value(self, value, dialect):
-        if value:
-            return self.choices[value]
-        return None
+        return self.choices.get(value)
+
+    def bind_processor(self, dialect):
+        # The dictionary lookups run per value, avoid the method calls of the TypeDecorator
+        return _compose(self.keys.get, self.impl.bind_processor(dialect))
+
+    def result_processor(self, dialect, coltype):
+        return _compose(self.impl.result_processor(dialect, coltype), self.choices.get)
 
 
 class StringListType(types.TypeDecorator):
@@ -53,61 +80,445 @@ class StringListType(types.TypeDecorator):
     class User(db.Model):
         roles = db.Column(StringListType(ROLES))
     ```
+
+    With native=True the list is stored as an array in PostgreSQL, a SET in
+    MySQL and as a bitmask integer (one bit per allowed value, in order) in
+    other databases, and loaded in the order of the allowed values.
+
+    The column supports containment filters, run in the database
+
+    ```
+    User.query.filter(User.roles.has('admin'))
+    User.query.filter(User.roles.has_any(['admin', 'reporter']))
+    User.query.filter(User.roles.has_all(['user', 'reporter']))
+    ```
+
+    In PostgreSQL these use the array operators @> and &&, which can use a
+    GIN index on the column.
     """
 
     impl = types.String
     python_type = list
 
-    def __init__(self, allowed, separator=',', **kw):
-        self.allowed = tuple(allowed)
+    class comparator_factory(types.TypeDecorator.Comparator):
+        def has(self, value):
+            """Filter the rows whose list contains the value"""
+            return self.has_all([value])
+
+        def has_all(self, values):
+            """Filter the rows whose list contains all the values"""
+            return self._match(values, True)
+
+        def has_any(self, values):
+            """Filter the rows whose list contains any of the values"""
+            return self._match(values, False)
+
+        def _match(self, values, match_all):
+            values = set(values)
+            known = [v for v in self.type.values if v in values]
+
+            # Values not allowed cannot be stored
+            if match_all and len(known) < len(values):
+                return sqlalchemy.false()
+            if not known:
+                return sqlalchemy.true() if match_all else sqlalchemy.false()
+
+            return StringListMatch(self.expr, known, match_all)
+
+    def __init__(self, allowed, separator=',', native=False, **kw):
+        self.values = tuple(allowed)
+        self.allowed = frozenset(self.values)
         self.separator = separator
+        self.native = native
+        self.bits = dict((v, 1 << i) for i, v in enumerate(self.values))
         super(StringListType, self).__init__(**kw)
 
+    def storage(self, dialect):
+        """How lists are stored in the dialect: 'array', 'set', 'bitmask' or 'string'"""
+        if not self.native:
+            return 'string'
+
+        return {'postgresql': 'array', 'mysql': 'set'}.get(dialect.name, 'bitmask')
+
+    def load_dialect_impl(self, dialect):
+        storage = self.storage(dialect)
+        if storage == 'array':
+            return dialect.type_descriptor(sqlalchemy.dialects.postgresql.ARRAY(types.Text))
+        elif storage == 'set':
+            return dialect.type_descriptor(sqlalchemy.dialects.mysql.SET(*self.values))
+        elif storage == 'bitmask':
+            return dialect.type_descriptor(types.Integer)
+
+        return dialect.type_descriptor(self.impl)
+
+    def mask(self, values):
+        bits = self.bits
+        return sum(bits[v] for v in set(values) if v in bits)
+
     def process_bind_param(self, value, dialect):
-        return self.separator.join([v for v in value if v in self.allowed])
+        return self._bind_process(dialect)(value)
 
     def process_result_value(self, value, dialect):
-        return [v for v in value.split(self.separator) if v in self.allowed]
+        return self._result_process(dialect)(value)
+
+    def bind_processor(self, dialect):
+        return _compose(self._bind_process(dialect), self.impl.bind_processor(dialect))
+
+    def result_processor(self, dialect, coltype):
+        return _compose(self.impl.result_processor(dialect, coltype), self._result_process(dialect))
+
+    def _bind_process(self, dialect):
+        allowed = self.allowed
+        storage = self.storage(dialect)
+
+        if storage == 'bitmask':
+            mask = self.mask
+
+            def process(value):
+                if value is None:
+                    return None
+                return mask(value)
+        elif storage in ('array', 'set'):
+            values = self.values
+
+            def process(value):
+                if value is None:
+                    return None
+                value = set(value)
+                return [v for v in values if v in value]
+        else:
+            join = self.separator.join
+
+            def process(value):
+                if value is None:
+                    return None
+                return join([v for v in value if v in allowed])
+
+        return process
+
+    def _result_process(self, dialect):
+        allowed = self.allowed
+        storage = self.storage(dialect)
+
+        if storage == 'bitmask':
+            bits = [(v, self.bits[v]) for v in self.values]
+
+            def process(value):
+                if value is None:
+                    return None
+                return [v for v, bit in bits if value & bit]
+        elif storage in ('array', 'set'):
+            values = self.values
+
+            def process(value):
+                if value is None:
+                    return None
+                value = set(value)
+                return [v for v in values if v in value]
+        else:
+            separator = self.separator
+
+            def process(value):
+                if value is None:
+                    return None
+                return [v for v in value.split(separator) if v in allowed]
+
+        return process
+
+
+class StringListMatch(ColumnElement):
+    """Containment filter on a StringListType column, compiled according
+    to the storage of the list in the dialect"""
+
+    type = types.Boolean()
+
+    def __init__(self, expr, values, match_all):
+        self.expr = expr
+        self.values = values
+        self.match_all = match_all
+
+
+@compiles(StringListMatch)
+def _compile_string_list_match(element, compiler, **kw):
+    type_ = element.expr.type
+    storage = type_.storage(compiler.dialect)
+
+    if storage == 'array':
+        column = sqlalchemy.type_coerce(element.expr, sqlalchemy.dialects.postgresql.ARRAY(types.Text))
+        clause = column.op('@>' if element.match_all else '&&')(sqlalchemy.dialects.postgresql.array(element.values))
+    elif storage in ('set', 'bitmask'):
+        # MySQL sets are bitmasks in numeric context
+        mask = type_.mask(element.values)
+        column = sqlalchemy.type_coerce(element.expr, types.Integer)
+        if storage == 'set':
+            column = column + 0
+
+        masked = column.op('&')(sqlalchemy.literal(mask, types.Integer))
+        clause = masked == mask if element.match_all else masked != 0
+    else:
+        column = ',' + sqlalchemy.type_coerce(element.expr, types.String) + ','
+        clauses = [column.contains(',%s,' % v, autoescape=True) for v in element.values]
+        clause = sqlalchemy.and_(*clauses) if element.match_all else sqlalchemy.or_(*clauses)
+
+    return compiler.process(clause, **kw)
+
+
+def gin_index(table, column):
+    """Create a GIN index on the column of the table in PostgreSQL, for the
+    containment filters of native StringListType columns"""
+    ddl = sqlalchemy.DDL('CREATE INDEX ix_%(table)s_{0} ON %(table)s USING gin ({0})'.format(column))
+    sqlalchemy.event.listen(table, 'after_create', ddl.execute_if(dialect='postgresql'))
+
+
+# The format of the identifiers generated by app.util.uuid
+_uuid_hex = re.compile(r'^[0-9a-f]{32}$')
 
 
 class UUID(types.TypeDecorator):
-    """ Converts UUID to string before storing to database.
-        Converts string to UUID when retrieving from database. """
+    """ Stores UUIDs, given as uuid.UUID objects or strings in any format
+        accepted by uuid.UUID(), and loads them as 32 character hexadecimal
+        strings (the format of app.util.uuid).
+
+        PostgreSQL uses its native UUID column type. Other databases use a
+        String column or, with binary=True, a 16 byte BINARY column, which
+        halves the size of the column and of the indexes and foreign keys
+        referencing it. Existing hexadecimal data is converted with
+        convert_uuid_column (the `db uuids` command). """
 
     impl = types.TypeEngine
 
+    def __init__(self, binary=False, **kw):
+        self.binary = binary
+        super(UUID, self).__init__(**kw)
+
     def load_dialect_impl(self, dialect):
         """ When using Postgres database, use the Postgres UUID column type.
-            Otherwise, use String column type. """
+            Otherwise, use String or Binary column type. """
         if dialect.name == 'postgresql':
-            return dialect.type_descriptor(sqlalchemy.dialects.postgresql.UUID)
+            return dialect.type_descriptor(sqlalchemy.dialects.postgresql.UUID(as_uuid=True))
+
+        if self.binary:
+            return dialect.type_descriptor(types.BINARY(16))
 
         return dialect.type_descriptor(types.String)
 
-    def process_bind_param(self, value, dialect):
-        """ When using Postgres database, check that is a valid uuid and
-            store as UUID object.
-            Otherwise, convert to string before storing to database. """
+    @staticmethod
+    def to_hex(value):
+        """ Validate the value and convert it to a 32 character hexadecimal
+            string. Values already in that format are not parsed again. """
+        if value is None:
+            return value
 
+        if isinstance(value, uuid.UUID):
+            return value.hex
+
+        if _uuid_hex.match(value):
+            return value
+
+        return uuid.UUID(value).hex
+
+    @staticmethod
+    def to_uuid(value):
+        if value is None or isinstance(value, uuid.UUID):
+            return value
+
+        return uuid.UUID(value)
+
+    @classmethod
+    def to_bytes(cls, value):
         if value is None:
             return value
 
-        if not isinstance(value, UUID):
-            # Try to convert to UUID to check validity
-            value = uuid.UUID(value)
+        if isinstance(value, uuid.UUID):
+            return value.bytes
+
+        return binascii.unhexlify(cls.to_hex(value))
 
-        if dialect.name == 'postgres':
+    @staticmethod
+    def from_bytes(value):
+        if value is None:
             return value
 
-        return str(value).replace('-', '')
+        return binascii.hexlify(value).decode('ascii')
 
-    def process_result_value(self, value, dialect):
-        """ When using Postgres database, convert to string before returning value.
-            Otherwise, provide as is. """
+    def process_bind_param(self, value, dialect):
+        """ When using Postgres database, check that is a valid uuid and
+            store as UUID object.
+            Otherwise, convert to string (or bytes) before storing to database. """
         if dialect.name == 'postgresql':
-            return str(value).replace('-', '')
+            return self.to_uuid(value)
+
+        if self.binary:
+            return self.to_bytes(value)
+
+        return self.to_hex(value)
 
+    def process_result_value(self, value, dialect):
+        """ When using Postgres database or binary storage, convert to string
+            before returning value. Otherwise, provide as is. """
         if value is None:
             return value
 
+        if isinstance(value, uuid.UUID):
+            return value.hex
+
+        if self.binary and dialect.name != 'postgresql':
+            return self.from_bytes(value)
+
         return value
+
+    def literal_processor(self, dialect):
+        # Both the native UUID type and strings accept the hexadecimal format
+        to_hex = self.to_hex
+        template = "X'%s'" if self.binary and dialect.name != 'postgresql' else "'%s'"
+
+        def process(value):
+            value = to_hex(value)
+            return 'NULL' if value is None else template % value
+
+        return process
+
+    def bind_processor(self, dialect):
+        # Choose the conversion once per dialect instead of once per value
+        if dialect.name == 'postgresql':
+            process = self.to_uuid
+        elif self.binary:
+            process = self.to_bytes
+        else:
+            process = self.to_hex
+
+        return _compose(process, self.impl.bind_processor(dialect))
+
+    def result_processor(self, dialect, coltype):
+        impl_processor = self.impl.result_processor(dialect, coltype)
+        if dialect.name == 'postgresql':
+            return _compose(impl_processor, lambda value: self.process_result_value(value, dialect))
+
+        if self.binary:
+            return _compose(impl_processor, self.from_bytes)
+
+        # Strings are loaded as they are stored
+        return impl_processor
+
+
+def uuid_columns(metadata, binary=True):
+    """List of (table, column) names of the UUID columns in the metadata"""
+    return [(table.name, column.name) for table in metadata.sorted_tables for column in table.columns
+            if isinstance(column.type, UUID) and column.type.binary == binary]
+
+
+def convert_uuid_column(connection, table, column, batch_size=1000):
+    """Convert the hexadecimal UUIDs stored in a column to the binary format,
+    batch_size distinct values at a time, committing after every batch.
+
+    On MySQL (and other databases enforcing column types) the column is
+    widened to VARBINARY(32) before the conversion and set to BINARY(16)
+    after it, with foreign key checks disabled, as the column may be
+    referenced by (or reference) other UUID columns. SQLite stores the binary
+    values in the existing column. Converted values are 16 bytes long, so an
+    interrupted conversion can be resumed. Return the number of converted
+    values.
+    """
+    dialect = connection.dialect.name
+    if dialect == 'postgresql':
+        # Native UUID type
+        return 0
+
+    from alembic.migration import MigrationContext
+    from alembic.operations import Operations
+
+    operations = Operations(MigrationContext.configure(connection))
+    if dialect == 'mysql':
+        connection.execute('SET foreign_key_checks = 0')
+
+    try:
+        if dialect != 'sqlite':
+            operations.alter_column(table, column, type_=types.VARBINARY(32))
+
+        # Without types, the values are not processed
+        values = sqlalchemy.table(table, sqlalchemy.column(column))
+        col = values.c[column]
+        pending = sqlalchemy.select([col]).distinct().where(sqlalchemy.func.length(col) == 32).limit(batch_size)
+        update = values.update().where(col == sqlalchemy.bindparam('hex')).values({column: sqlalchemy.bindparam('bin')})
+
+        converted = 0
+        while True:
+            with connection.begin():
+                rows = [row[0] for row in connection.execute(pending)]
+                if not rows:
+                    break
+
+                connection.execute(update, [dict(hex=value, bin=binascii.unhexlify(value)) for value in rows])
+                converted += len(rows)
+
+        if dialect != 'sqlite':
+            operations.alter_column(table, column, type_=types.BINARY(16))
+    finally:
+        # Restored also when the conversion fails, the connection may be reused
+        if dialect == 'mysql':
+            connection.execute('SET foreign_key_checks = 1')
+
+    return converted
+
+
+def string_list_columns(metadata):
+    """List of (table, column) names of the native StringListType columns in the metadata"""
+    return [(table.name, column.name) for table in metadata.sorted_tables for column in table.columns
+            if isinstance(column.type, StringListType) and column.type.native]
+
+
+def convert_string_list_column(connection, table, column, type_, batch_size=1000):
+    """Convert a StringListType column stored as separated strings to the
+    native storage of the type (see StringListType) in the database.
+
+    PostgreSQL splits the strings into an array, and MySQL reads them as SET
+    values, when altering the column. Other databases (SQLite) replace the
+    strings by their bitmask, batch_size distinct values at a time, and the
+    column is then recreated as an integer column. Columns already converted
+    are left as they are, so an interrupted conversion can be resumed. Return
+    the number of converted values (distinct values in SQLite).
+    """
+    from alembic.migration import MigrationContext
+    from alembic.operations import Operations
+
+    dialect = connection.dialect.name
+    storage = type_.storage(connection.dialect)
+    existing = dict((c['name'], c) for c in sqlalchemy.inspect(connection).get_columns(table))[column]
+    native = {'array': sqlalchemy.dialects.postgresql.ARRAY, 'set': sqlalchemy.dialects.mysql.SET}.get(storage,
+                                                                                                       types.Integer)
+    if isinstance(existing['type'], native):
+        return 0
+
+    values = sqlalchemy.table(table, sqlalchemy.column(column))
+    col = values.c[column]
+    operations = Operations(MigrationContext.configure(connection))
+    if dialect in ('postgresql', 'mysql'):
+        converted = connection.execute(sqlalchemy.select([sqlalchemy.func.count(col)])).scalar()
+        if storage == 'array':
+            operations.alter_column(table, column, type_=sqlalchemy.dialects.postgresql.ARRAY(types.Text),
+                                    postgresql_using="string_to_array(%s, '%s')" % (column, type_.separator))
+        else:
+            operations.alter_column(table, column, type_=sqlalchemy.dialects.mysql.SET(*type_.values),
+                                    existing_nullable=existing['nullable'])
+        return converted
+
+    # Masks are stored as digits until the column is recreated
+    pending = sqlalchemy.select([col]).distinct() \
+        .where(sqlalchemy.or_(col == '', sqlalchemy.not_(col.op('GLOB')('[0-9]*')))).limit(batch_size)
+    update = values.update().where(col == sqlalchemy.bindparam('string')).values({column: sqlalchemy.bindparam('mask')})
+
+    converted = 0
+    while True:
+        with connection.begin():
+            rows = [row[0] for row in connection.execute(pending)]
+            if not rows:
+                break
+
+            connection.execute(update, [dict(string=value, mask=type_.mask(value.split(type_.separator)))
+                                        for value in rows])
+            converted += len(rows)
+
+    with operations.batch_alter_table(table) as batch:
+        batch.alter_column(column, type_=types.Integer, existing_type=existing['type'])
+
+    return converted
@@ -0,0 +1,215 @@
+from __future__ import absolute_import
+from __future__ import unicode_literals
+import functools
+import json
+import os
+import threading
+import time
+
+from flask import current_app, request, has_request_context
+
+
+class Span(object):
+    """Timed phase of a request, with its attributes and nested spans"""
+
+    def __init__(self, trace, name, attributes):
+        self.trace = trace
+        self.name = name
+        self.attributes = attributes
+        self.children = []
+        self.start = None
+        self.end = None
+
+    @property
+    def duration(self):
+        return (self.end if self.end is not None else time.time()) - self.start
+
+    def __enter__(self):
+        self.trace.stack[-1].children.append(self)
+        self.trace.stack.append(self)
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.end = time.time()
+        if exc_type is not None:
+            self.attributes['error'] = exc_type.__name__
+        self.trace.stack.pop()
+
+    def walk(self, depth=0):
+        """The span and its descendants, depth first, as (depth, span)"""
+        yield depth, self
+        for child in self.children:
+            for item in child.walk(depth + 1):
+                yield item
+
+    def format(self):
+        """The span tree as text, one line per span"""
+        lines = []
+        for depth, span in self.walk():
+            attributes = ' '.join('%s=%s' % item for item in sorted(span.attributes.items()))
+            lines.append('%s%-*s %8.1f ms %s' % ('  ' * depth, 30 - 2 * depth, span.name,
+                                                 span.duration * 1000, attributes))
+        return '\n'.join(line.rstrip() for line in lines)
+
+
+class Trace(object):
+    """Spans of a request, the root span covers the whole request"""
+
+    def __init__(self, name, **attributes):
+        self.stack = []
+        self.root = Span(self, name, attributes)
+        self.root.start = time.time()
+        self.stack.append(self.root)
+        self.thread = threading.current_thread().ident
+
+    def span(self, name, attributes):
+        return Span(self, name, attributes)
+
+    def finish(self):
+        self.root.end = time.time()
+
+
+class NoSpan(object):
+    """Span used when the request is not traced"""
+
+    @property
+    def attributes(self):
+        return dict()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        pass
+
+
+_no_span = NoSpan()
+
+
+def span(name, **attributes):
+    """Context manager timing a phase of the current request:
+
+        with tracing.span('etag.get', uri=uri):
+            ...
+
+    It does nothing outside of a traced request."""
+    trace = getattr(request, 'trace', None) if has_request_context() else None
+    if trace is None:
+        return _no_span
+    return trace.span(name, attributes)
+
+
+def traced(name):
+    """Decorator tracing the calls to the function as a span"""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+class Exporter(object):
+    """Writes the traces of the requests somewhere for offline analysis"""
+
+    def export(self, trace):
+        raise NotImplementedError
+
+
+class ChromeTraceExporter(Exporter):
+    """Appends the spans to a file in the Trace Event format, which can be
+    opened in chrome://tracing or https://ui.perfetto.dev. Every span is a
+    complete event (with its start and duration in microseconds).
+
+    The file is a JSON array without the closing bracket, which the format
+    allows, so several processes can append to the same file."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def events(self, trace):
+        pid = os.getpid()
+        for _, span in trace.root.walk():
+            yield dict(name=span.name, ph='X', pid=pid, tid=trace.thread,
+                       ts=int(span.start * 1e6), dur=int(span.duration * 1e6), args=span.attributes)
+
+    def export(self, trace):
+        lines = ''.join(json.dumps(event, sort_keys=True) + ',\n' for event in self.events(trace))
+        with self._lock:
+            with open(self.path, 'a') as f:
+                if f.tell() == 0:
+                    f.write('[\n')
+                f.write(lines)
+
+
+class Tracer(object):
+    """Traces the phases of every request as a tree of spans.
+
+    Requests slower than TRACING_SLOW seconds are logged with their span tree
+    in the application log. The traces of all the requests are written to the
+    exporters (TRACING_FILE adds a ChromeTraceExporter writing to the file).
+    """
+
+    def __init__(self, app=None):
+        self.exporters = []
+        self.files = dict()
+
+        if app:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('TRACING_ENABLED', True)
+        app.config.setdefault('TRACING_SLOW', 1.0)
+        app.config.setdefault('TRACING_FILE', None)
+
+        app.extensions['tracing'] = self
+        # One exporter per file, shared by the applications writing to it
+        path = app.config.get('TRACING_FILE')
+        if path and path not in self.files:
+            self.files[path] = ChromeTraceExporter(path)
+
+        # Run first and last, to trace the other request hooks
+        app.before_request_funcs.setdefault(None, []).insert(0, self.before_request)
+        app.after_request_funcs.setdefault(None, []).insert(0, self.after_request)
+
+    def add_exporter(self, exporter):
+        """Export the traces of the requests of all the applications"""
+        self.exporters.append(exporter)
+
+    def before_request(self):
+        if current_app.config.get('TRACING_ENABLED'):
+            request.trace = Trace('request', method=request.method, path=request.path)
+
+    def after_request(self, response):
+        trace = getattr(request, 'trace', None)
+        if trace is None:
+            return response
+
+        request.trace = None
+        trace.finish()
+        trace.root.attributes.update(endpoint=request.endpoint, status=response.status_code)
+
+        if trace.root.duration > current_app.config.get('TRACING_SLOW'):
+            current_app.logger.warning('Slow request %s %s (%.1f ms):\n%s', request.method, request.path,
+                                       trace.root.duration * 1000, trace.root.format())
+
+        exporters = list(self.exporters)
+        path = current_app.config.get('TRACING_FILE')
+        if path:
+            exporters.append(self.files[path])
+
+        for exporter in exporters:
+            try:
+                exporter.export(trace)
+            except Exception:
+                current_app.logger.exception('Error exporting the trace with %s', exporter.__class__.__name__)
+
+        return response
+
+
+tracer = Tracer()
@@ -137,6 +137,19 @@ def enum(*sequential, **kwargs):
     return Enum(*[v for l in [list(range(len(sequential))), list(kwargs.values())] for v in l])
 
 
+def chunks(iterable, size):
+    """Split the iterable in lists of at most size elements"""
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+
+    if chunk:
+        yield chunk
+
+
 def build_url(base, query_params={}, fragment={}):
     """Construct a URL based off of base containing all parameters in
     the query portion of base plus any additional parameters.
@@ -165,9 +178,6 @@ def build_url(base, query_params={}, fragment={}):
                                 urllib.urlencode(fragment)))
 
 
-from flask import request, url_for
-
-
 def is_safe_url(target):
     """
     A function that ensures that a redirect target will lead to the same server
@@ -180,7 +190,19 @@ def is_safe_url(target):
 
     Source: http://flask.pocoo.org/snippets/62/
     """
+    from flask import request
+
     ref_url = urlparse.urlparse(request.host_url)
     test_url = urlparse.urlparse(urlparse.urljoin(request.host_url, target))
     return test_url.scheme in ('http', 'https') and \
         ref_url.netloc == test_url.netloc
+
+
+def is_admin_request(auth):
+    """Whether the current request has the bearer token of an administrator,
+    verified by the OAuth provider auth (False without provider)"""
+    if auth is None:
+        return False
+
+    valid, req = auth.verify_request([])
+    return valid and req.user is not None and req.user.is_admin
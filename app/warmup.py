@@ -0,0 +1,181 @@
+from __future__ import absolute_import
+from __future__ import unicode_literals
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from flask import current_app, request
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import configure_mappers
+from sqlalchemy.pool import QueuePool
+
+
+class Warmup(object):
+    """Warms up a process before it accepts requests, so the first requests
+    are not slower than the rest.
+
+    prepare() does the work that can be shared by forked processes, and is
+    run before forking when the application is preloaded: it configures the
+    SQLAlchemy mappers and compiles the templates. run() also opens
+    WARMUP_CONNECTIONS connections of every pool (by default the size of the
+    pool), and compiles the baked queries by running them once. With
+    WARMUP_PRELOAD it also looks up the newest WARMUP_PRELOAD_LIMIT OAuth
+    clients and ETags, loading them in the database caches.
+
+    The process is ready (see the /internal/ready endpoint) once run()
+    finishes. Warming up is best effort: database errors are logged, and the
+    process is ready anyway. The pre-forking server runs it in every worker
+    before accepting connections. With other servers the first request runs
+    it, and the other requests wait for it, except for the readiness checks:
+    they start the warmup in the background and answer 503 until it finishes.
+    The state of the warmup belongs to the process, which serves a single
+    application.
+    """
+
+    def __init__(self, app=None, db=None):
+        self.ready = False
+        self.prepared = False
+        self.error = None
+        self.timings = OrderedDict()
+        self._lock = threading.Lock()
+        self._thread = None
+
+        if app and db:
+            self.init_app(app, db)
+
+    def init_app(self, app, db):
+        self.db = db
+        app.config.setdefault('WARMUP_ENABLED', True)
+        app.config.setdefault('WARMUP_CONNECTIONS', None)
+        app.config.setdefault('WARMUP_PRELOAD', False)
+        app.config.setdefault('WARMUP_PRELOAD_LIMIT', 1000)
+
+        app.extensions['warmup'] = self
+        app.before_request(self.before_request)
+
+    def before_request(self):
+        if self.ready or not current_app.config.get('WARMUP_ENABLED'):
+            return
+
+        app = current_app._get_current_object()
+        if request.endpoint == 'internal.ready':
+            self.start(app)
+        else:
+            self.ensure(app)
+
+    def ensure(self, app):
+        """Warm up the process, unless it is already"""
+        with self._lock:
+            if not self.ready:
+                self.run(app)
+
+    def start(self, app):
+        """Warm up the process in a background thread"""
+        with self._lock:
+            if self.ready or (self._thread is not None and self._thread.is_alive()):
+                return
+
+            self._thread = threading.Thread(target=self.ensure, args=(app, ), name='warmup')
+            self._thread.daemon = True
+            self._thread.start()
+
+    @contextmanager
+    def step(self, name):
+        start = time.time()
+        yield
+        self.timings[name] = time.time() - start
+
+    def prepare(self, app=None):
+        """Warm up the state that forked processes can share"""
+        if self.prepared:
+            return
+
+        app = app or current_app._get_current_object()
+        with self.step('mappers'):
+            configure_mappers()
+
+        with self.step('templates'):
+            for name in app.jinja_env.list_templates():
+                app.jinja_env.get_template(name)
+
+        self.prepared = True
+
+    def engines(self, app):
+        yield self.db.get_engine(app)
+        for i in range(len(app.config.get('SQLALCHEMY_REPLICA_URIS'))):
+            yield self.db.get_engine(app, bind=('replica', i))
+
+    def connect(self, app):
+        """Open the connections of the pools"""
+        for engine in self.engines(app):
+            count = app.config.get('WARMUP_CONNECTIONS')
+            if count is None:
+                count = engine.pool.size() if isinstance(engine.pool, QueuePool) else 1
+
+            # Hold them all at once, so the pool opens count connections
+            connections = [engine.connect() for i in range(count)]
+            for connection in connections:
+                connection.close()
+
+    def preload(self, app):
+        """Look up the most recently modified clients and ETags, as the
+        requests do"""
+        from app.auth.models import Client
+        from app.auth.views import load_client
+        from app.cache import etag
+        from app.cache.models import Etag
+
+        limit = app.config.get('WARMUP_PRELOAD_LIMIT')
+        with self.db.read_only():
+            client_ids = [client_id for client_id, in self.db.session.query(Client.client_id)
+                          .order_by(Client.modified.desc()).limit(limit)]
+            uris = [uri for uri, in self.db.session.query(Etag.uri).order_by(Etag.modified.desc()).limit(limit)]
+
+        for client_id in client_ids:
+            load_client(client_id)
+        for uri in uris:
+            etag.get_etag(uri)
+
+    def run(self, app=None):
+        """Warm up the process for the application (by default the current
+        one), the process is then ready"""
+        from app.baked import queries
+
+        app = app or current_app._get_current_object()
+        start = time.time()
+        self.prepare(app)
+
+        self.error = None
+        with app.test_request_context():
+            try:
+                with self.step('connections'):
+                    self.connect(app)
+
+                with self.step('queries'):
+                    queries.warm(self.db.session())
+
+                if app.config.get('WARMUP_PRELOAD'):
+                    with self.step('preload'):
+                        self.preload(app)
+            except SQLAlchemyError as err:
+                app.logger.exception("Warmup failed")
+                self.error = str(err)
+            finally:
+                self.db.session.remove()
+
+        self.timings['total'] = time.time() - start
+        self.ready = True
+
+    def after_fork(self):
+        # The connections of forked processes are not open yet
+        self.ready = False
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def stats(self):
+        timings = dict((name, round(seconds * 1000, 3)) for name, seconds in self.timings.items())
+        return dict(ready=self.ready, failed=self.error is not None, timings=timings)
+
+
+warmup = Warmup()
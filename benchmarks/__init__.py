@@ -0,0 +1,4 @@
+"""Benchmarks of performance sensitive code, run them as modules, e.g.
+
+    python -m benchmarks.sql_types
+"""
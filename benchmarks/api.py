@@ -0,0 +1,441 @@
+"""Benchmark of the throughput and latency of the API endpoints, against a
+database of synthetic users: password and refresh token grants, the user
+detail with and without If-None-Match, the user list at several sizes, and
+user creation and update with If-Match
+
+    python -m benchmarks.api [--requests 200] [--users 1000] [--sizes 10,100,1000]
+                             [--server] [--output results.json] [--baseline baseline.json]
+
+Requests are made one at a time with the Flask test client or, with --server,
+over HTTP to the pre-forking server (app.server) started in a subprocess. The
+database is a temporary SQLite file, unless --database is given (the synthetic
+users are added to it, and kept).
+
+With --output the results are written as JSON, which is also the format of
+the baseline: store the output of a reference run, and pass it as --baseline
+to later runs, with the same --config and mode. Scenarios with failed requests,
+or whose median or p90 latency grew, or whose throughput fell, by more than
+--tolerance are reported as regressions, and the exit status is then 1.
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import unicode_literals
+import argparse
+import itertools
+import json
+import math
+import os
+import platform
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from timeit import default_timer
+
+from six.moves import http_client
+from six.moves.urllib.parse import urlencode, urlparse
+from werkzeug.utils import import_string
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PASSWORD = 'password'
+
+SERVE = '''
+from app import create_app
+from app.server import Arbiter
+from benchmarks.api import configuration
+Arbiter(lambda: create_app(configuration(%r, %r)), port=0, workers=%d, threads=%d).run()
+'''
+
+# Latencies compared with the baseline
+COMPARED = ('p50_ms', 'p90_ms')
+
+
+def configuration(name, database):
+    """The configuration object at the import path, using the given database"""
+    return type(str('BenchmarkConfig'), (import_string(name),), dict(SQLALCHEMY_DATABASE_URI=database))
+
+
+class TestClient(object):
+    """Requests through the Flask test client"""
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, headers=None, data=None):
+        """Return the status, the headers (with lower case names) and the body"""
+        rv = self.client.open(path, method=method, headers=headers, data=data)
+        return rv.status_code, dict((name.lower(), value) for name, value in rv.headers.items()), rv.data
+
+    def close(self):
+        pass
+
+
+class ServerClient(object):
+    """Requests over HTTP to the pre-forking server, in a subprocess"""
+
+    def __init__(self, config, database, workers, threads, timeout=60):
+        self.process = subprocess.Popen([sys.executable, '-c', SERVE % (config, database, workers, threads)],
+                                        cwd=ROOT, stderr=subprocess.PIPE)
+
+        # Drain the output of the server, which would block when the pipe is full
+        self.lines = []
+        self.reader = threading.Thread(target=self.read)
+        self.reader.daemon = True
+        self.reader.start()
+
+        deadline = time.time() + timeout
+        while time.time() < deadline and (self.process.poll() is None or self.reader.is_alive()):
+            for line in list(self.lines):
+                match = re.search(r'Listening at (http://[^ ]+)', line)
+                if match:
+                    url = urlparse(match.group(1))
+                    self.host, self.port = url.hostname, url.port
+                    return
+            time.sleep(0.05)
+
+        self.close()
+        raise RuntimeError("The server did not start:\n%s" % ''.join(self.lines))
+
+    def read(self):
+        for line in iter(self.process.stderr.readline, b''):
+            self.lines.append(line.decode('utf-8', 'replace'))
+
+    def request(self, method, path, headers=None, data=None):
+        connection = http_client.HTTPConnection(self.host, self.port, timeout=30)
+        try:
+            connection.request(method, path, body=data, headers=headers or {})
+            response = connection.getresponse()
+            return response.status, dict((name.lower(), value) for name, value in response.getheaders()), \
+                response.read()
+        finally:
+            connection.close()
+
+    def close(self):
+        if self.process.poll() is None:
+            self.process.terminate()
+            self.process.wait()
+        self.reader.join()
+        self.process.stderr.close()
+
+
+def create_users(users):
+    """Add synthetic users up to the given number of users"""
+    from app import db
+    from app.auth.models import User
+    from app.populate import populate
+
+    missing = users - User.query.count()
+    if missing > 0:
+        populate(missing, seed=users)
+    db.session.remove()
+
+
+def create_dataset():
+    """Create the users making the requests and their client, returning
+    their credentials and identifiers"""
+    from app import db
+    from app.auth.models import GrantTypes, User, UserDetails, Application, Client
+
+    run = '%x' % int(time.time() * 1000)
+    users = dict()
+    for name, is_admin in (('user', False), ('admin', True), ('grants', False)):
+        user = User(email='%s.%s@benchmark.example.com' % (name, run), password=PASSWORD, is_admin=is_admin)
+        user.details = UserDetails(name='Benchmark %s' % name, user=user)
+        db.session.add(user)
+        users[name] = user
+
+    application = Application(owner=users['admin'], name='Benchmark')
+    client = Client(app=application, name='Benchmark client',
+                    allowed_grant_types=[GrantTypes.PASSWORD, GrantTypes.REFRESH_TOKEN],
+                    _default_scopes='user', _redirect_uris='http://localhost')
+    db.session.add_all([application, client])
+    db.session.commit()
+
+    dataset = dict(run=run, client_id=client.client_id)
+    dataset.update((name, dict(email=user.email, id=user.username)) for name, user in users.items())
+    db.session.remove()
+    return dataset
+
+
+class Scenarios(object):
+    """The requests of every scenario. Each method prepares the scenario,
+    returning a function that makes its i-th request and returns whether it
+    got the expected status"""
+
+    def __init__(self, client, dataset):
+        self.client = client
+        self.dataset = dataset
+        self.tokens = dict()
+
+    def token(self, name):
+        """Access token of a user of the dataset, logged in only once"""
+        if name not in self.tokens:
+            self.tokens[name] = self.login(name)['access_token']
+        return self.tokens[name]
+
+    def login(self, name):
+        status, headers, body = self.client.request('POST', '/v1/oauth2/token?' + urlencode(dict(
+            client_id=self.dataset['client_id'], grant_type='password',
+            username=self.dataset[name]['email'], password=PASSWORD)))
+        if status != 200:
+            raise RuntimeError("Login failed with status %d: %s" % (status, body))
+        return json.loads(body.decode('utf-8'))
+
+    def authorized(self, name, headers=None):
+        headers = dict(headers or {})
+        headers['Authorization'] = 'Bearer %s' % self.token(name)
+        return headers
+
+    def get_etag(self, path, name):
+        status, headers, body = self.client.request('GET', path, self.authorized(name))
+        return headers['etag']
+
+    def password_grant(self):
+        # Every login replaces the token of the user, so it is not the user of other scenarios
+        def request(i):
+            status, headers, body = self.client.request('POST', '/v1/oauth2/token?' + urlencode(dict(
+                client_id=self.dataset['client_id'], grant_type='password',
+                username=self.dataset['grants']['email'], password=PASSWORD)))
+            return status == 200
+
+        return request
+
+    def refresh_token(self):
+        token = dict(refresh_token=self.login('grants')['refresh_token'])
+
+        def request(i):
+            status, headers, body = self.client.request('POST', '/v1/oauth2/token?' + urlencode(dict(
+                client_id=self.dataset['client_id'], grant_type='refresh_token',
+                refresh_token=token['refresh_token'])))
+            if status != 200:
+                return False
+            # The next request refreshes the new token
+            token['refresh_token'] = json.loads(body.decode('utf-8'))['refresh_token']
+            return True
+
+        return request
+
+    def user_detail(self):
+        path = '/v1/user/%s/' % self.dataset['user']['id']
+        headers = self.authorized('user')
+
+        def request(i):
+            return self.client.request('GET', path, headers)[0] == 200
+
+        return request
+
+    def user_detail_not_modified(self):
+        path = '/v1/user/%s/' % self.dataset['user']['id']
+        headers = self.authorized('user', {'If-None-Match': self.get_etag(path, 'user')})
+
+        def request(i):
+            return self.client.request('GET', path, headers)[0] == 304
+
+        return request
+
+    def user_list(self):
+        headers = self.authorized('admin')
+
+        def request(i):
+            return self.client.request('GET', '/v1/user/', headers)[0] == 200
+
+        return request
+
+    def user_create(self):
+        headers = self.authorized('admin', {'Content-Type': 'application/json'})
+        ids = itertools.count()
+
+        def request(i):
+            data = json.dumps(dict(email='created.%s.%d@benchmark.example.com' % (self.dataset['run'], next(ids)),
+                                   password=PASSWORD, name='Created user', gender='Female'))
+            return self.client.request('POST', '/v1/user/', headers, data)[0] == 201
+
+        return request
+
+    def user_update(self):
+        path = '/v1/user/%s/' % self.dataset['user']['id']
+        etag = dict(value=self.get_etag(path, 'user'))
+
+        def request(i):
+            headers = self.authorized('user', {'Content-Type': 'application/json', 'If-Match': etag['value']})
+            status, headers, body = self.client.request('PUT', path, headers,
+                                                        json.dumps(dict(name='Updated user %d' % i)))
+            if status != 202:
+                return False
+            # The next update matches the new version
+            etag['value'] = headers['etag']
+            return True
+
+        return request
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of the sorted values"""
+    return values[max(int(math.ceil(fraction * len(values))) - 1, 0)]
+
+
+def measure(request, requests, warmup):
+    """Make the requests after the warmup ones, returning the throughput and
+    the latency percentiles (in milliseconds)"""
+    for i in range(warmup):
+        request(-1 - i)
+
+    latencies = []
+    errors = 0
+    start = default_timer()
+    for i in range(requests):
+        sent = default_timer()
+        if not request(i):
+            errors += 1
+        latencies.append(default_timer() - sent)
+    elapsed = default_timer() - start
+
+    latencies.sort()
+    return OrderedDict([
+        ('requests', requests),
+        ('errors', errors),
+        ('throughput', round(requests / elapsed, 2)),
+        ('mean_ms', round(sum(latencies) / requests * 1000, 3)),
+        ('p50_ms', round(percentile(latencies, 0.5) * 1000, 3)),
+        ('p90_ms', round(percentile(latencies, 0.9) * 1000, 3)),
+        ('p99_ms', round(percentile(latencies, 0.99) * 1000, 3)),
+        ('max_ms', round(latencies[-1] * 1000, 3)),
+    ])
+
+
+def compare(results, baseline, tolerance):
+    """Regressions of the results from the baseline results, as tuples of
+    (scenario, metric, baseline value, value). Failed requests are always a
+    regression, the latencies of failed requests are not comparable"""
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if result['errors'] > 0:
+            regressions.append((name, 'errors', base['errors'] if base is not None else 0, result['errors']))
+        if base is None:
+            continue
+
+        for metric in COMPARED:
+            if result[metric] > base[metric] * (1 + tolerance):
+                regressions.append((name, metric, base[metric], result[metric]))
+        if result['throughput'] < base['throughput'] / (1 + tolerance):
+            regressions.append((name, 'throughput', base['throughput'], result['throughput']))
+
+    return regressions
+
+
+def run(app, client, args):
+    results = OrderedDict()
+    with app.app_context():
+        dataset = create_dataset()
+    scenarios = Scenarios(client, dataset)
+
+    def report(name, request):
+        results[name] = result = measure(request, args.requests, args.warmup)
+        print("%-28s %10.1f %10.2f %10.2f %10.2f %10.2f %7d" % (
+            name, result['throughput'], result['mean_ms'], result['p50_ms'], result['p90_ms'], result['p99_ms'],
+            result['errors']))
+        sys.stdout.flush()
+
+    print("%-28s %10s %10s %10s %10s %10s %7s" % ('scenario', 'req/s', 'mean (ms)', 'p50 (ms)', 'p90 (ms)',
+                                                   'p99 (ms)', 'errors'))
+
+    # The list returns every user, so it is measured before the other scenarios add users
+    for size in sorted(args.sizes):
+        with app.app_context():
+            create_users(size)
+        report('user_list_%d' % size, scenarios.user_list())
+
+    with app.app_context():
+        create_users(args.users)
+
+    for name in ('password_grant', 'refresh_token', 'user_detail', 'user_detail_not_modified', 'user_update',
+                 'user_create'):
+        report(name, getattr(scenarios, name)())
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--requests', type=int, default=200, help="Requests measured per scenario")
+    parser.add_argument('--warmup', type=int, default=10, help="Requests before measuring each scenario")
+    parser.add_argument('--users', type=int, default=1000, help="Synthetic users in the database")
+    parser.add_argument('--sizes', type=lambda value: [int(size) for size in value.split(',')],
+                        default=[10, 100, 1000], help="Users in the database when listing them")
+    parser.add_argument('--config', default='config.Config')
+    parser.add_argument('--database', default=None, help="Database URI (a temporary SQLite file by default)")
+    parser.add_argument('--server', action='store_true', help="Make the requests to a local server")
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--output', default=None, help="Write the results to this JSON file")
+    parser.add_argument('--baseline', default=None, help="Compare with the results in this JSON file")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="Allowed slowdown from the baseline")
+    args = parser.parse_args()
+
+    from app import create_app, db
+
+    # Results of other modes or configurations are not comparable
+    baseline = None
+    mode = 'server' if args.server else 'test_client'
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+        if (baseline['meta']['mode'], baseline['meta']['config']) != (mode, args.config):
+            parser.error("The baseline was measured with --config %s in %s mode, not %s in %s mode" % (
+                baseline['meta']['config'], baseline['meta']['mode'], args.config, mode))
+
+    directory = None
+    database = args.database
+    if database is None:
+        directory = tempfile.mkdtemp(prefix='benchmark-')
+        database = 'sqlite:///' + os.path.join(directory, 'api.db')
+
+    app = create_app(configuration(args.config, database))
+    with app.app_context():
+        db.create_all()
+
+    client = ServerClient(args.config, database, args.workers, args.threads) if args.server else TestClient(app)
+    try:
+        results = run(app, client, args)
+    finally:
+        client.close()
+        if directory is not None:
+            shutil.rmtree(directory)
+
+    output = OrderedDict([
+        ('meta', OrderedDict([
+            ('time', time.strftime('%Y-%m-%dT%H:%M:%S')),
+            ('mode', mode),
+            ('config', args.config),
+            ('database', app.config.get('SQLALCHEMY_DATABASE_URI').split(':')[0]),
+            ('requests', args.requests),
+            ('users', args.users),
+            ('python', platform.python_version()),
+            ('platform', platform.platform()),
+        ])),
+        ('results', results),
+    ])
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(output, f, indent=2)
+
+    if baseline is not None:
+        regressions = compare(results, baseline['results'], args.tolerance)
+        print("\nCompared with %s (%s, %s)" % (args.baseline, baseline['meta']['time'], baseline['meta']['mode']))
+        for name, metric, before, after in regressions:
+            print("REGRESSION %-28s %-10s %10.2f -> %10.2f%s" % (
+                name, metric, before, after, " (%+.0f%%)" % ((after / before - 1) * 100) if before else ''))
+        if regressions:
+            sys.exit(1)
+        print("No regressions over %d%%" % (args.tolerance * 100))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+"""Benchmark of the per-call overhead of the hot lookups, built with the ORM
+query API on every call (before) and run from the registry of baked queries
+in app.baked (after), against an in-memory SQLite database
+
+    python -m benchmarks.queries [--calls 5000]
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import unicode_literals
+import argparse
+import time
+from datetime import datetime, timedelta
+
+from app import create_app, db
+from app.baked import queries
+from app.auth.models import User, Application, Client, Token
+from app.cache.models import Etag
+
+
+def populate():
+    user = User(email='user@example.com', password='secret')
+    application = Application(owner=user, name='Benchmark')
+    client = Client(app=application, name='Benchmark client')
+    db.session.add_all([user, application, client])
+    db.session.flush()
+
+    token = Token(access_token='access', refresh_token='refresh', token_type='Bearer', _scopes='user',
+                  expires=datetime.utcnow() + timedelta(hours=1), client_id=client.client_id, user_id=user.id)
+    db.session.add_all([token, Etag(uri='/v1/user/%s/' % user.username, value='etag')])
+    db.session.commit()
+
+    return user, client
+
+
+def timed(fn, calls):
+    session = db.session()
+    start = time.time()
+    for i in range(calls):
+        fn()
+        # Do not answer from the identity map
+        session.expunge_all()
+
+    return (time.time() - start) / calls
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--calls', type=int, default=5000)
+    args = parser.parse_args()
+
+    app = create_app('config.TestingConfig')
+    with app.app_context():
+        db.create_all()
+        user, client = populate()
+        username, email, client_id = user.username, user.email, client.client_id
+        uri = '/v1/user/%s/' % username
+
+        lookups = (
+            ('load_token',
+             lambda: Token.query.filter_by(access_token='access').first(),
+             lambda: queries.run('token_by_access_token', access_token='access').first()),
+            ('load_client',
+             lambda: Client.query.filter_by(client_id=client_id).first(),
+             lambda: queries.run('client_by_id', client_id=client_id).first()),
+            ('get_etag',
+             lambda: Etag.query.get(uri),
+             lambda: queries.run('etag').get(uri)),
+            ('authenticate',
+             lambda: User.query.filter(db.or_(User.email == email, User.username == email)).first(),
+             lambda: queries.run('user_by_login', login=email).first()),
+            ('load_user',
+             lambda: User.query.filter_by(username=username).first(),
+             lambda: queries.run('user_by_username', username=username).first()),
+        )
+
+        print('%-14s %12s %12s %8s' % ('lookup', 'query (us)', 'baked (us)', 'speedup'))
+        for name, query, baked in lookups:
+            assert query() is not None and baked() is not None
+            before = timed(query, args.calls)
+            after = timed(baked, args.calls)
+            print('%-14s %12.1f %12.1f %7.2fx' % (name, before * 1e6, after * 1e6, before / after))
+
+        db.drop_all()
+
+
+if __name__ == '__main__':
+    main()
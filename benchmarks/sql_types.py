@@ -0,0 +1,91 @@
+"""Benchmark of the bind and result processing of the custom column types in
+app.sql, per dialect, and of a bulk insert and select of the rows in an
+in-memory SQLite database
+
+    python -m benchmarks.sql_types [--rows 100000]
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import unicode_literals
+import argparse
+import random
+import time
+import uuid
+
+from sqlalchemy import create_engine, Table, Column, Integer, MetaData, select
+from sqlalchemy.dialects import postgresql, sqlite
+
+from app.sql import ChoiceType, StringListType, UUID
+from app.constants import Genders, GrantTypes
+
+
+def timed(fn, *args):
+    start = time.time()
+    fn(*args)
+    return time.time() - start
+
+
+def sample(rows):
+    grant_types = list(GrantTypes)
+    return [dict(id=i,
+                 client_id=uuid.uuid4().hex,
+                 gender=random.choice(list(Genders)),
+                 grant_types=random.sample(grant_types, random.randint(1, len(grant_types))))
+            for i in range(rows)]
+
+
+def processors(type_, dialect):
+    impl = type_.dialect_impl(dialect)
+    return impl.bind_processor(dialect), impl.result_processor(dialect, None)
+
+
+def bench_processors(data):
+    types = (
+        ('client_id', UUID()),
+        ('gender', ChoiceType(Genders)),
+        ('grant_types', StringListType(GrantTypes)),
+    )
+
+    for dialect in (sqlite.dialect(), postgresql.psycopg2.dialect()):
+        for column, type_ in types:
+            bind, result = processors(type_, dialect)
+            values = [row[column] for row in data]
+
+            bind_time = timed(lambda: [bind(v) for v in values]) if bind else 0.0
+            stored = [bind(v) for v in values] if bind else values
+            result_time = timed(lambda: [result(v) for v in stored]) if result else 0.0
+
+            print('%-10s %-16s bind %8.1f ms  result %8.1f ms' % (
+                dialect.name, type_.__class__.__name__, bind_time * 1000, result_time * 1000))
+
+
+def bench_roundtrip(data):
+    engine = create_engine('sqlite://')
+    table = Table('clients', MetaData(),
+                  Column('id', Integer, primary_key=True),
+                  Column('client_id', UUID),
+                  Column('gender', ChoiceType(Genders)),
+                  Column('grant_types', StringListType(GrantTypes)))
+    table.create(engine)
+
+    with engine.connect() as connection:
+        insert_time = timed(connection.execute, table.insert(), data)
+        select_time = timed(lambda: connection.execute(select([table])).fetchall())
+
+    print('%-10s %-16s insert %6.1f ms  select %6.1f ms' % (
+        'sqlite', 'roundtrip', insert_time * 1000, select_time * 1000))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--rows', type=int, default=100000)
+    args = parser.parse_args()
+
+    data = sample(args.rows)
+    print('%d rows' % args.rows)
+    bench_processors(data)
+    bench_roundtrip(data)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+"""Benchmark of the startup time of a worker: importing the app package,
+creating the application with create_app() and serving the first request,
+each measured in a new interpreter
+
+    python -m benchmarks.startup [--runs 10] [--config config.TestingConfig] [--top 15]
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import unicode_literals
+import argparse
+import os
+import subprocess
+import sys
+from collections import OrderedDict
+
+STAGES = OrderedDict([
+    ('import', 'import app'),
+    ('create_app', 'import app; app.create_app({config!r})'),
+    ('first_request', 'import app; app.create_app({config!r}).test_client().get("/")'),
+])
+
+TIMED = 'import time; start = time.time(); {statement}; print(time.time() - start)'
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run(statement, *options):
+    return subprocess.check_output([sys.executable] + list(options) + ['-c', statement],
+                                   cwd=ROOT, stderr=subprocess.PIPE)
+
+
+def timed(statement, runs):
+    """Seconds taken by the statement in each run"""
+    return sorted(float(run(TIMED.format(statement=statement)).decode().strip().splitlines()[-1])
+                  for i in range(runs))
+
+
+def slowest_imports(statement, top):
+    """Modules with the highest cumulative import time (in seconds), from python -X importtime"""
+    process = subprocess.Popen([sys.executable, '-X', 'importtime', '-c', statement], cwd=ROOT,
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    _, err = process.communicate()
+
+    imports = []
+    for line in err.decode().splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, module = line.split('|')
+        name = module.strip()
+        # Only the modules imported directly by the statement or the application
+        if module.startswith('  ') and not name.startswith('app'):
+            continue
+        imports.append((int(cumulative) / 1e6, name))
+
+    return sorted(imports, reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--config', default='config.TestingConfig')
+    parser.add_argument('--top', type=int, default=0, help="Show the modules slowest to import")
+    args = parser.parse_args()
+
+    print("%-16s %12s %12s" % ('stage', 'min (ms)', 'median (ms)'))
+    for name, statement in STAGES.items():
+        times = timed(statement.format(config=args.config), args.runs)
+        print("%-16s %12.1f %12.1f" % (name, times[0] * 1000, times[len(times) // 2] * 1000))
+
+    if args.top and sys.version_info >= (3, 7):
+        print("\n%-50s %12s" % ('module', 'cumulative (ms)'))
+        for seconds, module in slowest_imports(STAGES['create_app'].format(config=args.config), args.top):
+            print("%-50s %12.1f" % (module, seconds * 1000))
+
+
+if __name__ == '__main__':
+    main()
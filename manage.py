@@ -1,18 +1,33 @@
 from __future__ import absolute_import
 from __future__ import unicode_literals
+from flask import current_app
 from flask.ext.script import Manager
 from flask.ext.migrate import Migrate, MigrateCommand
-from app import app, db
+from app import create_app, db
 from app.auth.models import User, Grant, Application, Client
 from app.constants import GrantTypes, ResponseTypes
+from app.sql import uuid_columns, convert_uuid_column, string_list_columns, convert_string_list_column
 from six import string_types
 
+import io
+import multiprocessing
+import os
 import sys
+import time
 import getpass
 
-migrate = Migrate(app, db)
+migrate = Migrate()
 
-manager = Manager(app)
+
+def make_app():
+    """The application is created when running a command, not when importing
+    this module, so the workers of the server can create their own"""
+    app = create_app()
+    migrate.init_app(app, db)
+    return app
+
+
+manager = Manager(make_app)
 manager.add_command('db', MigrateCommand)
 
 NewCommand = Manager(usage='Create resources on database')
@@ -136,10 +151,45 @@ def create():
     db.create_all()
 
 
-@MigrateCommand.command
-def populate(sample_data=False):
-    "Populate database with default data"
-    pass
+@MigrateCommand.option('-n', '--users', help="Number of users to generate", dest='users', type=int, default=1000)
+@MigrateCommand.option('-s', '--seed', help="Random seed, the same seed generates the same data", dest='seed',
+                       type=int, default=None)
+@MigrateCommand.option('-b', '--batch-size', help="Users inserted per transaction", dest='batch_size',
+                       type=int, default=10000)
+def populate(users=1000, seed=None, batch_size=10000):
+    "Populate database with synthetic users, applications, clients, tokens and etags"
+    from app.populate import populate as generate
+
+    start = time.time()
+
+    def progress(generated):
+        sys.stdout.write("\r%d/%d users (%.0f users/s)" % (generated, users, generated / (time.time() - start)))
+        sys.stdout.flush()
+
+    counts = generate(users, seed=seed, batch_size=batch_size, progress=progress)
+    print("\nCreated %s in %.1f seconds. The password of the users is 'password'" % (
+        ', '.join('%d %s' % (count, model) for model, count in sorted(counts.items())), time.time() - start))
+
+
+@MigrateCommand.option('-b', '--batch-size', help="Values converted per transaction", dest='batch_size',
+                       type=int, default=1000)
+def uuids(batch_size=1000):
+    "Convert the UUID columns stored as hexadecimal strings to binary"
+    with db.engine.connect() as connection:
+        for table, column in uuid_columns(db.metadata):
+            converted = convert_uuid_column(connection, table, column, batch_size)
+            print("Converted %d values of %s.%s" % (converted, table, column))
+
+
+@MigrateCommand.option('-b', '--batch-size', help="Values converted per transaction", dest='batch_size',
+                       type=int, default=1000)
+def lists(batch_size=1000):
+    "Convert the native string list columns stored as comma-joined strings"
+    with db.engine.connect() as connection:
+        for table, column in string_list_columns(db.metadata):
+            type_ = db.metadata.tables[table].c[column].type
+            converted = convert_string_list_column(connection, table, column, type_, batch_size)
+            print("Converted %d values of %s.%s" % (converted, table, column))
 
 
 def request_user_details():
@@ -248,6 +298,123 @@ def client(app_id=None, client_id=None):
     return "The client with id %s and secret %s has been %s" % (client.id, client.secret, operation)
 
 
+@manager.option('path', help="CSV (with a header line) or NDJSON file with the users")
+@manager.option('-f', '--format', help="Format of the file (csv or ndjson), by default given by its extension",
+                dest='format', default=None)
+@manager.option('-b', '--batch-size', help="Users inserted per transaction", dest='batch_size', type=int, default=1000)
+@manager.option('-p', '--processes', help="Processes hashing passwords", dest='processes', type=int, default=None)
+@manager.option('-c', '--checkpoint', help="File storing the progress, to resume an interrupted import",
+                dest='checkpoint', default=None)
+def import_users(path, format=None, batch_size=1000, processes=None, checkpoint=None):
+    """Import users from a CSV or NDJSON file. Each row has email, password
+    (or an existing sha256_crypt password_hash), name, url, bio, born and gender"""
+    from app.auth.importer import import_users as run_import
+
+    start = time.time()
+
+    def progress(checkpoint):
+        sys.stdout.write("\r%d rows, %d users imported, %d failed (%.0f rows/s)" % (
+            checkpoint.rows, checkpoint.imported, checkpoint.failed, checkpoint.rows / (time.time() - start)))
+        sys.stdout.flush()
+
+    def errors(number, message):
+        sys.stderr.write("\nRow %d: %s\n" % (number, message))
+
+    checkpoint = run_import(path, format=format, batch_size=batch_size, processes=processes,
+                            checkpoint=checkpoint, progress=progress, errors=errors)
+    print("\nImported %d users in %.1f seconds" % (checkpoint.imported, time.time() - start))
+
+
+@manager.option('-f', '--format', help="Format of the export (ndjson or csv)", dest='format', default='ndjson')
+@manager.option('-o', '--output', help="Output file, by default the standard output", dest='output', default=None)
+def export_users(format='ndjson', output=None):
+    """Export all the users with their details, with the fields of the user resource"""
+    from app.auth.export import export_users as run_export
+    from app.auth.views import UserResource
+
+    stream = io.open(output, 'w', encoding='utf-8', newline='') if output else sys.stdout
+    try:
+        for line in run_export(UserResource.aliases, format, current_app.config.get('EXPORT_BATCH_SIZE')):
+            stream.write(line)
+    finally:
+        if output:
+            stream.close()
+
+
+ProfilesCommand = Manager(usage='Inspect the profiles of requests')
+manager.add_command('profiles', ProfilesCommand)
+
+
+@ProfilesCommand.option('-e', '--endpoint', help="Only profiles of the endpoint", dest='endpoint', default=None)
+def ls(endpoint=None):
+    """List the captured profiles, newest first"""
+    from app.profiling import list_profiles
+
+    for profile in list_profiles(current_app.config.get('PROFILE_DIR')):
+        if endpoint is None or profile['endpoint'] == endpoint:
+            print("%s  %6dms  %-6s %-30s %s" % (profile['time'].strftime('%Y-%m-%d %H:%M:%S'), profile['latency'],
+                                                profile['method'], profile['endpoint'], profile['name']))
+
+
+@ProfilesCommand.option('names', nargs='*', help="Profiles to summarize, by default all the profiles of the endpoint")
+@ProfilesCommand.option('-e', '--endpoint', help="Summarize all the profiles of the endpoint", dest='endpoint',
+                        default=None)
+@ProfilesCommand.option('-s', '--sort', help="Sort key (cumulative, tottime, calls...)", dest='sort',
+                        default='cumulative')
+@ProfilesCommand.option('-n', '--limit', help="Number of functions shown", dest='limit', type=int, default=30)
+def show(names=None, endpoint=None, sort='cumulative', limit=30):
+    """Summarize profiles, adding their stats"""
+    from app.profiling import list_profiles, summarize
+
+    directory = current_app.config.get('PROFILE_DIR')
+    if not names:
+        names = [p['name'] for p in list_profiles(directory) if endpoint is None or p['endpoint'] == endpoint]
+    if not names:
+        return "No profiles found in %s" % directory
+
+    print(summarize([os.path.join(directory, name) for name in names], sort=sort, limit=limit))
+
+
+@manager.option('-H', '--host', help="Address to listen at", dest='host', default='127.0.0.1')
+@manager.option('-p', '--port', help="Port to listen at", dest='port', type=int, default=5000)
+@manager.option('-w', '--workers', help="Worker processes", dest='workers', type=int, default=None)
+@manager.option('-t', '--threads', help="Threads per worker", dest='threads', type=int, default=None)
+@manager.option('--max-requests', help="Requests served by a worker before it is replaced", dest='max_requests',
+                type=int, default=None)
+@manager.option('--max-requests-jitter', help="Random requests added to --max-requests per worker",
+                dest='max_requests_jitter', type=int, default=None)
+@manager.option('--graceful-timeout', help="Seconds the workers have to finish their requests when stopping",
+                dest='graceful_timeout', type=int, default=None)
+@manager.option('--no-preload', help="Create the application in every worker, instead of before forking",
+                dest='preload', action='store_false', default=None)
+def serve(host='127.0.0.1', port=5000, workers=None, threads=None, max_requests=None, max_requests_jitter=None,
+          graceful_timeout=None, preload=None):
+    """Run the pre-forking multi-process server. Send SIGHUP to restart the
+    workers gracefully, and SIGTERM to stop"""
+    from app.server import Arbiter
+
+    def setting(value, name):
+        return value if value is not None else current_app.config.get(name)
+
+    workers = setting(workers, 'SERVER_WORKERS') or 2 * multiprocessing.cpu_count()
+    preload = setting(preload, 'SERVER_PRELOAD')
+
+    # Metrics of previous runs
+    current_app.extensions['metrics'].clear()
+
+    arbiter = Arbiter(create_app, host=host, port=port, workers=workers,
+                      threads=setting(threads, 'SERVER_THREADS'),
+                      max_requests=setting(max_requests, 'SERVER_MAX_REQUESTS'),
+                      max_requests_jitter=setting(max_requests_jitter, 'SERVER_MAX_REQUESTS_JITTER'),
+                      graceful_timeout=setting(graceful_timeout, 'SERVER_GRACEFUL_TIMEOUT'),
+                      preload=preload, max_boot_failures=current_app.config.get('SERVER_MAX_BOOT_FAILURES'))
+
+    # The application of the command is already created
+    if preload:
+        arbiter.app = current_app._get_current_object()
+    arbiter.run()
+
+
 @manager.command
 def passwd(email):
     """Change a user password"""
@@ -1,6 +1,26 @@
 from __future__ import absolute_import
 from __future__ import unicode_literals
 
+from .access_log import AccessLogTestCase
+from .admission import AdmissionTestCase
 from .auth import OAuthTestCase
+from .batch import BatchTestCase
 from .cache import CacheTestCase
+from .compress import CompressTestCase
+from .export import ExportTestCase
+from .factory import FactoryTestCase
+from .importer import ImportTestCase
+from .internal import InternalTestCase
+from .logs import LogsTestCase
+from .memory import MemoryTestCase
+from .metrics import MetricsTestCase
+from .pool import PoolTestCase
+from .populate import PopulateTestCase
+from .profiling import ProfilingTestCase
+from .queries import QueriesTestCase
+from .replica import ReplicaTestCase
+from .server import ServerTestCase
+from .sql import SqlTypesTestCase
+from .tracing import TracingTestCase
 from .user import UserTestCase
+from .warmup import WarmupTestCase
@@ -0,0 +1,104 @@
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+from .base import BaseTestCase, app
+from app.access_log import AccessLog
+from app.auth.models import Client
+from app.query_stats import Queries
+from oauthlib.common import Request
+from flask import Response, json, request
+
+import logging
+
+
+class AccessLogTestCase(BaseTestCase):
+    """Unit tests for the structured access log"""
+
+    __test__ = True
+
+    def setUp(self):
+        super(AccessLogTestCase, self).setUp()
+        self.access_log = AccessLog()
+        self.access_log.app = app
+        self.access_log.logger = logging.getLogger('tests.access_log')
+
+    def test_entry(self):
+        with app.test_request_context('/v1/oauth2/token', method='POST', data={'client_id': 'abc'}):
+            entry = self.access_log.entry(Response('{}', 304), 0.0125, 1.0)
+
+        assert entry.get('status') == 304
+        assert entry.get('not_modified')
+        assert entry.get('latency') == 12.5
+        assert entry.get('bytes') == 2
+        assert entry.get('client_id') == 'abc'
+        assert entry.get('method') == 'POST'
+        assert 'body' not in entry
+
+        # Serializable as a JSON line
+        assert json.loads(json.dumps(entry)) == entry
+
+    def test_sql_time(self):
+        with app.test_request_context('/v1/user/'):
+            request.oauth = Request('/v1/user/')
+            request.oauth.client = Client.query.first()
+            request.queries = Queries()
+            request.queries.record('SELECT 1', 0.002)
+
+            entry = self.access_log.entry(Response('{}'), 0.1, 1.0)
+
+        assert entry.get('sql_count') == 1
+        assert entry.get('sql_time') == 2.0
+        assert entry.get('client_id') == self.client.get('id')
+
+    def test_sampling(self):
+        app.config['ACCESS_LOG_SAMPLE_RATE'] = 0.1
+        try:
+            assert self.access_log.sample_rate(200, 0.01) == 0.1
+            assert self.access_log.sample_rate(304, 0.01) == 0.1
+
+            # Slow responses and errors are always logged
+            assert self.access_log.sample_rate(200, 10) == 1.0
+            assert self.access_log.sample_rate(404, 0.01) == 1.0
+            assert self.access_log.sample_rate(500, 0.01) == 1.0
+        finally:
+            app.config['ACCESS_LOG_SAMPLE_RATE'] = 1.0
+
+    def test_body(self):
+        app.config['ACCESS_LOG_BODY'] = 10
+        try:
+            # Recorded as the application reads it
+            with app.test_request_context('/v1/user/', method='POST', data=b'x' * 100):
+                self.access_log.before_request()
+                assert len(request.get_data()) == 100
+                assert self.access_log.entry(Response('{}'), 0.1, 1.0).get('body') == 'x' * 10
+
+            # Otherwise only the first bytes are read
+            with app.test_request_context('/v1/user/', method='POST', data=b'y' * 100):
+                self.access_log.before_request()
+                assert self.access_log.entry(Response('{}'), 0.1, 1.0).get('body') == 'y' * 10
+                assert len(request.stream.read()) == 90
+        finally:
+            app.config['ACCESS_LOG_BODY'] = 0
+
+    def test_uncaught_exception(self):
+        entries = []
+        handler = logging.Handler()
+        handler.emit = lambda record: entries.append(json.loads(record.getMessage()))
+        self.access_log.logger.addHandler(handler)
+        self.access_log.logger.setLevel(logging.INFO)
+        app.config['TESTING'] = False
+        try:
+            with app.test_request_context('/v1/user/'):
+                self.access_log.before_request()
+                self.access_log.teardown_request(ValueError('failed'))
+
+            # Requests that were logged are not logged again
+            with app.test_request_context('/v1/user/'):
+                self.access_log.before_request()
+                self.access_log.after_request(Response('{}'))
+                self.access_log.teardown_request(ValueError('failed'))
+        finally:
+            app.config['TESTING'] = True
+            self.access_log.logger.removeHandler(handler)
+
+        assert [(e.get('status'), e.get('error')) for e in entries] == [(500, 'ValueError'), (200, None)]
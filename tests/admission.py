@@ -0,0 +1,88 @@
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+from .base import BaseTestCase, app
+from app.admission import Limiter, PRIORITY_CONDITIONAL, PRIORITY_WRITE, admission
+
+import threading
+import time
+
+
+class AdmissionTestCase(BaseTestCase):
+    """Unit tests for admission control"""
+
+    __test__ = True
+
+    def setUp(self):
+        super(AdmissionTestCase, self).setUp()
+        admission.limiters.clear()
+
+    def tearDown(self):
+        admission.limiters.clear()
+        super(AdmissionTestCase, self).tearDown()
+
+    def test_rejection(self):
+        status, token = self.login(self.client.get('id'), self.user.get('email'), self.user.get('password'))
+        assert token.get('access_token', None)
+
+        app.config['ADMISSION_LIMITS'] = {'read': dict(max_in_flight=0)}
+        rv = self.get('/v1/user/%s/' % self.user.get('id'), token.get('access_token'))
+
+        assert rv.status_code == 503
+        assert rv.headers.get('Retry-After') == '1'
+        assert admission.stats().get('read').get('rejected') == 1
+
+        # Other endpoint classes are not affected
+        status, token = self.login(self.client.get('id'), self.user.get('email'), self.user.get('password'))
+        assert status == 200
+
+    def test_oauth_rejection(self):
+        app.config['ADMISSION_LIMITS'] = {'oauth': dict(max_in_flight=0)}
+        app.config['ADMISSION_REJECT_STATUS'] = 429
+
+        status, data = self.login(self.client.get('id'), self.user.get('email'), self.user.get('password'))
+        assert status == 429
+
+    def test_priority(self):
+        limiter = Limiter(1, max_queue=1, timeout=5)
+        assert limiter.acquire()
+
+        results = dict()
+
+        def request(name, priority):
+            results[name] = limiter.acquire(priority)
+
+        write = threading.Thread(target=request, args=('write', PRIORITY_WRITE))
+        write.start()
+        while limiter.queued < 1:
+            time.sleep(0.001)
+
+        # The queue is full, the conditional request displaces the write
+        conditional = threading.Thread(target=request, args=('conditional', PRIORITY_CONDITIONAL))
+        conditional.start()
+        write.join()
+        assert results.get('write') is False
+
+        # A new write cannot displace the conditional request
+        assert not limiter.acquire(PRIORITY_WRITE)
+
+        limiter.release()
+        conditional.join()
+        assert results.get('conditional') is True
+        assert limiter.stats() == dict(in_flight=1, queued=0, admitted=2, rejected=2)
+
+    def test_classes(self):
+        status, token = self.login(self.client.get('id'), self.user.get('email'), self.user.get('password'))
+
+        # A saturated class does not affect the requests of the others
+        app.config['ADMISSION_LIMITS'] = {'read': dict(max_in_flight=1), 'write': dict(max_in_flight=1)}
+        limiter = admission.limiter('write')
+        assert limiter.acquire(PRIORITY_WRITE)
+        try:
+            rv = self.get('/v1/user/%s/' % self.user.get('id'), token.get('access_token'))
+            assert rv.status_code == 200
+        finally:
+            limiter.release()
+
+        assert admission.stats().get('read') == dict(in_flight=0, queued=0, admitted=1, rejected=0)
+        assert admission.stats().get('write').get('admitted') == 1
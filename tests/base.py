@@ -2,10 +2,12 @@ from __future__ import absolute_import
 from __future__ import unicode_literals
 
 from flask import json
-from app import app, db
+from app import create_app, db
+from app.query_stats import query_stats
 from app.auth.models import GrantTypes, User, UserDetails, Application, Client
 
 import unittest
+from contextlib import contextmanager
 
 try:
     # Python 3
@@ -14,6 +16,8 @@ except:
     # Python 2.7
     import urllib
 
+app = create_app('config.TestingConfig')
+
 
 class BaseTestCase(unittest.TestCase):
     __test__ = False
@@ -48,11 +52,11 @@ class BaseTestCase(unittest.TestCase):
         # Load testing configuration
         app.config.from_object('config.TestingConfig')
         self.app = app.test_client()
-        db.create_all()
 
         # Initialize the request context
         self.context = app.test_request_context()
         self.context.push()
+        db.create_all()
 
         # load data
         if (populate):
@@ -95,6 +99,7 @@ class BaseTestCase(unittest.TestCase):
         self.client['id'] = client.client_id
 
     def tearDown(self):
+        db.session.remove()
         db.drop_all(bind=None)
         self.context.pop()
 
@@ -145,3 +150,15 @@ class BaseTestCase(unittest.TestCase):
     def delete(self, uri, access_token, **params):
         """Perform an authenticated DELETE request using the given access_token"""
         return self.app.delete(uri, **self._prepare(access_token, **params))
+
+    @contextmanager
+    def assert_max_queries(self, count):
+        """Check that the block executes at most count SQL statements"""
+        # Requests share the session of the test context, start with an
+        # empty one as every request does outside of the tests
+        db.session.remove()
+        with query_stats.capture() as queries:
+            yield queries
+
+        assert queries.count <= count, "%d SQL statements executed, at most %d expected:\n%s" % (
+            queries.count, count, '\n'.join('%d times: %s' % (c, shape) for shape, c in queries.shapes.most_common()))
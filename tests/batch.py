@@ -0,0 +1,83 @@
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+from .base import BaseTestCase, app
+from flask import json
+
+
+class BatchTestCase(BaseTestCase):
+    """Unit tests for batch requests"""
+
+    __test__ = True
+
+    def batch(self, requests, access_token):
+        rv = self.post('/v1/batch', access_token, data=json.dumps(requests))
+        return rv.status_code, json.loads(rv.data)
+
+    def test_batch(self):
+        status, token = self.login(self.client.get('id'),
+                                   self.user.get('email'),
+                                   self.user.get('password'),
+                                   scopes=['user'])
+        assert token.get('access_token', None)
+
+        uri = '/v1/user/%s/' % self.user.get('id')
+        status, data = self.batch([dict(method='GET', path=uri),
+                                   dict(method='GET', path='/v1/user/'),
+                                   dict(method='GET', path='/does/not/exist/')], token.get('access_token'))
+        assert status == 200
+
+        results = data.get('objects')
+        assert [r.get('status') for r in results] == [200, 401, 404]
+        assert results[0].get('body').get('email') == self.user.get('email')
+
+        # Conditional headers are honored by sub-requests
+        etag = results[0].get('headers').get('ETag')
+        assert etag
+
+        status, data = self.batch([dict(path=uri, headers={'If-None-Match': etag}),
+                                   dict(method='PUT', path=uri, headers={'If-Match': etag},
+                                        body=dict(name='Batch name'))], token.get('access_token'))
+        results = data.get('objects')
+        assert [r.get('status') for r in results] == [304, 202]
+        assert results[1].get('body').get('name') == 'Batch name'
+
+    def test_batch_hooks(self):
+        status, token = self.login(self.client.get('id'),
+                                   self.user.get('email'),
+                                   self.user.get('password'),
+                                   scopes=['user'])
+
+        # The after_request hooks run for every sub-request
+        app.config['SQL_STATS_HEADERS'] = True
+        try:
+            status, data = self.batch([dict(path='/v1/user/%s/' % self.user.get('id'))], token.get('access_token'))
+        finally:
+            app.config['SQL_STATS_HEADERS'] = None
+
+        headers = data.get('objects')[0].get('headers')
+        assert int(headers.get('X-Query-Count')) > 0
+
+    def test_batch_compression(self):
+        status, token = self.login(self.client.get('id'),
+                                   self.admin.get('email'),
+                                   self.admin.get('password'))
+
+        # Sub-requests asking for gzip get the plain body
+        min_size = app.config.get('COMPRESS_MIN_SIZE')
+        app.config['COMPRESS_MIN_SIZE'] = 0
+        try:
+            status, data = self.batch([dict(path='/v1/user/', headers={'Accept-Encoding': 'gzip'})],
+                                      token.get('access_token'))
+        finally:
+            app.config['COMPRESS_MIN_SIZE'] = min_size
+
+        assert status == 200
+        result = data.get('objects')[0]
+        assert result.get('status') == 200
+        assert 'Content-Encoding' not in result.get('headers')
+        assert len(result.get('body').get('objects')) == 3
+
+    def test_batch_unauthenticated(self):
+        status, data = self.batch([dict(path='/v1/user/%s/' % self.user.get('id'))], 'not a token')
+        assert status == 401
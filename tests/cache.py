@@ -3,7 +3,12 @@ from __future__ import unicode_literals
 
 from .base import BaseTestCase
 from flask import json
-from app.restful import PreconditionFailed, PreconditionRequired
+from app import api
+from app.auth.views import UserResource
+from app.restful import PreconditionFailed, PreconditionRequired, SingleFlight
+
+import threading
+import time
 
 
 class CacheTestCase(BaseTestCase):
@@ -98,3 +103,89 @@ class CacheTestCase(BaseTestCase):
 
         data = json.loads(rv.data)
         assert data.get('email', None) == self.user.get('email')
+
+    def test_single_flight(self):
+        flights = SingleFlight()
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+
+        def compute():
+            calls.append(1)
+            started.set()
+            release.wait()
+            return 'response'
+
+        results = []
+        leader = threading.Thread(target=lambda: results.append(flights.do('key', compute)))
+        leader.start()
+        started.wait()
+
+        followers = [threading.Thread(target=lambda: results.append(flights.do('key', compute))) for i in range(3)]
+        for t in followers:
+            t.start()
+
+        # Wait until every follower is waiting for the leader
+        while flights.coalesced < 3:
+            time.sleep(0.001)
+        release.set()
+
+        for t in [leader] + followers:
+            t.join()
+
+        assert len(calls) == 1
+        assert results == ['response'] * 4
+        assert flights.stats() == dict(executed=1, coalesced=3)
+
+    def test_coalesced_gets(self):
+        status, token = self.login(self.client.get('id'), self.user.get('email'), self.user.get('password'))
+        uri = '/v1/user/%s/' % self.user.get('id')
+
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+        detail = UserResource.detail
+
+        def blocking_detail(resource, pk):
+            calls.append(pk)
+            started.set()
+            release.wait()
+            return detail(resource, pk)
+
+        UserResource.detail = blocking_detail
+        self.addCleanup(setattr, UserResource, 'detail', detail)
+        self.addCleanup(release.set)
+
+        responses = []
+
+        def get():
+            rv = self.get(uri, token.get('access_token'))
+            responses.append((rv.status_code, rv.headers.get('ETag'), json.loads(rv.data)))
+
+        leader = threading.Thread(target=get)
+        leader.start()
+        started.wait()
+
+        # One at a time, the followers share the database connection
+        coalesced = api.flights.stats().get('coalesced')
+        followers = []
+        for i in range(3):
+            follower = threading.Thread(target=get)
+            follower.start()
+            followers.append(follower)
+
+            deadline = time.time() + 5
+            while api.flights.stats().get('coalesced') < coalesced + i + 1:
+                assert time.time() < deadline, "The request was not coalesced"
+                time.sleep(0.001)
+        release.set()
+
+        for t in [leader] + followers:
+            t.join()
+
+        # Computed once, the same response for every request
+        assert calls == [self.user.get('id')]
+        assert len(responses) == 4
+        assert all(response == responses[0] for response in responses)
+        assert responses[0][0] == 200
+        assert responses[0][2].get('email') == self.user.get('email')
@@ -0,0 +1,88 @@
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+from .base import BaseTestCase, app
+from flask import json
+from app.cache.compress import compress
+
+import gzip
+import io
+
+
+class CompressTestCase(BaseTestCase):
+    """Unit tests for response compression"""
+
+    __test__ = True
+
+    def setUp(self):
+        super(CompressTestCase, self).setUp()
+
+        # Compress every response for the tests
+        app.config['COMPRESS_MIN_SIZE'] = 0
+        compress.cache.clear()
+
+        status, token = self.login(self.client.get('id'), self.admin.get('email'), self.admin.get('password'))
+        self.access_token = token.get('access_token')
+
+    def decompress(self, data):
+        return gzip.GzipFile(fileobj=io.BytesIO(data)).read()
+
+    def test_gzip(self):
+        rv = self.get('/v1/user/', self.access_token, headers={'Accept-Encoding': 'gzip'})
+
+        assert rv.status_code == 200
+        assert rv.headers.get('Content-Encoding') == 'gzip'
+        assert 'Accept-Encoding' in rv.headers.get('Vary')
+
+        data = json.loads(self.decompress(rv.data).decode())
+        assert data.get('objects', None)
+
+    def test_not_accepted(self):
+        rv = self.get('/v1/user/', self.access_token, headers={'Accept-Encoding': 'identity'})
+
+        assert rv.status_code == 200
+        assert rv.headers.get('Content-Encoding', None) is None
+        assert 'Accept-Encoding' in rv.headers.get('Vary')
+
+        data = json.loads(rv.data)
+        assert data.get('objects', None)
+
+    def test_min_size(self):
+        app.config['COMPRESS_MIN_SIZE'] = 1024 * 1024
+        rv = self.get('/v1/user/', self.access_token, headers={'Accept-Encoding': 'gzip'})
+
+        assert rv.status_code == 200
+        assert rv.headers.get('Content-Encoding', None) is None
+
+    def test_cached_variant(self):
+        uri = '/v1/user/%s/' % self.user.get('id')
+        rv = self.get(uri, self.access_token, headers={'Accept-Encoding': 'gzip'})
+        assert rv.headers.get('Content-Encoding') == 'gzip'
+        assert compress.cache.misses == 1
+
+        # The same body with the same etag reuses the compressed variant
+        second = self.get(uri, self.access_token, headers={'Accept-Encoding': 'gzip'})
+        assert compress.cache.hits == 1
+        assert second.headers['ETag'] == rv.headers['ETag']
+        assert second.data == rv.data
+
+    def test_etag(self):
+        uri = '/v1/user/%s/' % self.user.get('id')
+        plain = self.get(uri, self.access_token, headers={'Accept-Encoding': 'identity'})
+        etag = plain.headers['ETag'].strip('"')
+
+        # The compressed representation has its own validator
+        rv = self.get(uri, self.access_token, headers={'Accept-Encoding': 'gzip'})
+        assert rv.headers['ETag'] == '"%s-gzip"' % etag
+
+        # Which is accepted as the one of the resource
+        rv = self.get(uri, self.access_token, headers={'Accept-Encoding': 'gzip', 'If-None-Match': rv.headers['ETag']})
+        assert rv.status_code == 304
+        assert rv.headers['ETag'] == '"%s-gzip"' % etag
+        assert 'Accept-Encoding' in rv.headers.get('Vary')
+
+        rv = self.get(uri, self.access_token, headers={'Accept-Encoding': 'identity',
+                                                       'If-None-Match': plain.headers['ETag']})
+        assert rv.status_code == 304
+        assert rv.headers['ETag'] == plain.headers['ETag']
+        assert 'Accept-Encoding' in rv.headers.get('Vary')
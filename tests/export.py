@@ -0,0 +1,63 @@
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+from .base import BaseTestCase, app
+from flask import json
+
+from app import db
+from app.auth.export import export_users
+from app.auth.views import UserResource
+
+
+class ExportTestCase(BaseTestCase):
+    """Unit tests for the streaming user export"""
+
+    __test__ = True
+
+    def test_export_by_user(self):
+        status, token = self.login(self.client.get('id'), self.user.get('email'), self.user.get('password'))
+        rv = self.get('/v1/export/user', token.get('access_token'))
+        assert rv.status_code == 401
+
+    def test_export_ndjson(self):
+        status, token = self.login(self.client.get('id'), self.admin.get('email'), self.admin.get('password'))
+        rv = self.get('/v1/export/user', token.get('access_token'))
+        assert rv.status_code == 200
+        assert rv.mimetype == 'application/x-ndjson'
+        assert rv.is_streamed
+
+        users = [json.loads(line) for line in rv.get_data(as_text=True).splitlines()]
+        assert len(users) == 3
+
+        # Same representation as the user resource
+        detail = json.loads(self.get('/v1/user/%s/' % self.admin.get('id'), token.get('access_token')).data)
+        assert detail in users
+
+    def test_export_csv(self):
+        status, token = self.login(self.client.get('id'), self.admin.get('email'), self.admin.get('password'))
+        rv = self.get('/v1/export/user?format=csv', token.get('access_token'))
+        assert rv.status_code == 200
+
+        lines = rv.get_data(as_text=True).splitlines()
+        assert len(lines) == 4
+        header = lines[0].split(',')
+        assert 'email' in header and 'name' in header
+        assert self.user.get('email') in lines[1]
+
+        rv = self.get('/v1/export/user?format=xml', token.get('access_token'))
+        assert rv.status_code == 400
+
+    def test_batches(self):
+        with app.test_request_context():
+            lines = export_users(UserResource.aliases, 'csv', batch_size=1)
+            assert 'email' in next(lines)
+
+            # Only the batches are read from a replica, not the queries run
+            # while the lines are consumed
+            values = []
+            for value in lines:
+                assert getattr(db._local, 'read_only', 0) == 0
+                values.append(value)
+
+        assert len(values) == 3
+        assert len(set(values)) == 3
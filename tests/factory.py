@@ -0,0 +1,43 @@
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+from .base import BaseTestCase, app
+from app import create_app
+from app.tracing import tracer
+from config import TestingConfig
+
+import os
+import shutil
+import tempfile
+
+
+class FactoryTestCase(BaseTestCase):
+    """Unit tests for applications created with different configurations"""
+
+    __test__ = True
+
+    def test_configurations(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+
+        class Config(TestingConfig):
+            SQL_STATS_HEADERS = False
+            TRACING_FILE = os.path.join(directory, 'trace.json')
+
+        other = create_app(Config)
+        create_app(Config)
+
+        # Every application uses its own configuration in its requests
+        rv = self.app.get('/')
+        assert rv.status_code == 200
+        assert 'X-Query-Count' in rv.headers
+
+        rv = other.test_client().get('/')
+        assert rv.status_code == 200
+        assert 'X-Query-Count' not in rv.headers
+
+        # Only the other applications trace to the file, with a single exporter
+        assert app.config.get('TRACING_FILE') is None
+        assert list(tracer.files) == [Config.TRACING_FILE]
+        with open(Config.TRACING_FILE) as f:
+            assert f.read().count('"name": "request"') == 1
@@ -0,0 +1,96 @@
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+from .base import BaseTestCase
+from app.auth.models import User, hash_password, password_hashing
+from app.auth.importer import import_users
+from app.auth import bulk
+from passlib.hash import sha256_crypt
+
+import io
+import json
+import os
+import shutil
+import tempfile
+
+
+class ImportTestCase(BaseTestCase):
+    """Unit tests for the bulk user import"""
+
+    __test__ = True
+
+    def setUp(self):
+        super(ImportTestCase, self).setUp()
+        self.directory = tempfile.mkdtemp()
+        self.errors = []
+
+    def tearDown(self):
+        super(ImportTestCase, self).tearDown()
+        shutil.rmtree(self.directory)
+
+    def write(self, name, content):
+        path = os.path.join(self.directory, name)
+        with io.open(path, 'w', encoding='utf-8') as f:
+            f.write(content)
+        return path
+
+    def run_import(self, path, **kwargs):
+        return import_users(path, batch_size=2, errors=lambda number, message: self.errors.append(number), **kwargs)
+
+    def test_import_csv(self):
+        path = self.write('users.csv', '\n'.join([
+            'email,password,name,gender,born',
+            'ana@example.com,secret,Ana,Female,1990-02-03',
+            'pedro@example.com,secret,Pedro,Male,',
+            'nopassword@example.com,,No Password,,',
+            '%s,secret,Duplicated,,' % self.user.get('email'),
+            'diego@example.com,secret,Diego,Other,',
+            'maria@example.com,secret,Maria,,1985-13-01',
+        ]))
+
+        checkpoint = self.run_import(path)
+        assert checkpoint.rows == 6
+        assert checkpoint.imported == 2
+        assert self.errors == [3, 4, 5, 6]
+
+        user = User.query.filter(User.email == 'ana@example.com').first()
+        assert user.details.name == 'Ana'
+        assert user.details.gender == 'Female'
+        assert user.details.born.year == 1990
+        assert user.check_password('secret')
+
+    def test_import_ndjson_resume(self):
+        rows = [dict(email='user%d@example.com' % i, password='secret') for i in range(5)]
+        rows.append(dict(email='hashed@example.com', password_hash=hash_password('other')))
+        path = self.write('users.ndjson', '\n'.join(json.dumps(row) for row in rows) + '\nnot json\n')
+        checkpoint_path = os.path.join(self.directory, 'checkpoint.json')
+
+        # The first two rows were imported before the interruption
+        self.write('checkpoint.json', json.dumps(dict(rows=2, imported=2, failed=0)))
+        checkpoint = self.run_import(path, checkpoint=checkpoint_path)
+
+        assert checkpoint.rows == 7
+        assert checkpoint.imported == 6
+        assert self.errors == [7]
+        assert User.query.filter(User.email == 'user0@example.com').first() is None
+        assert User.query.filter(User.email == 'user2@example.com').first() is not None
+        assert User.query.filter(User.email == 'hashed@example.com').first().check_password('other')
+
+        with io.open(checkpoint_path, encoding='utf-8') as f:
+            assert json.load(f).get('rows') == 7
+
+    def test_hash_pool(self):
+        passwords = ['one', 'two', 'three']
+        before = sum(password_hashing.values.get(('hash', ), [0])[:-1])
+        hashed = bulk.hash_passwords(passwords, processes=2)
+        assert all(sha256_crypt.verify(p, h) for p, h in zip(passwords, hashed))
+
+        # The time hashing in the pool is recorded by this process
+        assert sum(password_hashing.values.get(('hash', ))[:-1]) == before + 3
+        pool = bulk._get_pool(2)
+        assert pool._processes == 2
+
+        # A different size gets a new pool
+        bulk.hash_passwords(passwords, processes=3)
+        assert bulk._get_pool(3) is not pool
+        assert bulk._get_pool(3)._processes == 3
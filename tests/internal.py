@@ -0,0 +1,41 @@
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+from .base import BaseTestCase, app
+from flask import json
+
+
+class InternalTestCase(BaseTestCase):
+    """Unit tests for the internal endpoints"""
+
+    __test__ = True
+
+    def test_restricted(self):
+        rv = self.app.get('/internal/pool', environ_base={'REMOTE_ADDR': '10.0.0.1'})
+        assert rv.status_code == 404
+
+        rv = self.app.get('/internal/pool', environ_base={'REMOTE_ADDR': '10.0.0.1'},
+                          headers={'X-Internal-Token': 'wrong token'})
+        assert rv.status_code == 404
+
+    def test_token(self):
+        rv = self.app.get('/internal/pool', environ_base={'REMOTE_ADDR': '10.0.0.1'},
+                          headers={'X-Internal-Token': app.config.get('INTERNAL_TOKEN')})
+        assert rv.status_code == 200
+
+    def test_pool(self):
+        rv = self.app.get('/internal/pool')
+        assert rv.status_code == 200
+
+        data = json.loads(rv.data)
+        assert data.get('checkouts') > 0
+        assert data.get('connects') > 0
+        assert len(data.get('pools')) == 1
+
+    def test_logs(self):
+        rv = self.app.get('/internal/logs')
+        assert rv.status_code == 200
+
+        data = json.loads(rv.data)
+        assert data.get('capacity') > 0
+        assert data.get('dropped') == 0
@@ -0,0 +1,75 @@
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+from app.logs import QueueHandler, QueueListener, QueueLogging
+from flask import Flask
+
+import logging
+import unittest
+from six.moves import queue
+
+
+class ListHandler(logging.Handler):
+    def __init__(self):
+        super(ListHandler, self).__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+class LogsTestCase(unittest.TestCase):
+    """Unit tests for the queue based logging"""
+
+    def setUp(self):
+        self.logger = logging.getLogger('tests.logs')
+        self.logger.setLevel(logging.INFO)
+        self.logger.propagate = False
+
+    def tearDown(self):
+        self.logger.handlers = []
+
+    def test_listener(self):
+        records = queue.Queue(10)
+        handler = ListHandler()
+        listener = QueueListener(records)
+        listener.add('logs', handler)
+        self.logger.addHandler(QueueHandler(records, 'logs'))
+        listener.start()
+
+        try:
+            raise ValueError('error')
+        except ValueError:
+            self.logger.exception('Failed %s', 'request')
+        self.logger.info('Logged %d', 1)
+
+        # Pending records are written when stopping
+        listener.stop()
+        assert [r.getMessage() for r in handler.records] == ['Failed request', 'Logged 1']
+        assert 'ValueError' in handler.records[0].exc_text
+
+    def test_full_queue(self):
+        records = queue.Queue(2)
+        queue_handler = QueueHandler(records, 'logs')
+        self.logger.addHandler(queue_handler)
+
+        # Requests are not blocked when the listener falls behind
+        for i in range(5):
+            self.logger.info('Record %d', i)
+
+        assert records.qsize() == 2
+        assert queue_handler.dropped == 3
+
+    def test_reinitialized(self):
+        logs = QueueLogging()
+        for i in range(2):
+            logs.init_app(Flask(__name__))
+            handler = ListHandler()
+
+            # Flask removes the handlers of the logger of a new application
+            self.logger.handlers = []
+            logs.add_handler(self.logger, handler)
+
+        self.logger.info('Logged')
+        logs.listener.stop()
+        assert [r.getMessage() for r in handler.records] == ['Logged']
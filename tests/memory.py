@@ -0,0 +1,115 @@
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+from .base import BaseTestCase, app
+from app.memory import memory
+from flask import json
+
+import os
+import unittest
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+
+@unittest.skipIf(not memory.available, "tracemalloc is not available")
+class MemoryTestCase(BaseTestCase):
+    """Unit tests for the memory allocation profiling"""
+
+    __test__ = True
+
+    def setUp(self):
+        super(MemoryTestCase, self).setUp()
+        self.addCleanup(memory.stop)
+
+        status, data = self.login(self.client.get('id'), self.admin.get('email'), self.admin.get('password'))
+        assert status == 200
+        self.token = data.get('access_token')
+
+    def test_admin(self):
+        status, data = self.login(self.client.get('id'), self.user.get('email'), self.user.get('password'))
+        assert status == 200
+
+        rv = self.get('/internal/memory', data.get('access_token'))
+        assert rv.status_code == 401
+        rv = self.app.post('/internal/memory/start')
+        assert rv.status_code == 401
+        assert not memory.tracing
+
+    def test_snapshots(self):
+        rv = self.post('/internal/memory/snapshots', self.token)
+        assert rv.status_code == 409
+
+        rv = self.post('/internal/memory/start', self.token)
+        assert rv.status_code == 200
+        assert json.loads(rv.data).get('tracing')
+
+        rv = self.post('/internal/memory/snapshots', self.token)
+        assert rv.status_code == 200
+        first = json.loads(rv.data).get('id')
+
+        retained = [bytearray(1024) for i in range(1000)]
+
+        rv = self.post('/internal/memory/snapshots', self.token)
+        second = json.loads(rv.data).get('id')
+        assert first == '%d-1' % os.getpid() and second == '%d-2' % os.getpid()
+
+        rv = self.get('/internal/memory/diff?from=%s&to=%s&limit=5' % (first, second), self.token)
+        assert rv.status_code == 200
+        diff = json.loads(rv.data).get('diff')
+        assert any('tests/memory.py' in d['traceback'][0] and d['size_diff'] >= 1024 * 1000 for d in diff)
+        del retained
+
+        rv = self.get('/internal/memory/top?snapshot=%s&key=filename' % second, self.token)
+        assert rv.status_code == 200
+        assert len(json.loads(rv.data).get('top')) > 0
+
+        rv = self.get('/internal/memory/diff?from=%d-100' % os.getpid(), self.token)
+        assert rv.status_code == 404
+
+        # Snapshots of other processes
+        rv = self.get('/internal/memory/top?snapshot=%d-1' % (os.getpid() + 1), self.token)
+        assert rv.status_code == 404
+        assert 'belongs to the process %d' % (os.getpid() + 1) in json.loads(rv.data).get('error')
+
+        # A new worker process does not keep the snapshots of its parent
+        memory.after_fork()
+        rv = self.post('/internal/memory/snapshots', self.token)
+        assert json.loads(rv.data).get('id') == first
+
+        # Missing or invalid snapshot ids
+        rv = self.get('/internal/memory/diff', self.token)
+        assert rv.status_code == 400
+        rv = self.get('/internal/memory/diff?from=last', self.token)
+        assert rv.status_code == 400
+        rv = self.get('/internal/memory/diff?from=%s&to=1' % first, self.token)
+        assert rv.status_code == 400
+
+    def test_endpoints(self):
+        app.config['MEMORY_SAMPLE_RATE'] = 1.0
+        memory.start()
+
+        rv = self.get('/v1/user/', self.token)
+        assert rv.status_code == 200
+
+        rv = self.get('/internal/memory', self.token)
+        assert rv.status_code == 200
+        stats = json.loads(rv.data)
+        assert stats.get('current') > 0
+        assert stats.get('pid') == os.getpid()
+        assert stats.get('endpoints').get('api_user_list').get('requests') == 1
+        assert stats.get('endpoints').get('api_user_list').get('max') > 0
+
+    def test_concurrent_requests(self):
+        # The sampled requests do not reset the peak of the process
+        memory.start()
+        allocated = bytearray(1024 * 1000)
+        del allocated
+        current, peak = tracemalloc.get_traced_memory()
+
+        app.config['MEMORY_SAMPLE_RATE'] = 1.0
+        rv = self.get('/v1/user/', self.token)
+        assert rv.status_code == 200
+        assert tracemalloc.get_traced_memory()[1] >= peak
@@ -0,0 +1,86 @@
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+from .base import BaseTestCase
+from app.metrics import Metrics, Registry
+
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+
+class MetricsTestCase(BaseTestCase):
+    """Unit tests for the metrics"""
+
+    __test__ = True
+
+    def sample(self, text, name):
+        """Value of the sample with the given name (and labels)"""
+        for line in text.splitlines():
+            if line.startswith(name + ' '):
+                return float(line.split(' ')[-1])
+        return None
+
+    def metrics(self):
+        rv = self.app.get('/internal/metrics')
+        assert rv.status_code == 200
+        assert rv.mimetype == 'text/plain'
+        return rv.data.decode('utf-8')
+
+    def test_requests(self):
+        status, data = self.login(self.client.get('id'), self.user.get('email'), self.user.get('password'))
+        assert status == 200
+
+        uri = '/v1/user/%s/' % self.user.get('id')
+        rv = self.get(uri, data.get('access_token'))
+        assert rv.status_code == 200
+        rv = self.get(uri, data.get('access_token'), headers={'If-None-Match': rv.headers.get('ETag')})
+        assert rv.status_code == 304
+
+        text = self.metrics()
+        assert '# TYPE http_request_duration_seconds histogram' in text
+        assert self.sample(text, 'http_requests_total{endpoint="api_user_detail",method="GET",status="304"}') >= 1
+        assert self.sample(text, 'http_request_duration_seconds_count{endpoint="api_user_detail",method="GET"}') >= 2
+        assert self.sample(text, 'api_get_responses_total{endpoint="api_user_detail",status="304",'
+                                 'conditional="True"}') >= 1
+        assert self.sample(text, 'etag_lookups_total{result="hit"}') >= 1
+        assert self.sample(text, 'oauth_token_lookups_total{token="access",result="valid"}') >= 2
+        assert self.sample(text, 'password_hash_seconds_count{operation="verify"}') >= 1
+        assert self.sample(text, 'db_pool_in_use') is not None
+
+    def test_processes(self):
+        registry = Registry()
+        counter = registry.counter('jobs', 'Jobs', ['kind'])
+        gauge = registry.gauge('queued', 'Queued jobs')
+        histogram = registry.histogram('job_seconds', 'Job time', buckets=(1, 2))
+
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        metrics = Metrics(registry=registry)
+        metrics.directory = directory
+
+        # A process that exited
+        process = subprocess.Popen([sys.executable, '-c', 'pass'])
+        process.wait()
+        with open(metrics.path(process.pid), 'w') as f:
+            json.dump({'jobs': [[['a'], 2]], 'queued': [[[], 7]], 'job_seconds': [[[], [1, 0, 0, 0.5]]]}, f)
+
+        counter.inc(kind='a')
+        counter.inc(kind='b')
+        gauge.set(3)
+        histogram.observe(1.5)
+        text = metrics.expose()
+
+        assert self.sample(text, 'jobs_total{kind="a"}') == 3
+        assert self.sample(text, 'jobs_total{kind="b"}') == 1
+        assert self.sample(text, 'job_seconds_bucket{le="1.0"}') == 1
+        assert self.sample(text, 'job_seconds_bucket{le="2.0"}') == 2
+        assert self.sample(text, 'job_seconds_bucket{le="+Inf"}') == 2
+        assert self.sample(text, 'job_seconds_sum') == 2.0
+
+        # Gauges only for running processes
+        assert self.sample(text, 'queued{pid="%d"}' % os.getpid()) == 3
+        assert self.sample(text, 'queued{pid="%d"}' % process.pid) is None
@@ -0,0 +1,69 @@
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+from .base import BaseTestCase, app
+from app import db
+from app.pool import PoolMonitor, TimedQueuePool, checkout_wait
+from sqlalchemy import create_engine
+from sqlalchemy.engine.url import make_url
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+
+class PoolTestCase(BaseTestCase):
+    """Unit tests for the connection pool instrumentation"""
+
+    __test__ = True
+
+    def setUp(self):
+        super(PoolTestCase, self).setUp()
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+
+        self.engine = create_engine('sqlite:///' + os.path.join(directory, 'pool.db'), poolclass=TimedQueuePool,
+                                    pool_size=1, max_overflow=0, pool_timeout=10,
+                                    connect_args={'check_same_thread': False})
+        self.addCleanup(self.engine.dispose)
+        self.monitor = PoolMonitor()
+        self.monitor.attach(self.engine, app)
+
+    def test_checkout_wait(self):
+        held = self.engine.connect()
+
+        # The pool is exhausted, the thread waits for the held connection
+        thread = threading.Thread(target=lambda: self.engine.connect().close())
+        thread.start()
+        time.sleep(0.2)
+        held.close()
+        thread.join()
+
+        stats = self.monitor.wait_stats()
+        assert stats.get('count') == 2
+        assert stats.get('max') >= 0.2
+        assert sum(stats.get('buckets').values()) == 2
+        assert self.monitor.stats().get('checkout_wait') == stats
+
+        # Also in the metrics, by pool
+        counts = checkout_wait.values.get((repr(self.engine.url), ))
+        assert sum(counts[:-1]) == 2 and counts[-1] >= 0.2
+
+    def test_dispose(self):
+        # The recreated pool is still timed
+        self.engine.dispose()
+        assert isinstance(self.engine.pool, TimedQueuePool)
+        self.engine.connect().close()
+        assert self.monitor.wait_stats().get('count') == 1
+
+    def test_pool_class(self):
+        # Engines which would use a QueuePool use the timed one
+        options = {}
+        db.apply_driver_hacks(app, make_url('postgresql://localhost/test'), options)
+        assert options.get('poolclass') is TimedQueuePool
+
+        options = {}
+        db.apply_driver_hacks(app, make_url('sqlite://'), options)
+        assert options.get('poolclass') is not TimedQueuePool
@@ -0,0 +1,37 @@
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+from .base import BaseTestCase
+from app.auth.models import User, Client, Token
+from app.cache.models import Etag
+from app.populate import Generator, populate
+
+
+class PopulateTestCase(BaseTestCase):
+    """Unit tests for the synthetic data generator"""
+
+    __test__ = True
+
+    def test_populate(self):
+        users = User.query.count()
+        counts = populate(250, seed=1, batch_size=100)
+
+        assert counts['User'] == 250
+        assert counts['Client'] == 3
+        assert User.query.count() == users + 250
+        assert Token.query.count() == 250
+        assert Etag.query.count() == 250
+
+        # The generated users can login with the generated clients
+        user = User.query.order_by(User.id.desc()).first()
+        client = Client.query.filter(Client.name != self.client.get('name'), Client.is_confidential.is_(False)).first()
+        status, token = self.login(client.client_id, user.email, 'password')
+        assert token.get('access_token', None)
+
+    def test_seed(self):
+        def generate(seed):
+            user, details = Generator(seed=seed).user(1, 1)
+            return user['username'], user['email'], details['name'], details['born']
+
+        assert generate(1) == generate(1)
+        assert generate(1) != generate(2)
@@ -0,0 +1,81 @@
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+from .base import BaseTestCase, app
+from app.profiling import list_profiles, summarize
+
+import os
+import shutil
+import sys
+import tempfile
+
+
+class ProfilingTestCase(BaseTestCase):
+    """Unit tests for the profiling of requests"""
+
+    __test__ = True
+
+    def setUp(self):
+        super(ProfilingTestCase, self).setUp()
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        app.config['PROFILE_ENABLED'] = True
+        app.config['PROFILE_DIR'] = self.directory
+
+    def test_admin(self):
+        status, data = self.login(self.client.get('id'), self.admin.get('email'), self.admin.get('password'))
+        assert status == 200
+
+        uri = '/v1/user/%s/' % self.user.get('id')
+        rv = self.get(uri, data.get('access_token'), headers={'X-Profile': '1'})
+        assert rv.status_code == 200
+
+        profiles = list_profiles(self.directory)
+        assert len(profiles) == 1
+        assert profiles[0]['name'] == rv.headers.get('X-Profile')
+        assert profiles[0]['method'] == 'GET'
+        assert profiles[0]['endpoint'] == 'api_user_detail'
+
+        summary = summarize([os.path.join(self.directory, profiles[0]['name'])], limit=10)
+        assert 'handle_etag' in summary
+
+    def test_not_admin(self):
+        status, data = self.login(self.client.get('id'), self.user.get('email'), self.user.get('password'))
+        assert status == 200
+
+        rv = self.get('/v1/user/%s/' % self.user.get('id'), data.get('access_token'), headers={'X-Profile': '1'})
+        assert rv.status_code == 200
+        assert 'X-Profile' not in rv.headers
+        assert list_profiles(self.directory) == []
+
+    def test_sampling(self):
+        app.config['PROFILE_SAMPLE_RATE'] = 1.0
+        app.config['PROFILE_MAX_FILES'] = 2
+        for i in range(3):
+            rv = self.app.get('/internal/pool')
+            assert rv.status_code == 200
+            assert 'X-Profile' in rv.headers
+
+        assert len(list_profiles(self.directory)) == 2
+
+    def test_uncaught_exception(self):
+        app.config['PROFILE_SAMPLE_RATE'] = 1.0
+
+        def fail():
+            raise ValueError('failed')
+
+        pool = app.view_functions['internal.pool']
+        app.view_functions['internal.pool'] = fail
+        try:
+            with self.assertRaises(ValueError):
+                self.app.get('/internal/pool')
+        finally:
+            app.view_functions['internal.pool'] = pool
+
+        # The profiler is disabled, and the next requests are profiled
+        assert sys.getprofile() is None
+        assert list_profiles(self.directory) == []
+
+        rv = self.app.get('/internal/pool')
+        assert rv.status_code == 200
+        assert 'X-Profile' in rv.headers
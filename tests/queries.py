@@ -0,0 +1,104 @@
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+from .base import BaseTestCase, app
+from flask import json
+from sqlalchemy.exc import SQLAlchemyError
+from app import db
+from app.auth.bulk import insert_users
+from app.auth.models import Client
+from app.baked import QueryRegistry, queries
+
+
+class QueriesTestCase(BaseTestCase):
+    """Query budgets of the main endpoints. A failure here means an endpoint
+    now executes more SQL statements, check for an N+1 query pattern"""
+
+    __test__ = True
+
+    def test_token_budget(self):
+        with self.assert_max_queries(6):
+            status, token = self.login(self.client.get('id'), self.user.get('email'), self.user.get('password'))
+        assert token.get('access_token', None)
+
+    def test_user_detail_budget(self):
+        status, token = self.login(self.client.get('id'), self.user.get('email'), self.user.get('password'))
+        uri = '/v1/user/%s/' % self.user.get('id')
+
+        # The first request stores the etag
+        with self.assert_max_queries(6):
+            rv = self.get(uri, token.get('access_token'))
+        assert rv.status_code == 200
+
+        with self.assert_max_queries(4):
+            rv = self.get(uri, token.get('access_token'))
+        assert rv.status_code == 200
+
+        with self.assert_max_queries(4):
+            rv = self.get(uri, token.get('access_token'), headers={'If-None-Match': rv.headers['ETag']})
+        assert rv.status_code == 304
+
+    def test_user_list_budget(self):
+        status, token = self.login(self.client.get('id'), self.admin.get('email'), self.admin.get('password'))
+
+        with self.assert_max_queries(7) as executed:
+            rv = self.get('/v1/user/', token.get('access_token'))
+        assert rv.status_code == 200
+        assert len(json.loads(rv.data).get('objects')) == 3
+        assert not executed.repeated(3)
+
+        # Independent of the number of users
+        insert_users([dict(email='user%d@example.com' % i, name='User %d' % i) for i in range(10)])
+        db.session.commit()
+
+        with self.assert_max_queries(7) as more:
+            rv = self.get('/v1/user/', token.get('access_token'))
+        assert rv.status_code == 200
+        assert len(json.loads(rv.data).get('objects')) == 13
+        assert more.count == executed.count
+
+    def test_failed_statement(self):
+        # The start time of a failed statement is not left behind
+        with db.engine.connect() as connection:
+            with self.assertRaises(SQLAlchemyError):
+                connection.execute('SELECT * FROM does_not_exist')
+            assert not connection.info.get('query_start')
+
+    def test_headers(self):
+        status, token = self.login(self.client.get('id'), self.user.get('email'), self.user.get('password'))
+        uri = '/v1/user/%s/' % self.user.get('id')
+
+        app.config['SQL_STATS_HEADERS'] = True
+        try:
+            with self.assert_max_queries(6) as executed:
+                rv = self.get(uri, token.get('access_token'))
+        finally:
+            app.config['SQL_STATS_HEADERS'] = None
+
+        assert int(rv.headers['X-Query-Count']) == executed.count
+        assert float(rv.headers['X-Query-Time']) >= 0
+
+    def test_registry(self):
+        user = queries.run('user_by_login', login=self.user.get('email')).first()
+        assert user.email == self.user.get('email')
+        assert queries.run('user_by_username', username=self.user.get('id')).first() is user
+        assert queries.run('user_by_login', login='nobody').first() is None
+
+        # The query is built once, the following calls only bind the parameters
+        built = []
+
+        def client_query(session):
+            built.append('query')
+            return session.query(Client)
+
+        def by_id(query):
+            built.append('filter')
+            return query.filter(Client.client_id == db.bindparam('client_id'))
+
+        registry = QueryRegistry()
+        registry.register('client_by_id', client_query, by_id)
+        assert registry.run('client_by_id', client_id=self.client.get('id')).first().name == self.client.get('name')
+        with self.assert_max_queries(1):
+            assert registry.run('client_by_id', client_id=self.client.get('id')).first() is not None
+        assert registry.run('client_by_id', client_id='0' * 32).first() is None
+        assert built == ['query', 'filter']
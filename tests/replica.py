@@ -0,0 +1,80 @@
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+from .base import BaseTestCase, app
+from flask import json
+from app import db
+
+import os
+import shutil
+import sqlite3
+import tempfile
+
+
+class ReplicaTestCase(BaseTestCase):
+    """Unit tests for the routing of read-only queries to replicas, using
+    two SQLite files as primary and replica databases"""
+
+    __test__ = True
+
+    def setUp(self):
+        super(ReplicaTestCase, self).setUp(populate=False)
+
+        self.directory = tempfile.mkdtemp()
+        self.primary = os.path.join(self.directory, 'primary.db')
+        self.replica = os.path.join(self.directory, 'replica.db')
+
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + self.primary
+        app.config['SQLALCHEMY_REPLICA_URIS'] = ['sqlite:///' + self.replica]
+        db.create_all()
+        self.populate()
+        db.session.remove()
+
+        # Forget the writes of previous tests
+        db._writes.clear()
+
+        # Replicate
+        shutil.copy(self.primary, self.replica)
+
+    def tearDown(self):
+        super(ReplicaTestCase, self).tearDown()
+        app.config['SQLALCHEMY_REPLICA_URIS'] = []
+        shutil.rmtree(self.directory)
+
+    def update_replica(self, sql):
+        connection = sqlite3.connect(self.replica)
+        connection.execute(sql)
+        connection.commit()
+        connection.close()
+
+    def test_read_your_writes(self):
+        # The new token is only in the primary database
+        status, token = self.login(self.client.get('id'), self.user.get('email'), self.user.get('password'))
+        assert token.get('access_token', None)
+
+        self.update_replica("UPDATE user_details SET name = 'Replica name'")
+
+        # Reads come from the replica
+        uri = '/v1/user/%s/' % self.user.get('id')
+        rv = self.get(uri, token.get('access_token'))
+        assert rv.status_code == 200
+        assert json.loads(rv.data).get('name') == 'Replica name'
+
+        # Storing the etag of a GET is not a write of the client
+        rv = self.get(uri, token.get('access_token'))
+        assert json.loads(rv.data).get('name') == 'Replica name'
+
+        # After an update, the user reads from the primary database
+        rv = self.get(uri, token.get('access_token'))
+        rv = self.put(uri, token.get('access_token'), headers={'If-Match': rv.headers['ETag']},
+                      data=json.dumps(dict(bio='Updated')))
+        assert rv.status_code == 202
+
+        rv = self.get(uri, token.get('access_token'))
+        assert json.loads(rv.data).get('name') == self.user.get('name')
+        assert json.loads(rv.data).get('bio') == 'Updated'
+
+        # Other clients still read from the replica
+        status, token = self.login(self.client.get('id'), self.admin.get('email'), self.admin.get('password'))
+        rv = self.get(uri, token.get('access_token'))
+        assert json.loads(rv.data).get('name') == 'Replica name'
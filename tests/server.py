@@ -0,0 +1,138 @@
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+import os
+import re
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+from six.moves.urllib.request import urlopen
+
+SERVE = '''
+import config
+from app import create_app
+from app.server import Arbiter
+from flask import current_app
+
+class Config(config.TestingConfig):
+    APPLICATION_LOG = %r
+    WARMUP_ENABLED = True
+
+def factory():
+    if %r:
+        raise RuntimeError('The application cannot be created')
+    app = create_app(Config)
+    app.add_url_rule('/log', 'log', lambda: current_app.logger.warning('Logged by the worker') or 'Logged')
+    return app
+
+# The arbiter has an application, as in manage.py
+create_app(Config)
+Arbiter(factory, port=0, workers=2, threads=2, max_requests=%d, graceful_timeout=5, preload=%r,
+        max_boot_failures=4).run()
+'''
+
+
+@unittest.skipIf(not hasattr(os, 'fork'), "The server requires fork")
+class ServerTestCase(unittest.TestCase):
+    """Unit tests for the pre-forking server"""
+
+    def serve(self, max_requests=0, preload=True, fail=False):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.log = os.path.join(directory, 'application.log')
+
+        self.process = subprocess.Popen([sys.executable, '-c', SERVE % (self.log, fail, max_requests, preload)],
+                                        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                        stderr=subprocess.PIPE)
+        self.addCleanup(self.kill)
+
+        self.lines = []
+        self.reader = threading.Thread(target=self.read)
+        self.reader.daemon = True
+        self.reader.start()
+
+        match = self.wait_for(r'Listening at (http://[^ ]+)')
+        self.url = match.group(1)
+
+    def read(self):
+        for line in iter(self.process.stderr.readline, b''):
+            self.lines.append(line.decode('utf-8', 'replace'))
+
+    def wait_for(self, pattern, timeout=20):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            for line in list(self.lines):
+                match = re.search(pattern, line)
+                if match:
+                    return match
+            time.sleep(0.05)
+        raise AssertionError("'%s' not found in the output:\n%s" % (pattern, ''.join(self.lines)))
+
+    def kill(self):
+        if self.process.poll() is None:
+            self.process.kill()
+            self.process.wait()
+        self.reader.join()
+        self.process.stderr.close()
+
+    def get(self, path='/'):
+        response = urlopen(self.url + path, timeout=10)
+        return response.getcode(), response.read()
+
+    def stop(self):
+        self.process.send_signal(signal.SIGTERM)
+        self.process.wait()
+        assert self.process.returncode == 0
+
+    def test_serve(self):
+        self.serve(max_requests=2)
+        self.wait_for(r'Worker ready in')
+
+        for i in range(6):
+            assert self.get() == (200, b'IT WORKS!!')
+
+        # Workers are replaced after two requests
+        self.wait_for(r'Worker \d+ exited with status 0')
+        assert self.get() == (200, b'IT WORKS!!')
+
+        self.stop()
+        assert 'Shutting down' in ''.join(self.lines)
+
+    def test_restart(self):
+        self.serve(preload=False)
+        assert self.get() == (200, b'IT WORKS!!')
+
+        self.process.send_signal(signal.SIGHUP)
+        self.wait_for('Restarting the workers')
+        self.wait_for(r'Worker \d+ exited with status 0')
+        assert self.get() == (200, b'IT WORKS!!')
+
+        self.stop()
+
+    def test_logs(self):
+        # Workers creating their application in the process of the arbiter's
+        self.serve(preload=False)
+        assert self.get('/log') == (200, b'Logged')
+        self.stop()
+
+        with open(self.log) as f:
+            assert 'Logged by the worker' in f.read()
+
+    def test_boot_failures(self):
+        # Workers failing to create their application are replaced with a backoff
+        self.serve(preload=False, fail=True)
+        self.wait_for(r'Worker \d+ failed to boot \(1 consecutive failures\), retrying in 0.2 seconds')
+        self.wait_for(r'failed to boot \(2 consecutive failures\), retrying in 0.4 seconds')
+
+        # Until the arbiter gives up
+        self.wait_for('Shutting down, the workers failed to boot 4 times')
+        self.process.wait()
+        assert self.process.returncode == 3
+        assert 'exited with status' not in ''.join(self.lines)
+        assert ''.join(self.lines).count('RuntimeError: The application cannot be created') == 4
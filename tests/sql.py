@@ -0,0 +1,170 @@
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+from app.sql import ChoiceType, StringListType, UUID, uuid_columns, convert_uuid_column, \
+    string_list_columns, convert_string_list_column
+from app.constants import Genders, GrantTypes
+
+import unittest
+import uuid
+from sqlalchemy import create_engine, Table, Column, Integer, String, MetaData, select
+from sqlalchemy.dialects import postgresql, sqlite
+
+
+class SqlTypesTestCase(unittest.TestCase):
+    """Unit tests for the custom column types"""
+
+    def setUp(self):
+        self.sqlite = sqlite.dialect()
+        self.postgresql = postgresql.psycopg2.dialect()
+
+    def processors(self, type_, dialect):
+        impl = type_.dialect_impl(dialect)
+        return impl.bind_processor(dialect) or (lambda v: v), \
+            impl.result_processor(dialect, None) or (lambda v: v)
+
+    def test_choice_type(self):
+        bind, result = self.processors(ChoiceType(Genders), self.sqlite)
+        assert bind(Genders.F) == 'F'
+        assert bind('Unknown') is None
+        assert bind(None) is None
+        assert result('M') == Genders.M
+        assert result(None) is None
+
+    def test_string_list_type(self):
+        bind, result = self.processors(StringListType(GrantTypes), self.sqlite)
+        assert bind([GrantTypes.PASSWORD, 'other', GrantTypes.REFRESH_TOKEN]) == 'password,refresh_token'
+        assert bind(None) is None
+        assert result('password,other') == [GrantTypes.PASSWORD]
+        assert result(None) is None
+
+    def test_native_string_list_type(self):
+        type_ = StringListType(GrantTypes, native=True)
+
+        bind, result = self.processors(type_, self.sqlite)
+        assert bind([GrantTypes.REFRESH_TOKEN, 'other']) == 2
+        assert bind([]) == 0
+        assert result(3) == [GrantTypes.PASSWORD, GrantTypes.REFRESH_TOKEN]
+        assert result(None) is None
+
+        bind, result = self.processors(type_, self.postgresql)
+        assert bind([GrantTypes.REFRESH_TOKEN, GrantTypes.PASSWORD]) == [GrantTypes.PASSWORD, GrantTypes.REFRESH_TOKEN]
+        assert result([GrantTypes.REFRESH_TOKEN]) == [GrantTypes.REFRESH_TOKEN]
+
+    def test_string_list_filters(self):
+        engine = create_engine('sqlite://')
+        rows = [[], [GrantTypes.PASSWORD], [GrantTypes.REFRESH_TOKEN], [GrantTypes.PASSWORD, GrantTypes.REFRESH_TOKEN]]
+
+        for native in (True, False):
+            table = Table('t', MetaData(), Column('id', Integer, primary_key=True),
+                          Column('grant_types', StringListType(GrantTypes, native=native)))
+            table.create(engine)
+            engine.execute(table.insert(), [dict(id=i, grant_types=v) for i, v in enumerate(rows)])
+
+            def ids(clause):
+                return [row[0] for row in engine.execute(select([table.c.id]).where(clause).order_by(table.c.id))]
+
+            column = table.c.grant_types
+            assert ids(column.has(GrantTypes.PASSWORD)) == [1, 3]
+            assert ids(column.has_all([GrantTypes.PASSWORD, GrantTypes.REFRESH_TOKEN])) == [3]
+            assert ids(column.has_any([GrantTypes.PASSWORD, GrantTypes.REFRESH_TOKEN])) == [1, 2, 3]
+            assert ids(column.has_any(['other'])) == []
+            assert ids(column.has_all(['other', GrantTypes.PASSWORD])) == []
+            table.drop(engine)
+
+        column = Column('grant_types', StringListType(GrantTypes, native=True))
+        Table('t', MetaData(), column)
+        sql = str(column.has_all([GrantTypes.PASSWORD]).compile(dialect=self.postgresql))
+        assert sql == 't.grant_types @> ARRAY[%(param_1)s]'
+
+    def test_uuid(self):
+        value = uuid.uuid4()
+
+        bind, result = self.processors(UUID(), self.sqlite)
+        assert bind(value) == value.hex
+        assert bind(value.hex) == value.hex
+        assert bind(str(value)) == value.hex
+        assert result(value.hex) == value.hex
+        with self.assertRaises(ValueError):
+            bind('not an uuid')
+
+        bind, result = self.processors(UUID(), self.postgresql)
+        assert bind(value.hex) == value
+        assert result(value) == value.hex
+
+    def test_binary_uuid(self):
+        value = uuid.uuid4()
+
+        bind, result = self.processors(UUID(binary=True), self.sqlite)
+        assert bind(value.hex) == value.bytes
+        assert bind(value) == value.bytes
+        assert result(value.bytes) == value.hex
+
+        # PostgreSQL always uses the native type
+        bind, result = self.processors(UUID(binary=True), self.postgresql)
+        assert bind(value.hex) == value
+
+    def test_convert_uuid_column(self):
+        engine = create_engine('sqlite://')
+        values = [uuid.uuid4().hex for i in range(25)]
+
+        # Existing hexadecimal data
+        Table('t', MetaData(), Column('id', Integer, primary_key=True), Column('uuid', String)).create(engine)
+        engine.execute('INSERT INTO t (uuid) VALUES (?)', [(v, ) for v in values + values[:5]])
+
+        table = Table('t', MetaData(), Column('id', Integer, primary_key=True), Column('uuid', UUID(binary=True)))
+        assert uuid_columns(table.metadata) == [('t', 'uuid')]
+
+        with engine.connect() as connection:
+            assert convert_uuid_column(connection, 't', 'uuid', batch_size=10) == 25
+
+            # Resumable
+            assert convert_uuid_column(connection, 't', 'uuid', batch_size=10) == 0
+
+            rows = connection.execute(select([table.c.uuid]).order_by(table.c.id)).fetchall()
+            assert [row[0] for row in rows] == values + values[:5]
+
+            rows = connection.execute(select([table.c.id]).where(table.c.uuid == values[0])).fetchall()
+            assert len(rows) == 2
+
+    def test_convert_string_list_column(self):
+        engine = create_engine('sqlite://')
+        values = ['password,refresh_token', 'refresh_token', '', None, 'password,other']
+
+        # Existing comma-joined data
+        Table('t', MetaData(), Column('id', Integer, primary_key=True), Column('grant_types', String)).create(engine)
+        engine.execute('INSERT INTO t (grant_types) VALUES (?)', [(v, ) for v in values + values[:2]])
+
+        type_ = StringListType(GrantTypes, native=True)
+        table = Table('t', MetaData(), Column('id', Integer, primary_key=True), Column('grant_types', type_))
+        assert string_list_columns(table.metadata) == [('t', 'grant_types')]
+
+        with engine.connect() as connection:
+            assert convert_string_list_column(connection, 't', 'grant_types', type_, batch_size=2) == 4
+
+            # Resumable
+            assert convert_string_list_column(connection, 't', 'grant_types', type_) == 0
+
+            rows = connection.execute(select([table.c.grant_types]).order_by(table.c.id)).fetchall()
+            assert [row[0] for row in rows] == [[GrantTypes.PASSWORD, GrantTypes.REFRESH_TOKEN],
+                                                [GrantTypes.REFRESH_TOKEN], [], None, [GrantTypes.PASSWORD],
+                                                [GrantTypes.PASSWORD, GrantTypes.REFRESH_TOKEN],
+                                                [GrantTypes.REFRESH_TOKEN]]
+
+            rows = connection.execute(select([table.c.id]).where(table.c.grant_types.has(GrantTypes.PASSWORD)))
+            assert [row[0] for row in rows] == [1, 5, 6]
+
+    def test_literals(self):
+        value = uuid.uuid4()
+        table = Table('t', MetaData(), Column('id', UUID), Column('client_id', UUID(binary=True)),
+                      Column('gender', ChoiceType(Genders)))
+        query = select([table]).where(table.c.id == str(value)).where(table.c.client_id == value) \
+            .where(table.c.gender == Genders.M)
+
+        for dialect in (self.sqlite, self.postgresql):
+            sql = str(query.compile(dialect=dialect, compile_kwargs={'literal_binds': True}))
+            assert "t.id = '%s'" % value.hex in sql
+            assert "t.gender = 'M'" in sql
+
+        sql = str(query.compile(dialect=self.sqlite, compile_kwargs={'literal_binds': True}))
+        assert "t.client_id = X'%s'" % value.hex in sql
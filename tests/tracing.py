@@ -0,0 +1,72 @@
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+from .base import BaseTestCase, app
+from app.tracing import ChromeTraceExporter, tracer
+
+import json
+import logging
+import os
+import shutil
+import tempfile
+
+
+class ListHandler(logging.Handler):
+    def __init__(self):
+        super(ListHandler, self).__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+class TracingTestCase(BaseTestCase):
+    """Unit tests for the tracing of requests"""
+
+    __test__ = True
+
+    def setUp(self):
+        super(TracingTestCase, self).setUp()
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+
+        self.path = os.path.join(directory, 'trace.json')
+        self.exporter = ChromeTraceExporter(self.path)
+        tracer.add_exporter(self.exporter)
+        self.addCleanup(tracer.exporters.remove, self.exporter)
+
+    def events(self):
+        with open(self.path) as f:
+            return json.loads(f.read().rstrip().rstrip(',') + ']')
+
+    def test_export(self):
+        status, data = self.login(self.client.get('id'), self.user.get('email'), self.user.get('password'))
+        assert status == 200
+
+        rv = self.get('/v1/user/%s/' % self.user.get('id'), data.get('access_token'))
+        assert rv.status_code == 200
+
+        events = self.events()
+        request = [e for e in events if e['name'] == 'request' and e['args'].get('endpoint') == 'api_user_detail']
+        assert len(request) == 1
+        assert request[0]['args'].get('status') == 200
+
+        # Spans of the request, in the request
+        spans = [e for e in events if request[0]['ts'] <= e['ts'] <= request[0]['ts'] + request[0]['dur']]
+        names = set(e['name'] for e in spans)
+        for name in ('authenticate', 'token.lookup', 'etag.get', 'UserResource.detail', 'prepare', 'serialize'):
+            assert name in names, name
+
+    def test_slow(self):
+        app.config['TRACING_SLOW'] = 0
+        handler = ListHandler()
+        app.logger.addHandler(handler)
+        self.addCleanup(app.logger.removeHandler, handler)
+
+        rv = self.app.get('/internal/pool')
+        assert rv.status_code == 200
+
+        messages = [r.getMessage() for r in handler.records if r.getMessage().startswith('Slow request')]
+        assert len(messages) == 1
+        assert 'GET /internal/pool' in messages[0]
+        assert 'endpoint=internal.pool' in messages[0]
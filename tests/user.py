@@ -145,3 +145,77 @@ class UserTestCase(BaseTestCase):
             assert False
         except Unauthorized:
             assert True
+
+    def test_bulk_create(self):
+        status, token = self.login(self.client.get('id'),
+                                   self.admin.get('email'),
+                                   self.admin.get('password'))
+        assert token.get('access_token', None)
+
+        rv = self.post('/v1/user/', token.get('access_token'),
+                       data=json.dumps([dict(email='first@test.com', password='abc', name='First'),
+                                        dict(email='second@test.com', password='def', gender='Female'),
+                                        dict(email='third@test.com'),
+                                        dict(email=self.user.get('email'), password='abc'),
+                                        dict(email='first@test.com', password='ghi')]))
+
+        assert rv.status_code == 201
+
+        results = json.loads(rv.data).get('objects')
+        assert [r.get('status') for r in results] == [201, 201, 400, 409, 409]
+        assert results[0].get('object').get('name') == 'First'
+        assert results[1].get('object').get('gender') == 'Female'
+
+        # The etag of every created user is stored
+        uri = '/v1/user/%s/' % results[0].get('object').get('id')
+        rv = self.get(uri, token.get('access_token'),
+                      headers={"If-None-Match": "%s" % results[0].get('etag')})
+        assert rv.status_code == 304
+
+        # The new users can login
+        status, data = self.login(self.client.get('id'), 'second@test.com', 'def')
+        assert status == 200
+
+    def test_bulk_create_by_user(self):
+        status, token = self.login(self.client.get('id'),
+                                   self.user.get('email'),
+                                   self.user.get('password'))
+        assert token.get('access_token', None)
+
+        try:
+            self.post('/v1/user/', token.get('access_token'),
+                      data=json.dumps([dict(email='first@test.com', password='abc')]))
+            assert False
+        except Unauthorized:
+            assert True
+
+    def test_bulk_update(self):
+        status, token = self.login(self.client.get('id'),
+                                   self.admin.get('email'),
+                                   self.admin.get('password'))
+        assert token.get('access_token', None)
+
+        rv = self.get('/v1/user/%s/' % self.user.get('id'), token.get('access_token'))
+        etag = rv.headers.get('ETag')
+
+        rv = self.put('/v1/user/', token.get('access_token'),
+                      data=json.dumps([dict(id=self.user.get('id'), etag=etag, password='abc', bio='Updated'),
+                                       dict(id=self.owner.get('id'), name='No etag'),
+                                       dict(id=self.admin.get('id'), etag='bad_etag', name='Bad etag'),
+                                       dict(id='does_not_exist', etag=etag),
+                                       dict(id=['not', 'a', 'string'], etag=etag)]))
+
+        assert rv.status_code == 202
+
+        results = json.loads(rv.data).get('objects')
+        assert [r.get('status') for r in results] == [202, 428, 412, 404, 400]
+        assert results[0].get('object').get('bio') == 'Updated'
+        assert results[0].get('etag') != etag
+
+        # The old etag is no longer valid
+        rv = self.get('/v1/user/%s/' % self.user.get('id'), token.get('access_token'),
+                      headers={"If-None-Match": "%s" % etag})
+        assert rv.status_code == 200
+
+        status, data = self.login(self.client.get('id'), self.user.get('email'), 'abc')
+        assert status == 200
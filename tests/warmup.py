@@ -0,0 +1,89 @@
+from __future__ import absolute_import
+from __future__ import unicode_literals
+
+from .base import BaseTestCase, app
+from app import db
+from app.query_stats import query_stats
+from app.warmup import warmup
+from app.cache import etag
+from flask import json
+
+import time
+
+
+class WarmupTestCase(BaseTestCase):
+    """Unit tests for the warmup of the processes"""
+
+    __test__ = True
+
+    def setUp(self):
+        super(WarmupTestCase, self).setUp()
+        warmup.after_fork()
+        app.config.update(WARMUP_ENABLED=True)
+        self.addCleanup(app.config.update, WARMUP_ENABLED=False, WARMUP_PRELOAD=False)
+
+    def test_run(self):
+        warmup.run()
+
+        rv = self.app.get('/internal/ready')
+        assert rv.status_code == 200
+
+        data = json.loads(rv.data)
+        assert data.get('ready')
+        assert not data.get('failed')
+        for step in ('mappers', 'templates', 'connections', 'queries', 'total'):
+            assert step in data.get('timings')
+
+    def test_ready(self):
+        # Checks from any address start the warmup in the background
+        app.logger.disabled = True
+        self.addCleanup(setattr, app.logger, 'disabled', False)
+        rv = self.app.get('/internal/ready', environ_base={'REMOTE_ADDR': '10.0.0.1'})
+        assert rv.status_code in (200, 503)
+
+        deadline = time.time() + 10
+        while rv.status_code != 200 and time.time() < deadline:
+            time.sleep(0.05)
+            rv = self.app.get('/internal/ready', environ_base={'REMOTE_ADDR': '10.0.0.1'})
+        assert rv.status_code == 200
+
+        # Other internal endpoints are still restricted
+        rv = self.app.get('/internal/pool', environ_base={'REMOTE_ADDR': '10.0.0.1'})
+        assert rv.status_code == 404
+
+    def test_first_request(self):
+        rv = self.app.get('/')
+        assert rv.status_code == 200
+        assert warmup.ready
+
+    def test_disabled(self):
+        app.config.update(WARMUP_ENABLED=False)
+        rv = self.app.get('/internal/ready')
+        assert rv.status_code == 200
+        assert not warmup.ready
+
+    def test_preload(self):
+        etag.set_etag('/v1/users/1', 'abc')
+        db.session.commit()
+
+        app.config.update(WARMUP_PRELOAD=True)
+        with query_stats.capture() as queries:
+            warmup.run()
+
+        assert warmup.ready
+        assert 'preload' in warmup.timings
+        assert any('FROM etags' in shape for shape in queries.shapes)
+        assert any('FROM clients' in shape for shape in queries.shapes)
+
+    def test_error(self):
+        db.drop_all()
+        app.logger.disabled = True
+        try:
+            warmup.run()
+        finally:
+            app.logger.disabled = False
+
+        # Ready, although cold
+        assert warmup.ready
+        assert warmup.error is not None
+        db.create_all()